@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of per-card filename generation.
+
+Times vcf_names.GetFieldsFilename on synthetic names next to the original
+replace-loop implementation it superseded.
+
+    python -m benchmarks.bench_filenames --count 1000000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import random
+import sys
+import timeit
+
+from vcardtools import vcf_fastparse
+from vcardtools import vcf_names
+
+
+FAMILY = ('Gump', "O'Brien", 'Smith-Jones', 'van der Berg', 'Müller',
+          'Иванов', 'Lee', 'St. John', 'Ng & Co', 'García')
+GIVEN = ('Forrest', 'Jenny', 'Jean-Luc', 'Ann Marie', 'Jörg', '', 'Dan')
+ADDITIONAL = ('', '', '', 'J.', 'Lee+')
+
+
+def LegacyCleanString(s):
+    punc = (' ', '-', '\'', '.', '&amp;', '&', '+', '@')
+    pieces = []
+    for part in s.split():
+        part = part.strip()
+        for p in punc:
+            part = part.replace(p, '_')
+        part = part.strip('_')
+        part = part.lower()
+        pieces.append(part)
+    return '_'.join(pieces)
+
+
+def LegacyIsFileSystemCompatString(input_str, encoding='latin-1'):
+    try:
+        input_str.encode(encoding)
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        return ''
+    return input_str
+
+
+def LegacyGetFieldsFilename(fields, filename_charset='latin-1'):
+    fname_pieces = []
+    for val in (fields.n or ())[:3]:
+        if val and LegacyIsFileSystemCompatString(val, filename_charset):
+            fname_pieces.append(LegacyCleanString(val.lower()))
+    if not fname_pieces and fields.email:
+        fname_pieces.append(LegacyCleanString(fields.email[0].split('@')[0]))
+    if not fname_pieces:
+        raise vcf_names.NameError('no filename')
+    return '{}.vcf'.format('_'.join(fname_pieces))
+
+
+def MakeFields(count, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for idx in range(count):
+        fields = vcf_fastparse.VcardFields()
+        fields.n = (rng.choice(FAMILY), rng.choice(GIVEN) + str(idx % 97),
+                    rng.choice(ADDITIONAL), '', '')
+        fields.email = ['user.{}@example.com'.format(idx)]
+        records.append(fields)
+    return records
+
+
+def TimeFilenames(func, records, charset):
+    def Run():
+        for fields in records:
+            try:
+                func(fields, filename_charset=charset)
+            except vcf_names.NameError:
+                pass
+    return timeit.timeit(Run, number=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_filenames')
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--filename_charset', default='latin-1')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    records = MakeFields(args.count)
+    candidates = (('legacy', LegacyGetFieldsFilename),
+                  ('vcf_names', vcf_names.GetFieldsFilename))
+    # interleaved and best-of, so that noise hits both alike
+    best = {}
+    for _ in range(args.repeat):
+        for label, func in candidates:
+            seconds = TimeFilenames(func, records, args.filename_charset)
+            best[label] = min(best.get(label, seconds), seconds)
+    for label, _ in candidates:
+        seconds = best[label]
+        print('{:<10} {:>8.3f} s total {:>8.0f} ns/card'.format(
+            label, seconds, seconds / args.count * 1e9))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Correctness checks of the vcardtools hot paths.
+
+The benchmarks only time the code, these checks make sure that what is
+timed still gives the right answers, on generated corpora and on small
+cards that broke before:
+
+    python -m benchmarks.check
+
+Every check prints OK or what went wrong, and the exit status is 1 when
+any of them failed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from vcardtools import vcf_dedupe
+from vcardtools import vcf_fastparse
+
+from . import corpus
+
+
+CHECKS = collections.OrderedDict()
+
+
+class CheckError(Exception):
+    pass
+
+
+def Check(name):
+    """Registers a check, a function of a scratch directory that raises
+    CheckError when it fails."""
+    def Register(func):
+        CHECKS[name] = func
+        return func
+    return Register
+
+
+def WriteFile(workdir, name, content):
+    path = os.path.join(workdir, name)
+    with io.open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+    return path
+
+
+def RunMain(module, argv):
+    """Runs the main of a vcardtools command, CheckError if it exits."""
+    parser = argparse.ArgumentParser()
+    module.AddArguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        module.main(args)
+    except SystemExit as e:
+        raise CheckError('{} exited with {}'.format(module.__name__, e.code))
+    finally:
+        if hasattr(args.outfile, 'close'):
+            args.outfile.close()
+
+
+# Two vCard 2.1 cards sharing an email, one with a quoted-printable soft
+# line break, which vobject fails on unless the lines are joined first.
+QP_SOFT_BREAK_CARDS = (
+    'BEGIN:VCARD\r\n'
+    'VERSION:2.1\r\n'
+    'N:Gump;Forrest\r\n'
+    'FN:Forrest Gump\r\n'
+    'EMAIL;INTERNET:forrest@example.com\r\n'
+    'NOTE;ENCODING=QUOTED-PRINTABLE:Stupid is as stupid does and this note '
+    'goes on=\r\n'
+    'over lines\r\n'
+    'END:VCARD\r\n'
+    'BEGIN:VCARD\r\n'
+    'VERSION:2.1\r\n'
+    'N:Gump;Forrest\r\n'
+    'FN:Forrest Gump\r\n'
+    'EMAIL;INTERNET:forrest@example.com\r\n'
+    'TEL;CELL:+1 555 555 1212\r\n'
+    'END:VCARD\r\n')
+
+
+@Check('dedupe.qp_soft_break')
+def CheckDedupeSoftBreak(workdir):
+    infile = WriteFile(workdir, 'qp.vcf', QP_SOFT_BREAK_CARDS)
+    outfile = os.path.join(workdir, 'qp-deduped.vcf')
+    RunMain(vcf_dedupe, ['--outfile', outfile, infile])
+    with io.open(outfile, 'r', encoding='utf-8') as f:
+        content = f.read()
+    if content.count('BEGIN:VCARD') != 1:
+        raise CheckError('expected one merged card, got:\n' + content)
+    if 'over lines' not in content or '555 1212' not in content:
+        raise CheckError('fields lost in the merge:\n' + content)
+
+
+# A card vobject cannot parse, sharing an email with another card.
+BAD_GROUP_CARDS = (
+    'BEGIN:VCARD\r\n'
+    'VERSION:3.0\r\n'
+    'FN:Forrest Gump\r\n'
+    'EMAIL:forrest@example.com\r\n'
+    'this line is not a property\r\n'
+    'END:VCARD\r\n'
+    'BEGIN:VCARD\r\n'
+    'VERSION:3.0\r\n'
+    'FN:Forrest Gump\r\n'
+    'EMAIL:forrest@example.com\r\n'
+    'END:VCARD\r\n'
+    'BEGIN:VCARD\r\n'
+    'VERSION:3.0\r\n'
+    'FN:Jenny Curran\r\n'
+    'EMAIL:jenny@example.com\r\n'
+    'END:VCARD\r\n')
+
+
+@Check('dedupe.bad_group')
+def CheckDedupeBadGroup(workdir):
+    infile = WriteFile(workdir, 'bad.vcf', BAD_GROUP_CARDS)
+    outfile = os.path.join(workdir, 'bad-deduped.vcf')
+    RunMain(vcf_dedupe, ['--outfile', outfile, infile])
+    with io.open(outfile, 'r', encoding='utf-8', newline='') as f:
+        content = f.read()
+    if content != BAD_GROUP_CARDS:
+        raise CheckError('the cards of a group that cannot be merged must '
+                         'be written unchanged, got:\n' + content)
+
+
+# A unique vCard 2.1 card in Latin-1, as old phones export them.
+LEGACY_CHARSET_CARD = (
+    b'BEGIN:VCARD\r\n'
+    b'VERSION:2.1\r\n'
+    b'N;CHARSET=ISO-8859-1:M\xfcller;J\xfcrgen;;;\r\n'
+    b'FN;CHARSET=ISO-8859-1:J\xfcrgen M\xfcller\r\n'
+    b'EMAIL;INTERNET:jm@example.de\r\n'
+    b'END:VCARD\r\n')
+
+
+@Check('dedupe.legacy_charset')
+def CheckDedupeLegacyCharset(workdir):
+    infile = os.path.join(workdir, 'latin1.vcf')
+    with open(infile, 'wb') as f:
+        f.write(LEGACY_CHARSET_CARD)
+    outfile = os.path.join(workdir, 'latin1-deduped.vcf')
+    RunMain(vcf_dedupe, ['--outfile', outfile, infile])
+    with open(outfile, 'rb') as f:
+        content = f.read()
+    if content != LEGACY_CHARSET_CARD:
+        raise CheckError('a unique card must be written byte for byte, '
+                         'got:\n{!r}'.format(content))
+
+
+# Cards the generated corpus has no examples of: quoted-printable soft
+# line breaks, legacy charsets, raw and quoted-printable, and folds in the
+# middle of values.
+PARSER_CARDS = (
+    b'BEGIN:VCARD\r\n'
+    b'VERSION:2.1\r\n'
+    b'N;CHARSET=ISO-8859-1;ENCODING=QUOTED-PRINTABLE:M=FCller;J=FCrgen;;;\r\n'
+    b'FN;CHARSET=ISO-8859-1;ENCODING=QUOTED-PRINTABLE:J=FCrgen M=FCller\r\n'
+    b'EMAIL;INTERNET:jm@example.de\r\n'
+    b'TEL;CELL:+49 30 1234567\r\n'
+    b'END:VCARD',
+    b'BEGIN:VCARD\r\n'
+    b'VERSION:2.1\r\n'
+    b'N;CHARSET=ISO-8859-1:M\xfcller;J\xfcrgen;;;\r\n'
+    b'FN;CHARSET=ISO-8859-1:J\xfcrgen M\xfcller\r\n'
+    b'EMAIL;INTERNET:jm@example.de\r\n'
+    b'END:VCARD',
+    b'BEGIN:VCARD\r\n'
+    b'VERSION:2.1\r\n'
+    b'N;ENCODING=QUOTED-PRINTABLE;CHARSET=WINDOWS-1252:Dubois;Ren=E9;;;\r\n'
+    b'FN;ENCODING=QUOTED-PRINTABLE;CHARSET=WINDOWS-1252:Ren=E9 Dubois=\r\n'
+    b'=20Jr\r\n'
+    b'EMAIL;INTERNET:rene@example.fr\r\n'
+    b'END:VCARD',
+    b'BEGIN:VCARD\r\n'
+    b'VERSION:2.1\r\n'
+    b'N;CHARSET=UTF-8;ENCODING=QUOTED-PRINTABLE:Gump;Forrest;;;\r\n'
+    b'FN;CHARSET=UTF-8;ENCODING=QUOTED-PRINTABLE:Forrest =\r\n'
+    b'Gump =C3=A9t=C3=\r\n'
+    b'=A9\r\n'
+    b'EMAIL;INTERNET:forrest@example.com\r\n'
+    b'END:VCARD',
+    b'BEGIN:VCARD\r\n'
+    b'VERSION:3.0\r\n'
+    b'N:Curran;Jenny;;;\r\n'
+    b'FN:Jenny\r\n'
+    b'  Curran\r\n'
+    b'EMAIL;TYPE=INTERNET:jenny.curran@exa\r\n'
+    b' mple.com\r\n'
+    b'TEL;TYPE=CELL:+1 555\r\n'
+    b'\t 0100\r\n'
+    b'UID:urn:uuid:1234\r\n'
+    b' 5678\r\n'
+    b'END:VCARD',
+)
+
+
+def IterParserCards():
+    """Yields decoded cards of every version, with quoted-printable, folded
+    and base64 values, and PARSER_CARDS."""
+    for base64_21 in (False, True):
+        for card in corpus.GenerateCorpus(1000, seed=1, photo_ratio=0.05,
+                                          photo_bytes=512,
+                                          base64_21=base64_21):
+            yield card
+    for raw in PARSER_CARDS:
+        yield vcf_fastparse.DecodeCard(raw)
+
+
+@Check('fastparse.matches_vobject')
+def CheckFastParser(workdir):
+    differences = []
+    for card in IterParserCards():
+        fast = vcf_fastparse.GetVcardFields(
+            card, vcf_fastparse.PROPERTIES, parser='fast')
+        slow = vcf_fastparse.GetVcardFields(
+            card, vcf_fastparse.PROPERTIES, parser='vobject')
+        if fast != slow:
+            differences.append('{}\n  fast:    {!r}\n  vobject: {!r}'.format(
+                card, fast, slow))
+    if differences:
+        raise CheckError('{} cards parsed differently, the first:\n{}'.format(
+            len(differences), differences[0]))
+
+
+def RunChecks(names):
+    """Runs the named checks, returns the number that failed."""
+    failed = 0
+    for name in names:
+        workdir = tempfile.mkdtemp(prefix='vcardtools-check-')
+        try:
+            CHECKS[name](workdir)
+        except CheckError as e:
+            failed += 1
+            print('{:<30} FAILED: {}'.format(name, e))
+        else:
+            print('{:<30} OK'.format(name))
+        finally:
+            shutil.rmtree(workdir)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='check')
+    parser.add_argument('--only', action='append', choices=list(CHECKS),
+                        help='Run only this check, may be repeated')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    return 1 if RunChecks(args.only or list(CHECKS)) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares two benchmarks.suite result files.
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+
+Exits with status 1 when any benchmark got slower, or used more memory, by
+more than the threshold.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import io
+import json
+import sys
+
+
+def LoadResults(path):
+    with io.open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def Change(old, new):
+    """Relative change from old to new, None when either is missing."""
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def FormatChange(change):
+    return '{:+7.1%}'.format(change) if change is not None else '    n/a'
+
+
+def Compare(old, new, threshold):
+    """Prints a table of both runs; returns the names that regressed."""
+    if old.get('corpus') != new.get('corpus'):
+        print('WARNING: the runs used different corpora, {} vs {}'.format(
+            old.get('corpus'), new.get('corpus')))
+    print('{:<22} {:>10} {:>10} {:>8} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'old s', 'new s', 'time', 'old peak', 'new peak', 'mem'))
+    regressed = []
+    for name, new_result in new['results'].items():
+        old_result = old['results'].get(name)
+        if old_result is None:
+            print('{:<22} (new)'.format(name))
+            continue
+        time_change = Change(old_result['seconds'], new_result['seconds'])
+        mem_change = Change(old_result.get('peak_bytes'),
+                            new_result.get('peak_bytes'))
+        print('{:<22} {:>10.3f} {:>10.3f} {} {:>12} {:>12} {}'.format(
+            name, old_result['seconds'], new_result['seconds'],
+            FormatChange(time_change), str(old_result.get('peak_bytes')),
+            str(new_result.get('peak_bytes')), FormatChange(mem_change)))
+        if any(change is not None and change > threshold
+               for change in (time_change, mem_change)):
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='compare')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown or memory growth reported '
+                             'as a regression')
+    args = parser.parse_args(argv)
+    old, new = LoadResults(args.old), LoadResults(args.new)
+    print('old: {} ({})'.format(old.get('commit'), old.get('date')))
+    print('new: {} ({})'.format(new.get('commit'), new.get('date')))
+    regressed = Compare(old, new, args.threshold)
+    if regressed:
+        print('\nRegressed: {}'.format(', '.join(regressed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Deterministic synthetic vCard corpora.
+
+The same seed and count always produce the same bytes, so benchmark runs
+on different commits see identical input.  Cards mix vCard 2.1, 3.0 and
+4.0 and include folded lines, quoted-printable values, embedded photos,
+several EMAIL/TEL entries, item1. groups, non-latin names and a share of
+duplicate people.
+
+    python -m benchmarks.corpus --count 100000 --seed 0 corpus.vcf
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import base64
+import io
+import quopri
+import random
+import sys
+
+
+VERSIONS = ('2.1', '3.0', '4.0')
+
+FAMILY_NAMES = (
+    'Gump', 'Curran', 'Smith', 'Jones', "O'Brien", 'Smith-Jones',
+    'van der Berg', 'Müller', 'García', 'Łukasiewicz', 'Nguyễn',
+    'Иванов', 'Παπαδόπουλος', '李', '佐藤', 'Dubois', 'St. John',
+)
+GIVEN_NAMES = (
+    'Forrest', 'Jenny', 'Dan', 'Bubba', 'Jean-Luc', 'Ann Marie', 'Jörg',
+    'Zoë', 'Мария', 'Γιώργος', '伟', 'さくら', 'José', 'Siobhán',
+)
+DOMAINS = ('example.com', 'example.org', 'mail.example.net', 'example.de')
+TEL_TYPES = ('HOME', 'WORK', 'CELL', 'FAX')
+LABELS = ('_$!<Other>!$_', 'Assistant', 'Old address')
+
+FOLD_WIDTH = 75
+CRLF = '\r\n'
+
+
+def FoldLine(line, width=FOLD_WIDTH):
+    """Folds a content line the RFC 6350 way, continuations start with ' '."""
+    if len(line) <= width:
+        return [line]
+    lines = [line[:width]]
+    rest = line[width:]
+    while rest:
+        lines.append(' ' + rest[:width - 1])
+        rest = rest[width - 1:]
+    return lines
+
+
+def EscapeText(value):
+    return (value.replace('\\', '\\\\').replace(',', '\\,')
+            .replace(';', '\\;').replace('\n', '\\n'))
+
+
+def QuotedPrintable(value):
+    """Encodes a value as quoted-printable without soft line breaks."""
+    encoded = quopri.encodestring(value.encode('utf-8'), quotetabs=True)
+    return encoded.decode('ascii').replace('=\n', '')
+
+
+def MakePerson(rng, idx):
+    family = rng.choice(FAMILY_NAMES)
+    given = rng.choice(GIVEN_NAMES)
+    login = 'user{}'.format(idx)
+    return {
+        'family': family,
+        'given': given,
+        'additional': rng.choice(('', '', '', 'J.', 'Lee')),
+        'emails': ['{}.{}@{}'.format(login, k, rng.choice(DOMAINS))
+                   for k in range(rng.choice((0, 1, 1, 2, 3)))],
+        'tels': ['+1 ({:03d}) 555-{:04d}'.format(rng.randint(200, 999),
+                                                 rng.randint(0, 9999))
+                 for _ in range(rng.choice((0, 1, 2, 3)))],
+    }
+
+
+def MakePhoto(rng, size):
+    return base64.b64encode(bytes(bytearray(
+        rng.getrandbits(8) for _ in range(size)))).decode('ascii')
+
+
+def GenerateCard(rng, idx, person, version, photo_bytes=0,
+                 base64_21=False):
+    """Returns one vCard, CRLF terminated.
+
+    vobject cannot serialize the vCard 2.1 ENCODING=BASE64 form of a photo
+    again, so 2.1 cards get the 3.0 ENCODING=b form unless base64_21 is set.
+    """
+    family, given = person['family'], person['given']
+    fn = ' '.join(p for p in (given, person['additional'], family) if p)
+    n = ';'.join(EscapeText(p) for p in
+                 (family, given, person['additional'], '', ''))
+    lines = ['BEGIN:VCARD', 'VERSION:' + version]
+    if version == '2.1' and any(ord(c) > 127 for c in fn):
+        lines.append('N;CHARSET=UTF-8;ENCODING=QUOTED-PRINTABLE:' +
+                     QuotedPrintable(n))
+        lines.append('FN;CHARSET=UTF-8;ENCODING=QUOTED-PRINTABLE:' +
+                     QuotedPrintable(fn))
+    else:
+        lines.append('N:' + n)
+        lines.append('FN:' + EscapeText(fn))
+    for k, email in enumerate(person['emails']):
+        if version == '2.1':
+            lines.append('EMAIL;INTERNET:' + email)
+        elif k == 2:
+            lines.append('item1.EMAIL;TYPE=INTERNET:' + email)
+            lines.append('item1.X-ABLabel:' + rng.choice(LABELS))
+        else:
+            lines.append('EMAIL;TYPE=INTERNET{}:{}'.format(
+                ',PREF' if k == 0 else '', email))
+    for tel in person['tels']:
+        tel_type = rng.choice(TEL_TYPES)
+        if version == '2.1':
+            lines.append('TEL;{}:{}'.format(tel_type, tel))
+        else:
+            lines.append('TEL;TYPE={},VOICE:{}'.format(tel_type, tel))
+    if rng.random() < 0.3:
+        lines.append('ADR;TYPE=HOME:;;{} Plantation St.;Baytown;LA;{:05d};'
+                     'United States of America'.format(
+                         rng.randint(1, 999), rng.randint(0, 99999)))
+    if rng.random() < 0.3:
+        lines.append('NOTE:' + EscapeText(
+            'Met at the {} conference, talked about shrimp, boats, running '
+            'across the country and back again.'.format(2000 + idx % 20)))
+    if photo_bytes:
+        photo = MakePhoto(rng, photo_bytes)
+        if version == '4.0':
+            lines.append('PHOTO:data:image/jpeg;base64,' + photo)
+        elif version == '2.1' and base64_21:
+            lines.append('PHOTO;ENCODING=BASE64;TYPE=JPEG:' + photo)
+        else:
+            lines.append('PHOTO;ENCODING=b;TYPE=JPEG:' + photo)
+    lines.append('UID:urn:uuid:00000000-0000-4000-8000-{:012d}'.format(idx))
+    lines.append('REV:{:04d}-{:02d}-{:02d}T12:00:00Z'.format(
+        2005 + idx % 15, 1 + idx % 12, 1 + idx % 28))
+    lines.append('END:VCARD')
+    folded = []
+    for line in lines:
+        folded.extend(FoldLine(line))
+    return CRLF.join(folded) + CRLF
+
+
+def GenerateCorpus(count, seed=0, versions=VERSIONS, photo_ratio=0.02,
+                   photo_bytes=24 * 1024, duplicate_ratio=0.05,
+                   base64_21=False):
+    """Yields count vCards, the same ones for the same arguments.
+
+    Args:
+      count (int): Number of cards.
+      seed (int): Random seed.
+      versions: vCard versions to mix.
+      photo_ratio (float): Share of cards with an embedded photo.
+      photo_bytes (int): Size of each photo before base64.
+      duplicate_ratio (float): Share of cards repeating an earlier person
+          (same name, same emails and phones) to give dedupe work to do.
+      base64_21 (bool): Write 2.1 photos as ENCODING=BASE64.
+    """
+    rng = random.Random(seed)
+    people = []
+    for idx in range(count):
+        if people and rng.random() < duplicate_ratio:
+            person = rng.choice(people)
+        else:
+            person = MakePerson(rng, idx)
+            if len(people) < 10000:
+                people.append(person)
+        version = rng.choice(versions)
+        size = photo_bytes if rng.random() < photo_ratio else 0
+        yield GenerateCard(rng, idx, person, version, photo_bytes=size,
+                           base64_21=base64_21)
+
+
+def WriteCorpus(path, count, seed=0, **kwargs):
+    """Writes a corpus into path and returns its size in bytes."""
+    size = 0
+    with io.open(path, 'w', encoding='utf-8', newline='') as f:
+        for card in GenerateCorpus(count, seed=seed, **kwargs):
+            size += f.write(card)
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='corpus')
+    parser.add_argument('outfile')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--versions', default=','.join(VERSIONS),
+                        help='Comma separated vCard versions to mix')
+    parser.add_argument('--photo_ratio', type=float, default=0.02)
+    parser.add_argument('--photo_bytes', type=int, default=24 * 1024)
+    parser.add_argument('--duplicate_ratio', type=float, default=0.05)
+    parser.add_argument('--base64_21', action='store_true',
+                        help='Write vCard 2.1 photos as ENCODING=BASE64')
+    args = parser.parse_args(argv)
+    WriteCorpus(args.outfile, args.count, seed=args.seed,
+                versions=tuple(args.versions.split(',')),
+                photo_ratio=args.photo_ratio,
+                photo_bytes=args.photo_bytes,
+                duplicate_ratio=args.duplicate_ratio,
+                base64_21=args.base64_21)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Cold-start benchmarks of the vcardtool command line.
+
+Hooks run vcardtool thousands of times on tiny files, where starting the
+interpreter and importing modules costs more than the work itself.  Every
+benchmark starts a fresh interpreter under -X importtime and records both
+the wall time of the whole run and the time spent importing, with the
+slowest imports, so that a new eager import shows up as a regression:
+
+    python -m benchmarks.startup --output before.json
+    git checkout other-branch
+    python -m benchmarks.startup --output after.json
+    python -m benchmarks.compare before.json after.json
+
+The results have the layout of benchmarks.suite, with 'seconds' being the
+wall time; 'import_seconds' and 'modules' are extra.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from benchmarks import corpus
+from benchmarks import suite
+
+
+RESULTS_VERSION = 1
+
+# Benchmark name to vcardtool arguments, {vcf} is a one-card file.
+COMMANDS = collections.OrderedDict([
+    ('startup.help', ['--help']),
+    ('startup.list_help', ['list', '--help']),
+    ('startup.list', ['list', '{vcf}']),
+    ('startup.list_email', ['list', '--email', '{vcf}']),
+    ('startup.split', ['split', '--pretend', '{vcf}']),
+    ('startup.dedupe', ['dedupe', '--pretend', '{vcf}']),
+])
+
+
+def ParseImportTimes(stderr):
+    """Returns {module: (self us, cumulative us)} from -X importtime output.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            # the header line
+            continue
+        times[parts[2].strip()] = (self_us, cumulative_us)
+    return times
+
+
+def RunOnce(argv, cwd):
+    """Returns (wall seconds, {module: (self us, cumulative us)})."""
+    cmd = [sys.executable, '-X', 'importtime', '-m',
+           'vcardtools.vcardtool'] + argv
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (root, env.get('PYTHONPATH')) if p)
+    start = timeit.default_timer()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    _, stderr = proc.communicate()
+    seconds = timeit.default_timer() - start
+    if proc.returncode:
+        raise RuntimeError('{} failed:\n{}'.format(
+            ' '.join(cmd), stderr.decode('utf-8', 'replace')))
+    return seconds, ParseImportTimes(stderr.decode('utf-8', 'replace'))
+
+
+def TimeCommand(argv, cwd, repeat, top=5):
+    """Best of repeat runs of one command line, as a result dict."""
+    best = None
+    for _ in range(repeat):
+        seconds, times = RunOnce(argv, cwd)
+        if best is None or seconds < best[0]:
+            best = seconds, times
+    seconds, times = best
+    slowest = sorted(times.items(), key=lambda item: -item[1][0])[:top]
+    return collections.OrderedDict([
+        ('seconds', seconds),
+        ('items', 1),
+        ('us_per_item', seconds * 1e6),
+        ('peak_bytes', None),
+        # sum of the self times, the cumulative ones overlap
+        ('import_seconds', sum(t[0] for t in times.values()) / 1e6),
+        ('modules', len(times)),
+        ('slowest_imports', [[name, t[0]] for name, t in slowest]),
+    ])
+
+
+def RunStartup(names, repeat=5):
+    workdir = tempfile.mkdtemp(prefix='vcardtools-startup-')
+    try:
+        vcf = os.path.join(workdir, 'one.vcf')
+        with io.open(vcf, 'w', encoding='utf-8', newline='') as f:
+            f.write(next(corpus.GenerateCorpus(1, seed=1, photo_ratio=0)))
+        commit, dirty = suite.GetCommit()
+        results = collections.OrderedDict()
+        for name in names:
+            argv = [a.format(vcf=vcf) for a in COMMANDS[name]]
+            results[name] = TimeCommand(argv, workdir, repeat)
+            print('{:<22} {:>9.3f} s {:>9.3f} s importing {:>5} modules'
+                  .format(name, results[name]['seconds'],
+                          results[name]['import_seconds'],
+                          results[name]['modules']), file=sys.stderr)
+        return {
+            'version': RESULTS_VERSION,
+            'commit': commit,
+            'dirty': dirty,
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': {'count': 1, 'seed': 1},
+            'repeat': repeat,
+            'jobs': 1,
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='startup')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', action='append', choices=list(COMMANDS),
+                        help='Run only this benchmark, may be repeated')
+    parser.add_argument('--output', help='Write JSON results to this file '
+                                         'instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = RunStartup(args.only or list(COMMANDS), repeat=args.repeat)
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Timing and peak-memory benchmarks of the vcardtools hot paths.
+
+Generates a corpus with benchmarks.corpus, runs every benchmark, and
+writes the results as JSON so that runs on different commits can be
+compared with benchmarks.compare:
+
+    python -m benchmarks.suite --count 5000 --output before.json
+    git checkout other-branch
+    python -m benchmarks.suite --count 5000 --output after.json
+    python -m benchmarks.compare before.json after.json
+
+Times are the best of --repeat runs.  Peak memory is measured in a
+separate run under tracemalloc, so that tracing does not skew the times;
+it covers Python allocations of the benchmarking process only, not the
+--jobs worker processes.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from six import u
+
+from benchmarks import corpus
+from vcardtools import vcf_lister
+from vcardtools import vcf_merge
+from vcardtools import vcf_splitter
+
+
+RESULTS_VERSION = 1
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def Benchmark(name):
+    """Registers a benchmark.
+
+    The decorated function takes the Context and returns a callable that
+    does the work once and returns the number of items it handled.
+    """
+    def Register(func):
+        BENCHMARKS[name] = func
+        return func
+    return Register
+
+
+class Context(object):
+    """Corpus and scratch space shared by all benchmarks of a run."""
+
+    def __init__(self, workdir, count, seed, jobs):
+        self.workdir = workdir
+        self.count = count
+        self.jobs = jobs
+        self.corpus_path = os.path.join(workdir, 'corpus.vcf')
+        self.corpus_bytes = corpus.WriteCorpus(self.corpus_path, count,
+                                               seed=seed)
+        with io.open(self.corpus_path, 'r', encoding='utf-8') as f:
+            self.content = f.read()
+        self._vcards = None
+
+    @property
+    def vcards(self):
+        # parsed once, only when a benchmark needs vobject objects
+        if self._vcards is None:
+            self._vcards = list(vcf_splitter.GetVcardsFromString(self.content))
+        return self._vcards
+
+    def MakeDir(self, prefix):
+        return tempfile.mkdtemp(prefix=prefix, dir=self.workdir)
+
+
+def ParseArgs(module, argv):
+    parser = argparse.ArgumentParser()
+    module.AddArguments(parser)
+    return parser.parse_args(argv)
+
+
+@Benchmark('GetVcardsFromString')
+def BenchGetVcardsFromString(ctx):
+    def Run():
+        return sum(1 for _ in vcf_splitter.GetVcardsFromString(ctx.content))
+    return Run
+
+
+@Benchmark('GetVcardFilename')
+def BenchGetVcardFilename(ctx):
+    vcards = ctx.vcards
+
+    def Run():
+        for vcard in vcards:
+            try:
+                vcf_splitter.GetVcardFilename(vcard)
+            except vcf_splitter.NameError:
+                pass
+        return len(vcards)
+    return Run
+
+
+@Benchmark('DedupVcardFilenames')
+def BenchDedupVcardFilenames(ctx):
+    named = []
+    for vcard in ctx.vcards:
+        try:
+            named.append((vcf_splitter.GetVcardFilename(vcard), vcard))
+        except vcf_splitter.NameError:
+            pass
+
+    def Run():
+        vcard_dict = collections.defaultdict(list)
+        for name, vcard in named:
+            vcard_dict[name].append(vcard)
+        vcf_splitter.DedupVcardFilenames(vcard_dict)
+        return len(named)
+    return Run
+
+
+@Benchmark('FilenameAllocator')
+def BenchFilenameAllocator(ctx):
+    names = []
+    for vcard in ctx.vcards:
+        try:
+            fname = vcf_splitter.GetVcardFilename(vcard)
+        except vcf_splitter.NameError:
+            continue
+        raw = u(vcard.serialize()).encode('utf-8')
+        names.append((fname, vcf_splitter.GetCardSuffix(None, raw)))
+
+    def Run():
+        allocator = vcf_splitter.FilenameAllocator()
+        for fname, suffix in names:
+            allocator.Allocate(fname, suffix)
+        return len(names)
+    return Run
+
+
+@Benchmark('MergeVcards')
+def BenchMergeVcards(ctx):
+    vcards = ctx.vcards
+    pairs = list(zip(vcards[::2], vcards[1::2]))
+
+    def Run():
+        for vcard1, vcard2 in pairs:
+            vcf_merge.MergeVcards(vcard1, vcard2,
+                                  resolve_conflict=vcf_merge.ResolvePreferFirst)
+        return len(pairs)
+    return Run
+
+
+@Benchmark('split.main')
+def BenchSplitMain(ctx):
+    def Run():
+        output_dir = ctx.MakeDir('split-')
+        try:
+            args = ParseArgs(vcf_splitter, [ctx.corpus_path,
+                                            '--output_dir', output_dir,
+                                            '--jobs', str(ctx.jobs)])
+            vcf_splitter.main(args)
+        finally:
+            shutil.rmtree(output_dir)
+        return ctx.count
+    return Run
+
+
+@Benchmark('list.main')
+def BenchListMain(ctx):
+    def Run():
+        args = ParseArgs(vcf_lister, [ctx.corpus_path, '--email',
+                                      '--jobs', str(ctx.jobs)])
+        vcf_lister.main(args)
+        return ctx.count
+    return Run
+
+
+@Benchmark('merge.main')
+def BenchMergeMain(ctx):
+    # merge works on two single-card files; the second card has the fields
+    # of the first plus extra list fields, so no conflict ever prompts
+    card = next(corpus.GenerateCorpus(1, seed=1, photo_ratio=0))
+    extra = ('EMAIL;TYPE=INTERNET:extra@example.com\r\n'
+             'TEL;TYPE=CELL:+1 555 0100\r\nEND:VCARD\r\n')
+    paths = []
+    for name, content in (('a.vcf', card),
+                          ('b.vcf', card.replace('END:VCARD\r\n', extra))):
+        path = os.path.join(ctx.workdir, name)
+        with io.open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        paths.append(path)
+    merges = 200
+
+    def Run():
+        for _ in range(merges):
+            args = ParseArgs(vcf_merge, paths)
+            args.outfile = io.StringIO()
+            vcf_merge.main(args)
+        return merges
+    return Run
+
+
+class _NullOutput(object):
+    """Stands in for sys.stdout while the CLI mains print."""
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def RunQuietly(func):
+    stdout = sys.stdout
+    sys.stdout = _NullOutput()
+    try:
+        return func()
+    finally:
+        sys.stdout = stdout
+
+
+def TimeBenchmark(run, repeat):
+    """Returns (best seconds, items) over repeat runs."""
+    best = None
+    items = 0
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        items = RunQuietly(run)
+        seconds = timeit.default_timer() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, items
+
+
+def MeasurePeakMemory(run):
+    """Returns the peak traced allocation of one run, in bytes."""
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        RunQuietly(run)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def GetCommit():
+    """Returns (commit id, dirty) of the checkout under test, if any."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=root).decode('ascii').strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain',
+                                          '--untracked-files=no'], cwd=root)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def RunSuite(names, count, seed=0, repeat=3, jobs=1, memory=True):
+    """Runs the named benchmarks and returns the results as a dict."""
+    workdir = tempfile.mkdtemp(prefix='vcardtools-bench-')
+    try:
+        ctx = Context(workdir, count, seed, jobs)
+        commit, dirty = GetCommit()
+        results = collections.OrderedDict()
+        for name in names:
+            run = BENCHMARKS[name](ctx)
+            seconds, items = TimeBenchmark(run, repeat)
+            results[name] = {
+                'seconds': seconds,
+                'items': items,
+                'us_per_item': seconds / items * 1e6 if items else None,
+                'peak_bytes': MeasurePeakMemory(run) if memory else None,
+            }
+            print('{:<22} {:>9.3f} s {:>10.1f} us/item {:>12} peak bytes'.format(
+                name, seconds, results[name]['us_per_item'] or 0,
+                str(results[name]['peak_bytes'])), file=sys.stderr)
+        return {
+            'version': RESULTS_VERSION,
+            'commit': commit,
+            'dirty': dirty,
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'corpus': {'count': count, 'seed': seed,
+                       'bytes': ctx.corpus_bytes},
+            'repeat': repeat,
+            'jobs': jobs,
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='suite')
+    parser.add_argument('--count', type=int, default=5000,
+                        help='Number of cards in the corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='--jobs passed to the CLI mains')
+    parser.add_argument('--no_memory', action='store_true',
+                        help='Skip the tracemalloc runs')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS),
+                        help='Run only this benchmark, may be repeated')
+    parser.add_argument('--output', help='Write JSON results to this file '
+                                         'instead of stdout')
+    args = parser.parse_args(argv)
+
+    # the CLI modules log every card at DEBUG, which would time the terminal
+    logging.disable(logging.WARNING)
+    results = RunSuite(args.only or list(BENCHMARKS), args.count,
+                       seed=args.seed, repeat=args.repeat, jobs=args.jobs,
+                       memory=not args.no_memory)
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
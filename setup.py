@@ -43,7 +43,13 @@ setup(
             'vcf_merge = vcardtools.vcf_merge:dispatch_main',
             'vcf_splitter = vcardtools.vcf_splitter:dispatch_main',
             'vcf_lister = vcardtools.vcf_lister:dispatch_main',
+            'vcf_dedupe = vcardtools.vcf_dedupe:dispatch_main',
         ],
     },
-    install_requires = ['argparse', 'six', 'vobject']
+    install_requires = [
+        'argparse',
+        'futures; python_version < "3"',
+        'six',
+        'vobject',
+    ]
 )
@@ -7,39 +7,126 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import collections
+import importlib
 import sys
 
-try:
-    from . import vcf_merge
-    from . import vcf_splitter
-    from . import vcf_lister
-except ImportError:
-    print(sys.path)
-    raise
+
+# Sub-command to (module, help).  Only the module of the sub-command being
+# run is imported, so that starting the tool on a small file stays fast.
+COMMANDS = collections.OrderedDict([
+    ('merge', ('vcf_merge', 'merge help')),
+    ('split', ('vcf_splitter', 'split help')),
+    ('dedupe', ('vcf_dedupe', 'dedupe help')),
+    ('list', ('vcf_lister', 'list help')),
+])
+
+# Top level options taking a value, which cannot be a sub-command.
+VALUE_OPTIONS = ('--profile', '--cache_dir', '--cache_mb')
+
+
+def FindCommand(argv):
+    """Returns the sub-command named on the command line, or None."""
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif arg in COMMANDS:
+            return arg
+        elif not arg.startswith('-'):
+            return None
+    return None
+
+
+def ImportCommand(command):
+    try:
+        return importlib.import_module(
+            '.' + COMMANDS[command][0], __package__ or 'vcardtools')
+    except ImportError:
+        print(sys.path)
+        raise
+
+
+def RunProfiled(func, args, usage, profile_path):
+    """Runs func under cProfile, '-' prints the top functions to stderr."""
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        func(args, usage=usage)
+    finally:
+        profiler.disable()
+        if profile_path == '-':
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats('cumulative').print_stats(30)
+        else:
+            profiler.dump_stats(profile_path)
+            print('Profile written to {}, see python -m pstats.'.format(
+                profile_path), file=sys.stderr)
 
 
 def main():
     parser = argparse.ArgumentParser(prog='vcardtool')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Log debug messages')
+    parser.add_argument('--timings',
+                        action='store_true',
+                        help='Print the time, item count and throughput of '
+                             'every stage and the peak RSS to stderr')
+    parser.add_argument('--profile',
+                        metavar='FILE',
+                        help='Write cProfile statistics to FILE, - prints '
+                             'the slowest functions to stderr')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='Keep the fields parsed from every card in an '
+                             'on-disk cache and reuse them on later runs')
+    parser.add_argument('--cache_dir',
+                        metavar='DIR',
+                        help='Directory of the cache (default: '
+                             '~/.cache/vcardtools)')
+    parser.add_argument('--cache_mb',
+                        type=float,
+                        default=100,
+                        help='Drop the least recently used entries when the '
+                             'cache grows past this size (default: 100)')
     sub_parsers = parser.add_subparsers(help='sub-command help')
 
-    parser_merge = sub_parsers.add_parser('merge', help='merge help')
-    vcf_merge.AddArguments(parser_merge)
-    parser_merge.set_defaults(func=vcf_merge.main)
-
-    parser_split = sub_parsers.add_parser('split', help='split help')
-    vcf_splitter.AddArguments(parser_split)
-    parser_split.set_defaults(func=vcf_splitter.main)
-
-    parser_list = sub_parsers.add_parser('list', help='list help')
-    vcf_lister.AddArguments(parser_list)
-    parser_list.set_defaults(func=vcf_lister.main)
+    command = FindCommand(sys.argv[1:])
+    for name, (_, help_text) in COMMANDS.items():
+        sub_parser = sub_parsers.add_parser(name, help=help_text)
+        if name == command:
+            module = ImportCommand(name)
+            module.AddArguments(sub_parser)
+            sub_parser.set_defaults(func=module.main)
 
     args = parser.parse_args(sys.argv[1:])
-    try:
-        args.func(args, usage=parser.format_help())
-    except AttributeError:
+    if not hasattr(args, 'func'):
         parser.print_usage()
         sys.exit(1)
+    # vcf_profile is imported by every sub-command module already
+    from . import vcf_profile
+    if args.verbose:
+        vcf_profile.SetVerbose()
+    timings = vcf_profile.Enable() if args.timings else None
+    cache = None
+    if args.cache or args.cache_dir:
+        from . import vcf_cache
+        cache = vcf_cache.Enable(args.cache_dir, args.cache_mb)
+    try:
+        if args.profile:
+            RunProfiled(args.func, args, parser.format_help(), args.profile)
+        else:
+            args.func(args, usage=parser.format_help())
+    finally:
+        if cache:
+            cache.Close()
+        if timings:
+            timings.Report()
 
 
 if __name__ == '__main__':
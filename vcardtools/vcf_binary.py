@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""What to do with inline PHOTO, LOGO and SOUND values, --binary.
+
+A single base64 photo can outweigh a hundred cards.  The policies:
+
+keep     Cards are written with their binary values, as read.
+strip    Binary values are dropped from the cards written.
+extract  Every binary value is decoded once into a file named after its
+         hash in a photos/ directory next to the output, so identical
+         photos are stored once, and the card refers to it by URI.
+lazy     Cards are written with their binary values, but cards parsed by
+         vobject to be merged get a short placeholder instead, which is
+         swapped back for the original bytes when the card is written.
+
+Listing and naming never decode binary values whatever the policy, see
+vcf_fastparse.StripBinaryValues.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import binascii
+import hashlib
+import os
+import re
+
+from . import vcf_fastparse
+from . import vcf_writer
+
+
+POLICIES = ('keep', 'strip', 'extract', 'lazy')
+BINARY_DIR = 'photos'
+
+# Media subtype, or vCard 2.1 TYPE, to file extension.
+EXTENSIONS = {
+    'JPEG': '.jpg', 'JPG': '.jpg', 'PNG': '.png', 'GIF': '.gif',
+    'BMP': '.bmp', 'TIFF': '.tif', 'SVG+XML': '.svg', 'WAV': '.wav',
+    'X-WAV': '.wav', 'MPEG': '.mp3', 'MP3': '.mp3', 'OGG': '.ogg',
+    'AAC': '.aac',
+}
+DEFAULT_EXTENSION = '.bin'
+
+LAZY_SCHEME = b'vcardtools-blob:'
+LAZY_REGEX = re.compile(br'^[^\r\n]*:' + LAZY_SCHEME + br'([0-9a-f]{16})\r?\n',
+                        re.M)
+
+_policy = 'keep'
+
+
+def SetPolicy(policy):
+    """Sets the policy of this process, RawVcard.vobject follows 'lazy'."""
+    global _policy
+    _policy = policy
+
+
+def GetPolicy():
+    return _policy
+
+
+def _LineEnding(raw):
+    return b'\r\n' if b'\r\n' in raw else b'\n'
+
+
+def _GetExtension(media_type):
+    subtype = media_type.split('/')[-1].strip().upper()
+    return EXTENSIONS.get(subtype)
+
+
+def DecodeBinaryValue(head, value):
+    """Returns (data, file extension) of an inline base64 value, or None.
+
+    Args:
+      head (bytes): Name and parameters of the property.
+      value (bytes): Its value, folded or not.
+    """
+    value = b''.join(value.split())
+    extension = None
+    if value[:5].upper() == b'DATA:':
+        meta, _, value = value.partition(b',')
+        if b';BASE64' not in meta.upper():
+            return None
+        extension = _GetExtension(meta[5:].split(b';')[0].decode('ascii'))
+    else:
+        params = vcf_fastparse.ParseParams(
+            head.decode('ascii', 'replace').split(';')[1:])
+        for media_type in params.get('TYPE', []) + params.get('MEDIATYPE', []):
+            extension = _GetExtension(media_type) or extension
+    try:
+        data = binascii.a2b_base64(value)
+    except (binascii.Error, ValueError):
+        return None
+    return data, extension or DEFAULT_EXTENSION
+
+
+def ExtractBinaryValues(raw, uri_prefix=BINARY_DIR + '/'):
+    """Replaces inline binary values of a raw card with URIs.
+
+    Returns:
+      (card bytes, list of (filename, data)), filenames are the SHA-1 of
+      the data plus an extension and the URIs uri_prefix + filename.
+    """
+    pieces = []
+    extracted = []
+    pos = 0
+    value_type = b'uri'
+    if raw.find(b'VERSION:2.1') >= 0 or raw.find(b'version:2.1') >= 0:
+        value_type = b'URL'
+    for start, colon, end in vcf_fastparse.FindBinaryValues(raw):
+        decoded = DecodeBinaryValue(raw[start:colon], raw[colon + 1:end])
+        if decoded is None:
+            continue
+        data, extension = decoded
+        filename = hashlib.sha1(data).hexdigest() + extension
+        name = raw[start:colon].split(b';', 1)[0]
+        pieces.append(raw[pos:start])
+        pieces.append(b''.join((name, b';VALUE=', value_type, b':',
+                                (uri_prefix + filename).encode('utf-8'),
+                                _LineEnding(raw))))
+        pos = end
+        extracted.append((filename, data))
+    if not pieces:
+        return raw, extracted
+    pieces.append(raw[pos:])
+    return b''.join(pieces), extracted
+
+
+def HideBinaryValues(raw):
+    """Replaces inline binary values with placeholders for vobject.
+
+    Returns:
+      (card bytes, {placeholder token: original bytes}), the card keeps the
+      dict, which RestoreBinaryValues needs to put the values back.
+    """
+    pieces = []
+    hidden = {}
+    pos = 0
+    for start, colon, end in vcf_fastparse.FindBinaryValues(raw):
+        token = hashlib.sha1(raw[start:end]).hexdigest()[:16].encode('ascii')
+        hidden[token] = raw[start:end]
+        name = raw[start:colon].split(b';', 1)[0]
+        pieces.append(raw[pos:start])
+        pieces.append(b''.join((name, b';VALUE=uri:', LAZY_SCHEME, token,
+                                _LineEnding(raw))))
+        pos = end
+    if not pieces:
+        return raw, hidden
+    pieces.append(raw[pos:])
+    return b''.join(pieces), hidden
+
+
+def RestoreBinaryValues(raw, hidden):
+    """Swaps the placeholders of HideBinaryValues for the original values.
+
+    Args:
+      raw (bytes): Serialized card.
+      hidden (dict): The values hidden from the cards it was made of.
+    """
+    if raw.find(LAZY_SCHEME) < 0:
+        return raw
+    return LAZY_REGEX.sub(
+        lambda match: hidden.get(match.group(1), match.group(0)), raw)
+
+
+def _WriteMissingFile(directory):
+    def Write(path, data):
+        path = os.path.join(directory, path)
+        if os.path.exists(path):
+            return
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        vcf_writer.WriteFile(path, data, atomic=True)
+    return Write
+
+
+class BinaryOutput(object):
+    """Applies a policy to cards on their way out.
+
+    Attributes:
+      policy (str): One of POLICIES.
+      uri_prefix (str): URI of the photos/ directory as seen from the cards.
+      extracted (int): Distinct binary values extracted.
+    """
+
+    def __init__(self, policy, directory='.', uri_prefix=BINARY_DIR + '/',
+                 write=None):
+        """
+        Args:
+          policy (str): One of POLICIES.
+          directory (str): Where the photos/ directory goes.
+          uri_prefix (str): See the attribute.
+          write: Callable writing (path relative to directory, data) if no
+              such file exists, instead of writing right away.
+        """
+        self.policy = policy
+        self.uri_prefix = uri_prefix
+        self.extracted = 0
+        self._write = write or _WriteMissingFile(directory)
+        self._seen = set()
+
+    def Apply(self, raw, hidden=None):
+        """Returns the card bytes to write, writing extracted values.
+
+        hidden holds the values lazily hidden from the card, see
+        HideBinaryValues.
+        """
+        if self.policy == 'strip':
+            return vcf_fastparse.StripBinaryValues(raw, min_bytes=0)
+        if self.policy == 'lazy':
+            return RestoreBinaryValues(raw, hidden or {})
+        if self.policy != 'extract':
+            return raw
+        raw, extracted = ExtractBinaryValues(raw, self.uri_prefix)
+        for filename, data in extracted:
+            if filename in self._seen:
+                continue
+            self._seen.add(filename)
+            self._write(os.path.join(BINARY_DIR, filename), data)
+            self.extracted += 1
+        return raw
+
+    def ApplyText(self, text, encoding='utf-8', hidden=None):
+        """Same as Apply for a card as text."""
+        if self.policy == 'keep':
+            return text
+        return vcf_fastparse.DecodeCard(
+            self.Apply(text.encode(encoding), hidden), encoding)
+
+
+def AddArguments(parser):
+    parser.add_argument('--binary',
+                        choices=POLICIES,
+                        default='keep',
+                        help='Keep, strip or extract to {}/ the inline '
+                             'photos, logos and sounds of the cards written; '
+                             'lazy keeps them but leaves them out when '
+                             'merging'.format(BINARY_DIR))
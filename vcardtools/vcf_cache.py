@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""On-disk cache of parsed card fields, for vcardtool --cache.
+
+Exports are re-run daily and mostly unchanged, so the fields extracted from
+a card are kept in an SQLite database under the user's cache directory
+(~/.cache/vcardtools by default), keyed by a hash of the raw card bytes,
+the parser and the encoding.  Any command in any directory reuses them:
+a card seen before is not parsed again.
+
+Entries are written in batches and stamped with the time of their last
+use; when the cache grows past its size limit the least recently used
+ones are dropped.  --jobs workers open the database themselves and commit
+after every batch.  A cache that cannot be opened or written is turned
+off with a warning, it never fails a command.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import marshal
+import os
+import time
+
+from . import vcf_fastparse
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+log_formatter = logging.Formatter(('%(asctime)s - %(name)s - %(levelname)s'
+                                   ' - %(message)s'))
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(log_formatter)
+log_handler.setLevel(logging.DEBUG)
+logger.addHandler(log_handler)
+
+
+CACHE_NAME = 'fields.sqlite'
+CACHE_VERSION = 1
+DEFAULT_MAX_MB = 100
+
+# New and used entries are written to the database this many at a time.
+FLUSH_SIZE = 1000
+
+# Entries are evicted down to this fraction of the size limit, so that
+# eviction does not run again on the next command.
+EVICT_TO = 0.8
+
+# Seconds to wait for another process writing the cache.
+LOCK_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (version INTEGER);
+CREATE TABLE IF NOT EXISTS fields (
+    key TEXT PRIMARY KEY, data BLOB, size INTEGER, used INTEGER);
+CREATE INDEX IF NOT EXISTS fields_used ON fields (used);
+"""
+
+
+def GetDefaultCacheDir():
+    """$XDG_CACHE_HOME/vcardtools, ~/.cache/vcardtools without it."""
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'vcardtools')
+
+
+def DumpFields(fields):
+    """Serializes a VcardFields, marshal is several times faster than JSON.
+    """
+    return marshal.dumps(tuple(getattr(fields, prop)
+                               for prop in vcf_fastparse.PROPERTIES))
+
+
+def LoadFields(data):
+    """Inverse of DumpFields."""
+    fields = vcf_fastparse.VcardFields()
+    for prop, value in zip(vcf_fastparse.PROPERTIES, marshal.loads(data)):
+        setattr(fields, prop, value)
+    return fields
+
+
+def GetKey(raw, encoding='utf-8', parser='fast'):
+    """Cache key of a raw card block (bytes)."""
+    digest = hashlib.sha1('{}\0{}\0{}\0{}\0'.format(
+        CACHE_VERSION, marshal.version, parser, encoding).encode('ascii'))
+    digest.update(raw)
+    return digest.hexdigest()
+
+
+class ParseCache(object):
+    """Fields of cards by GetKey, in an SQLite database.
+
+    The database is opened on first use in every process, so instances can
+    be handed to the --jobs workers.
+
+    Attributes:
+      path (str): Database file.
+      max_bytes (int): Size limit of the cached fields.
+      hits (int): Lookups answered from the cache.
+      misses (int): Lookups that were not.
+      disabled (bool): Set after an error, the cache is not used anymore.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_MB * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disabled = False
+        self._conn = None
+        self._pid = None
+        self._new = {}
+        self._used = []
+
+    def __getstate__(self):
+        return self.path, self.max_bytes
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def _Connect(self):
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        # only --cache needs it
+        import sqlite3
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        # readers do not wait for the writing worker
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        row = conn.execute('SELECT version FROM meta').fetchone()
+        if row is None or row[0] != CACHE_VERSION:
+            with conn:
+                conn.executescript('DELETE FROM fields; DELETE FROM meta;')
+                conn.execute('INSERT INTO meta VALUES (?)', (CACHE_VERSION,))
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def _Disable(self, error):
+        logger.warning('Turning off the cache "{}": {}'.format(
+            self.path, error))
+        self.disabled = True
+        self._new = {}
+        self._used = []
+
+    def Get(self, key):
+        """Returns the cached VcardFields of a key, or None."""
+        if self.disabled:
+            return None
+        fields = self._new.get(key)
+        if fields is not None:
+            self.hits += 1
+            return fields
+        try:
+            row = self._Connect().execute(
+                'SELECT data FROM fields WHERE key = ?', (key,)).fetchone()
+        except Exception as e:
+            # sqlite3.Error, or the directory cannot be created
+            self._Disable(e)
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.append(key)
+        if len(self._used) >= FLUSH_SIZE:
+            self.Flush()
+        return LoadFields(bytes(row[0]))
+
+    def Put(self, key, fields):
+        """Caches the fields of a key, they must have every property set."""
+        if self.disabled:
+            return
+        self._new[key] = fields
+        if len(self._new) >= FLUSH_SIZE:
+            self.Flush()
+
+    def Flush(self):
+        """Writes new entries and last-use times to the database."""
+        if self.disabled or not (self._new or self._used):
+            return
+        now = int(time.time())
+        try:
+            conn = self._Connect()
+            import sqlite3
+            rows = []
+            for key, fields in self._new.items():
+                data = DumpFields(fields)
+                rows.append((key, sqlite3.Binary(data), len(key) + len(data),
+                             now))
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO fields VALUES '
+                                 '(?, ?, ?, ?)', rows)
+                conn.executemany('UPDATE fields SET used = ? WHERE key = ?',
+                                 ((now, key) for key in self._used))
+        except Exception as e:
+            self._Disable(e)
+            return
+        self._new = {}
+        self._used = []
+
+    def Evict(self):
+        """Drops the least recently used entries above the size limit.
+
+        Returns:
+          The number of entries dropped.
+        """
+        if self.disabled:
+            return 0
+        try:
+            conn = self._Connect()
+            total, count = conn.execute(
+                'SELECT SUM(size), COUNT(*) FROM fields').fetchone()
+            if not total or total <= self.max_bytes:
+                return 0
+            # entries are about the same size
+            drop = count - int(count * self.max_bytes * EVICT_TO / total)
+            with conn:
+                conn.execute('DELETE FROM fields WHERE key IN (SELECT key '
+                             'FROM fields ORDER BY used LIMIT ?)', (drop,))
+        except Exception as e:
+            self._Disable(e)
+            return 0
+        return drop
+
+    def Close(self):
+        self.Flush()
+        evicted = self.Evict()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        logger.debug('Cache %s: %d hits, %d misses, %d evicted', self.path,
+                     self.hits, self.misses, evicted)
+
+
+_cache = None
+
+
+def Enable(cache_dir=None, max_mb=DEFAULT_MAX_MB):
+    """Turns the cache on for this process, returns the ParseCache."""
+    global _cache
+    path = os.path.join(cache_dir or GetDefaultCacheDir(), CACHE_NAME)
+    _cache = ParseCache(path, max_bytes=int(max_mb * 2 ** 20))
+    return _cache
+
+
+def SetCache(cache):
+    """Installs a ParseCache, or None, as the cache of this process."""
+    global _cache
+    _cache = cache
+
+
+def GetCache():
+    """The enabled ParseCache, None when the cache is off."""
+    return _cache
+
+
+def Flush():
+    if _cache is not None:
+        _cache.Flush()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""vCards kept as the raw bytes they were read as.
+
+Split, list and dedupe mostly pass cards through unchanged, and running
+them through vobject.serialize() is slow, refolds lines and can subtly
+alter values.  A RawVcard holds the original bytes and where they came
+from, decodes and parses only the properties that are asked for, and
+hands the original bytes back out.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from . import vcf_binary
+from . import vcf_cache
+from . import vcf_fastparse
+from . import vcf_profile
+
+
+class RawVcard(object):
+    """One vCard block, parsed lazily.
+
+    Attributes:
+      raw (bytes): The block from BEGIN:VCARD up to and including END:VCARD.
+      offset (int): Byte offset of the block in its file, None if unknown.
+      encoding (str): Encoding of raw.
+      hidden_binary (dict): Binary values left out of the vobject card by the
+          lazy --binary policy, see vcf_binary.HideBinaryValues.
+    """
+
+    __slots__ = ('raw', 'offset', 'encoding', 'hidden_binary', '_text',
+                 '_fields', '_parsed', '_vobject')
+
+    def __init__(self, raw, offset=None, encoding='utf-8'):
+        self.raw = raw
+        self.offset = offset
+        self.encoding = encoding
+        self.hidden_binary = {}
+        self._text = None
+        self._fields = None
+        self._parsed = frozenset()
+        self._vobject = None
+
+    def __getstate__(self):
+        # only the raw block crosses to the --jobs workers
+        return self.raw, self.offset, self.encoding
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return '<RawVcard at {} ({} bytes)>'.format(self.offset, len(self.raw))
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = vcf_fastparse.DecodeCard(self.raw, self.encoding)
+        return self._text
+
+    def _GetFieldsText(self):
+        """The text to parse fields from, without inline binary values."""
+        if self._text is not None:
+            return self._text
+        raw = vcf_fastparse.StripBinaryValues(self.raw)
+        if raw is self.raw:
+            return self.text
+        # not kept, the card may still need its full text
+        return vcf_fastparse.DecodeCard(raw, self.encoding)
+
+    @property
+    def line_ending(self):
+        return b'\r\n' if b'\r\n' in self.raw else b'\n'
+
+    def GetFields(self, properties=vcf_fastparse.DEFAULT_PROPERTIES,
+                  parser='fast'):
+        """Returns a VcardFields with at least the given properties set.
+
+        Properties already parsed by an earlier call are not parsed again.
+        With vcf_cache enabled every property is taken from the cache, or
+        parsed and cached.
+        """
+        if self._fields is None and vcf_cache.GetCache() is not None:
+            self._fields = self._GetCachedFields(vcf_cache.GetCache(), parser)
+            self._parsed = frozenset(vcf_fastparse.PROPERTIES)
+            return self._fields
+        if self._fields is None:
+            # nothing parsed yet, the common case of a single call
+            with vcf_profile.Stage('parse'):
+                self._fields = vcf_fastparse.GetVcardFields(
+                    self._GetFieldsText(), properties, parser=parser)
+            self._parsed = frozenset(properties)
+            return self._fields
+        missing = [p for p in properties if p not in self._parsed]
+        if missing:
+            with vcf_profile.Stage('parse'):
+                fields = vcf_fastparse.GetVcardFields(
+                    self._GetFieldsText(), missing, parser=parser)
+            for prop in missing:
+                setattr(self._fields, prop, getattr(fields, prop))
+            self._parsed = self._parsed.union(missing)
+        return self._fields
+
+    def _GetCachedFields(self, cache, parser):
+        with vcf_profile.Stage('cache'):
+            key = vcf_cache.GetKey(self.raw, self.encoding, parser)
+            fields = cache.Get(key)
+        if fields is None:
+            with vcf_profile.Stage('parse'):
+                fields = vcf_fastparse.GetVcardFields(
+                    self._GetFieldsText(), vcf_fastparse.PROPERTIES,
+                    parser=parser)
+            with vcf_profile.Stage('cache'):
+                cache.Put(key, fields)
+        return fields
+
+    def Get(self, prop, parser='fast'):
+        """Returns the decoded value of one property, see VcardFields."""
+        return getattr(self.GetFields((prop,), parser=parser), prop)
+
+    @property
+    def vobject(self):
+        """The card parsed by vobject, for reading.
+
+        With the lazy --binary policy binary values are replaced with
+        placeholders, see vcf_binary.
+        """
+        if self._vobject is None:
+            text = None
+            if vcf_binary.GetPolicy() == 'lazy':
+                raw, self.hidden_binary = vcf_binary.HideBinaryValues(
+                    self.raw)
+                if raw is not self.raw:
+                    # the binary values are neither decoded nor kept
+                    text = vcf_fastparse.DecodeCard(raw, self.encoding)
+            if text is None:
+                text = self.text
+            with vcf_profile.Stage('parse (vobject)'):
+                self._vobject = vcf_fastparse.ReadVobject(text)
+        return self._vobject
+
+    def Serialize(self):
+        """Returns the card as bytes ending in a line break.
+
+        These are the original bytes, byte for byte.
+        """
+        return self.raw + self.line_ending
+
+    def SerializeText(self):
+        """Same as Serialize, decoded."""
+        return self.text + self.line_ending.decode('ascii')
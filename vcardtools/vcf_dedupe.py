@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Find and merge duplicate vCards across whole address books.
+
+Rather than comparing every pair of cards, every card is filed under its
+normalized email, phone and name keys in a hash index.  Cards sharing a key
+end up in the same group (union-find), so grouping stays near-linear in the
+number of cards.  Each group is then merged with vcf_merge using one of its
+non-interactive conflict policies.  With --fuzzy, groups with similar
+names are reported, and merged with --fuzzy_merge, see vcf_fuzzy.
+
+Two passes are made over the input: the first only extracts keys with the
+fast parser, the second writes unique cards through untouched and holds
+just the members of a group until it is complete.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+import argparse
+import collections
+import functools
+import logging
+import os
+import sys
+
+from six import u
+
+from . import vcf_binary
+from . import vcf_fuzzy
+from . import vcf_inputs
+from . import vcf_merge
+from . import vcf_normalize
+from . import vcf_parallel
+from . import vcf_profile
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+log_formatter = logging.Formatter(('%(asctime)s - %(name)s - %(levelname)s'
+                                   ' - %(message)s'))
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(log_formatter)
+log_handler.setLevel(logging.DEBUG)
+logger.addHandler(log_handler)
+
+
+KEY_TYPES = ('email', 'tel', 'name')
+DEFAULT_KEY_TYPES = ('email', 'tel')
+
+
+def GetDedupeKeys(card, key_types=DEFAULT_KEY_TYPES, default_country=None):
+    """Returns the normalized keys a vcf_card.RawVcard can be matched on.
+
+    Runs in the --jobs worker processes, so it only returns strings.
+    """
+    fields = card.GetFields(('fn', 'email', 'tel'))
+    keys = set()
+    if 'email' in key_types:
+        keys.update('email:{}'.format(k) for k in
+                    map(vcf_normalize.NormalizeEmail, fields.email) if k)
+    if 'tel' in key_types:
+        keys.update('tel:{}'.format(k) for k in
+                    (vcf_normalize.NormalizePhone(t, default_country)
+                     for t in fields.tel) if k)
+    if 'name' in key_types and fields.fn:
+        name = vcf_normalize.NormalizeName(fields.fn)
+        if name:
+            keys.add('name:{}'.format(name))
+    return sorted(keys)
+
+
+def GetFuzzyDedupeRecord(card, matcher, key_types=DEFAULT_KEY_TYPES,
+                         default_country=None):
+    """Returns (exact keys, vcf_fuzzy record) of a vcf_card.RawVcard."""
+    # one parse for both
+    fields = card.GetFields(('fn', 'n', 'email', 'tel'))
+    keys = GetDedupeKeys(card, key_types=key_types,
+                         default_country=default_country)
+    return keys, matcher.GetRecord(fields.fn, fields.n)
+
+
+def IterFuzzyKeys(records, matcher):
+    """Hands the fuzzy part of records to matcher, yields the exact keys."""
+    for idx, (keys, fuzzy_record) in enumerate(records):
+        matcher.Add(idx, fuzzy_record)
+        yield keys
+
+
+def FindRoot(parent, idx):
+    """Union-find lookup with path halving."""
+    while parent[idx] != idx:
+        parent[idx] = parent[parent[idx]]
+        idx = parent[idx]
+    return idx
+
+
+def Union(parent, idx1, idx2):
+    root1 = FindRoot(parent, idx1)
+    root2 = FindRoot(parent, idx2)
+    # the earliest card stays the root, so groups keep input order
+    if root1 < root2:
+        parent[root2] = root1
+    elif root2 < root1:
+        parent[root1] = root2
+
+
+def GroupDuplicates(card_keys):
+    """Groups cards that share at least one key, directly or transitively.
+
+    Args:
+      card_keys: Iterable of key lists, one per card in input order.
+
+    Returns:
+      A list with, for every card, the index of the first card of its group.
+    """
+    parent = []
+    key_owner = {}
+    for idx, keys in enumerate(card_keys):
+        with vcf_profile.Stage('dedup'):
+            parent.append(idx)
+            for key in keys:
+                owner = key_owner.setdefault(key, idx)
+                if owner != idx:
+                    Union(parent, owner, idx)
+    return [FindRoot(parent, idx) for idx in range(len(parent))]
+
+
+def GroupSimilarDuplicates(roots, matcher, max_group):
+    """Groups the groups of GroupDuplicates whose names are similar.
+
+    Every group of cards joins at most one group of similar names, in which
+    every two of them have a similar name, so that chains of similar names
+    do not end up in one group.
+
+    Returns:
+      A list of lists of roots, see vcf_fuzzy.GroupSimilar.
+    """
+    with vcf_profile.Stage('dedup', items=0):
+        pairs = ((roots[idx1], roots[idx2], score)
+                 for idx1, idx2, score in matcher.IterPairs())
+        return vcf_fuzzy.GroupSimilar(pairs, sizes=collections.Counter(roots),
+                                      max_group=max_group)
+
+
+def JoinGroups(roots, groups):
+    """Returns roots with every group of roots made one group."""
+    parent = list(roots)
+    for group in groups:
+        for root in group[1:]:
+            Union(parent, group[0], root)
+    return [FindRoot(parent, idx) for idx in range(len(parent))]
+
+
+def IterSourceBlocks(filenames, read_jobs=vcf_inputs.DEFAULT_READ_JOBS):
+    """Yields every vCard of every file as a vcf_card.RawVcard, in order."""
+    return vcf_inputs.IterInputRawVcards(filenames, jobs=read_jobs)
+
+
+def _GetCardBytes(card, binary_output=None):
+    """Bytes of a card written through unchanged, but for binary values."""
+    if binary_output is not None and binary_output.policy != 'lazy':
+        with vcf_profile.Stage('binary'):
+            return binary_output.Apply(card.Serialize())
+    return card.Serialize()
+
+
+def WriteDeduped(filenames, roots, outfile, resolve_conflict, pretend=False,
+                 read_jobs=vcf_inputs.DEFAULT_READ_JOBS, binary_output=None):
+    """Second pass: writes unique cards byte for byte and merged groups.
+
+    Unique cards keep the charset they were read in, merged cards are
+    written in UTF-8.  binary_output, a vcf_binary.BinaryOutput, handles the binary values of
+    the cards written.  A group that cannot be parsed or merged is reported
+    and its cards written through unchanged.
+
+    Returns:
+      A (groups merged, groups that failed, vCards written) tuple.
+    """
+    sizes = collections.Counter(roots)
+    pending = {}
+    merged_count = failed_count = written = 0
+    # the bytes go under the text layer of outfile, after what it holds
+    outfile.flush()
+    out = getattr(outfile, 'buffer', outfile)
+    for idx, card in enumerate(IterSourceBlocks(filenames, read_jobs)):
+        root = roots[idx]
+        if sizes[root] == 1:
+            if not pretend:
+                data = _GetCardBytes(card, binary_output)
+                with vcf_profile.Stage('write'):
+                    out.write(data)
+                written += 1
+            continue
+        members = pending.setdefault(root, [])
+        members.append(card)
+        if len(members) < sizes[root]:
+            continue
+        del pending[root]
+        if pretend:
+            merged_count += 1
+            print('Would merge: {}'.format(' | '.join(
+                card.Get('fn') or '?' for card in members)))
+            continue
+        # imported on first use, it is slow to import
+        import vobject
+        try:
+            vcards = [card.vobject for card in members]
+            merged = vcf_merge.MergeVcardGroup(
+                vcards, resolve_conflict=resolve_conflict)
+            text = u(merged.serialize())
+        except (ValueError, vobject.base.ParseError) as e:
+            logger.error('Could not merge {}, writing its {} vCards '
+                         'unchanged: {}'.format(
+                             ' | '.join(card.Get('fn') or '?'
+                                        for card in members),
+                             len(members), e))
+            failed_count += 1
+            data = b''.join(_GetCardBytes(card, binary_output)
+                            for card in members)
+            with vcf_profile.Stage('write'):
+                out.write(data)
+            written += len(members)
+            continue
+        merged_count += 1
+        if binary_output is not None:
+            # the lazily hidden values go away with the group's cards
+            hidden = {}
+            for card in members:
+                hidden.update(card.hidden_binary)
+            with vcf_profile.Stage('binary'):
+                text = binary_output.ApplyText(text, hidden=hidden)
+        with vcf_profile.Stage('write'):
+            out.write(text.encode('utf-8'))
+        written += 1
+    return merged_count, failed_count, written
+
+
+def ParseKeyTypes(value):
+    key_types = tuple(k.strip() for k in value.split(',') if k.strip())
+    unknown = set(key_types) - set(KEY_TYPES)
+    if unknown or not key_types:
+        raise argparse.ArgumentTypeError(
+            'invalid key type(s): {}'.format(value))
+    return key_types
+
+
+def AddArguments(parser):
+    parser.add_argument('vcard_files',
+                        nargs='+',
+                        help='vCard files, directories or globs to '
+                             'deduplicate, read in order')
+    parser.add_argument('--keys',
+                        type=ParseKeyTypes,
+                        default=DEFAULT_KEY_TYPES,
+                        help='Comma separated normalized fields that '
+                             'identify a person, out of {} (default: '
+                             '{})'.format(','.join(KEY_TYPES),
+                                          ','.join(DEFAULT_KEY_TYPES)))
+    vcf_normalize.AddArguments(parser)
+    vcf_fuzzy.AddArguments(parser)
+    vcf_merge.AddPolicyArguments(parser, 'newest')
+    parser.add_argument('--pretend',
+                        action='store_true',
+                        help='Print the groups but do not write anything')
+    parser.add_argument('--outfile',
+                        nargs='?',
+                        type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='Write deduplicated vCards to file')
+    vcf_parallel.AddArguments(parser)
+    vcf_inputs.AddArguments(parser)
+    vcf_binary.AddArguments(parser)
+
+
+def main(args, usage=''):
+    try:
+        filenames = vcf_inputs.ExpandInputs(args.vcard_files)
+    except (IOError, OSError) as e:
+        print('\nERROR: {}\nCheck that all files specified exist and '
+              'permissions are OK.\n'.format(e))
+        print(usage)
+        sys.exit(1)
+    try:
+        rules = vcf_merge.GetMergeRules(args)
+    except ValueError as e:
+        print('\nERROR: {}\n'.format(e))
+        print(usage)
+        sys.exit(1)
+
+    blocks = IterSourceBlocks(filenames, args.read_jobs)
+    if args.fuzzy:
+        matcher = vcf_fuzzy.FuzzyMatcher(
+            threshold=args.fuzzy_threshold, bands=args.fuzzy_bands,
+            rows=args.fuzzy_rows, max_bucket=args.fuzzy_max_bucket)
+        get_record = functools.partial(
+            GetFuzzyDedupeRecord, matcher=matcher, key_types=args.keys,
+            default_country=args.default_country)
+        card_keys = IterFuzzyKeys(
+            vcf_parallel.MapBlocks(get_record, blocks, jobs=args.jobs),
+            matcher)
+        roots = GroupDuplicates(card_keys)
+        similar = GroupSimilarDuplicates(roots, matcher, args.fuzzy_max_group)
+        logger.info('{} pairs of similar names found, {} groups of similar '
+                    'names.'.format(matcher.matched_pairs, len(similar)))
+        if matcher.skipped_buckets:
+            logger.warning('{} name buckets too large to compare, raise '
+                           '--fuzzy_max_bucket to compare them.'.format(
+                               matcher.skipped_buckets))
+        if args.fuzzy_merge:
+            roots = JoinGroups(roots, similar)
+        else:
+            for group in similar:
+                logger.info('Similar, not merged: {}'.format(' | '.join(
+                    matcher.GetName(root) or '?' for root in group)))
+            if similar:
+                logger.info('Pass --fuzzy_merge to merge them.')
+    else:
+        get_keys = functools.partial(GetDedupeKeys, key_types=args.keys,
+                                     default_country=args.default_country)
+        card_keys = vcf_parallel.MapBlocks(get_keys, blocks, jobs=args.jobs)
+        roots = GroupDuplicates(card_keys)
+
+    binary_output = None
+    if args.binary != 'keep':
+        vcf_binary.SetPolicy(args.binary)
+        # photos/ goes next to the output file
+        name = getattr(args.outfile, 'name', '')
+        directory = (os.path.dirname(os.path.abspath(name))
+                     if name and not name.startswith('<') else os.getcwd())
+        binary_output = vcf_binary.BinaryOutput(args.binary, directory)
+    merged_count, failed_count, written = WriteDeduped(
+        filenames, roots, args.outfile, rules, pretend=args.pretend,
+        read_jobs=args.read_jobs, binary_output=binary_output)
+    if args.pretend:
+        logger.info('{} vCards read, {} duplicate groups would be merged, '
+                    '{} vCards would be written.'.format(
+                        len(roots), merged_count, len(set(roots))))
+    else:
+        logger.info('{} vCards read, {} duplicate groups merged, {} vCards '
+                    'written.'.format(len(roots), merged_count, written))
+    if failed_count:
+        logger.error('{} duplicate groups could not be merged and were '
+                     'written unchanged.'.format(failed_count))
+    for line in rules.Summary():
+        logger.info(line)
+
+
+def dispatch_main():
+    parser = argparse.ArgumentParser(prog='vcf_dedupe')
+    AddArguments(parser)
+    args = parser.parse_args(sys.argv[1:])
+    main(args, usage=parser.format_usage())
+
+
+if __name__ == '__main__':
+    dispatch_main()
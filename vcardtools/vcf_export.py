@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Structured output of vCard fields for list --format.
+
+One row per card, with the columns picked by --field, so that downstream
+jobs never have to parse vCards or the ad-hoc text listing again.  Rows are
+written in batches: CSV and TSV through csv.writer.writerows, JSON lines
+as one joined string per batch, and Parquet, when pyarrow is installed,
+as one record batch per batch of rows.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import csv
+import itertools
+import json
+
+from . import vcf_profile
+
+
+FORMATS = ('text', 'csv', 'tsv', 'jsonl', 'parquet')
+
+# Column name to the vcf_fastparse property it is read from.
+COLUMN_PROPERTIES = {
+    'fn': 'fn',
+    'family': 'n',
+    'given': 'n',
+    'email': 'email',
+    'tel': 'tel',
+    'uid': 'uid',
+    'rev': 'rev',
+}
+COLUMNS = ('fn', 'family', 'given', 'email', 'tel', 'uid', 'rev')
+LIST_COLUMNS = frozenset(['email', 'tel'])
+DEFAULT_COLUMNS = ('fn', 'email', 'tel')
+
+# Joins the values of list columns in CSV and TSV.
+LIST_SEPARATOR = ';'
+
+BATCH_SIZE = 1024
+
+
+class ExportError(Exception):
+    pass
+
+
+def ParseColumns(value):
+    """argparse type of --field: 'fn,email' -> ('fn', 'email')."""
+    columns = tuple(c.strip() for c in value.split(',') if c.strip())
+    unknown = [c for c in columns if c not in COLUMN_PROPERTIES]
+    if unknown or not columns:
+        raise argparse.ArgumentTypeError(
+            'invalid field(s): {}, choose from {}'.format(
+                value, ','.join(COLUMNS)))
+    return columns
+
+
+def GetProperties(columns):
+    """vcf_fastparse properties needed to fill the columns."""
+    properties = []
+    for column in columns:
+        prop = COLUMN_PROPERTIES[column]
+        if prop not in properties:
+            properties.append(prop)
+    return tuple(properties)
+
+
+def GetRow(fields, columns):
+    """Returns the values of the columns from a vcf_fastparse.VcardFields.
+
+    List columns are lists, the others strings or None.
+    """
+    row = []
+    for column in columns:
+        if column == 'family':
+            row.append(fields.n[0] if fields.n else None)
+        elif column == 'given':
+            row.append(fields.n[1] if fields.n else None)
+        else:
+            row.append(getattr(fields, column))
+    return tuple(row)
+
+
+def GetCardRow(card, columns, parser='fast'):
+    """Same as GetRow for a vcf_card.RawVcard, run in the --jobs workers."""
+    return GetRow(card.GetFields(GetProperties(columns), parser=parser),
+                  columns)
+
+
+def IterBatches(rows, size=BATCH_SIZE):
+    """Yields lists of up to size items."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _FlatRow(row, columns, tabs=False):
+    flat = []
+    for column, value in zip(columns, row):
+        if column in LIST_COLUMNS:
+            value = LIST_SEPARATOR.join(value)
+        elif value is None:
+            value = ''
+        if tabs:
+            # TSV has no quoting
+            value = ' '.join(value.split())
+        flat.append(value)
+    return flat
+
+
+def WriteDelimited(rows, columns, outfile, dialect='excel'):
+    """Writes a header and the rows as CSV, or TSV for dialect excel-tab."""
+    tabs = dialect == 'excel-tab'
+    writer = csv.writer(outfile, dialect=dialect, lineterminator='\n')
+    writer.writerow(columns)
+    count = 0
+    for batch in IterBatches(rows):
+        with vcf_profile.Stage('write', items=len(batch)):
+            writer.writerows([_FlatRow(row, columns, tabs) for row in batch])
+        count += len(batch)
+    return count
+
+
+def WriteJsonLines(rows, columns, outfile):
+    """Writes one JSON object per row and line."""
+    count = 0
+    for batch in IterBatches(rows):
+        with vcf_profile.Stage('write', items=len(batch)):
+            outfile.write(''.join(
+                json.dumps(dict(zip(columns, row)), ensure_ascii=False,
+                           sort_keys=True) + '\n'
+                for row in batch))
+        count += len(batch)
+    return count
+
+
+def ImportArrow():
+    """Returns the pyarrow and pyarrow.parquet modules.
+
+    pyarrow is optional and slow to import, so only --format parquet loads
+    it.
+
+    Raises:
+      ExportError: pyarrow is not installed.
+    """
+    try:
+        import pyarrow
+        from pyarrow import parquet
+    except ImportError:
+        raise ExportError('--format parquet needs pyarrow, '
+                          'pip install pyarrow')
+    return pyarrow, parquet
+
+
+def GetArrowSchema(columns):
+    pyarrow, _ = ImportArrow()
+    return pyarrow.schema([
+        (column, pyarrow.list_(pyarrow.string()) if column in LIST_COLUMNS
+         else pyarrow.string())
+        for column in columns])
+
+
+def WriteParquet(rows, columns, path):
+    """Writes the rows to a Parquet file, one row group per batch.
+
+    Raises:
+      ExportError: pyarrow is not installed.
+    """
+    pyarrow, parquet = ImportArrow()
+    schema = GetArrowSchema(columns)
+    writer = parquet.ParquetWriter(path, schema)
+    count = 0
+    try:
+        for batch in IterBatches(rows):
+            arrays = [pyarrow.array(list(values), type=field.type)
+                      for values, field in zip(zip(*batch), schema)]
+            with vcf_profile.Stage('write', items=len(batch)):
+                writer.write_table(pyarrow.Table.from_arrays(
+                    arrays, schema=schema))
+            count += len(batch)
+    finally:
+        writer.close()
+    return count
+
+
+def WriteRows(rows, columns, fmt, outfile=None, path=None):
+    """Writes rows in one of the FORMATS but text.
+
+    Args:
+      rows: Iterable of rows as returned by GetRow.
+      columns: Column names of the rows.
+      fmt (str): csv, tsv, jsonl or parquet.
+      outfile: Text stream for the row formats.
+      path (str): Output file for parquet.
+
+    Returns:
+      The number of rows written.
+    """
+    if fmt == 'parquet':
+        if not path:
+            raise ExportError('--format parquet needs --outfile')
+        return WriteParquet(rows, columns, path)
+    if fmt == 'jsonl':
+        return WriteJsonLines(rows, columns, outfile)
+    return WriteDelimited(rows, columns, outfile,
+                          dialect='excel-tab' if fmt == 'tsv' else 'excel')
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Minimal vCard line parser for the handful of fields we index on.
+
+Listing and naming only ever look at FN, N, EMAIL and a few more
+properties, so building the full vobject object graph for every card is
+wasted work.  This parser unfolds lines, splits parameters, undoes
+quoted-printable and charset encodings and text escaping, and only for the
+requested properties.  vobject is still used whenever a card has to be
+re-serialized or merged.
+
+Old exports (vCard 2.1) are not always UTF-8: cards that are not are
+decoded with the CHARSET they declare, or as Windows-1252.  Inline PHOTO,
+LOGO and SOUND data, often most of an export, is cut out of the raw bytes
+before anything is decoded or split into lines.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import binascii
+import codecs
+import re
+
+import six
+
+
+NAME_PARTS = ('family', 'given', 'additional', 'prefix', 'suffix')
+
+# Bare vCard 2.1 parameters that are not types, e.g. "NOTE;QUOTED-PRINTABLE:"
+ENCODING_VALUES = frozenset(['QUOTED-PRINTABLE', 'BASE64', 'B', '8BIT',
+                             '7BIT'])
+
+PARSERS = ('fast', 'vobject')
+
+# Cards that are not valid in the encoding of their file are decoded with
+# the charsets they declare, then with these.  latin-1 never fails.
+FALLBACK_ENCODINGS = ('cp1252', 'latin-1')
+CHARSET_REGEX = re.compile(br';CHARSET=([-\w]+)', re.I)
+
+# Binary values are only looked for in cards at least this big.
+MIN_BINARY_BYTES = 4096
+BINARY_PROPERTIES = frozenset([b'PHOTO', b'LOGO', b'SOUND'])
+
+LINE_SPLIT_REGEX = re.compile(r'\r\n|\r|\n')
+ESCAPE_REGEX = re.compile(r'\\(.)', re.S)
+
+
+class VcardFields(object):
+    """The common fields of a single vCard.
+
+    Attributes:
+      fn (string): Formatted name or None.
+      n (tuple): Name components in NAME_PARTS order or None.
+      email (list): Email addresses in card order.
+      tel (list): Telephone numbers in card order.
+      uid (string): UID or None.
+      rev (string): REV timestamp as written in the card or None.
+    """
+    __slots__ = ('fn', 'n', 'email', 'tel', 'uid', 'rev')
+
+    def __init__(self):
+        self.fn = None
+        self.n = None
+        self.email = []
+        self.tel = []
+        self.uid = None
+        self.rev = None
+
+    def __eq__(self, other):
+        return (isinstance(other, VcardFields) and
+                all(getattr(self, s) == getattr(other, s)
+                    for s in self.__slots__))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'VcardFields({})'.format(', '.join(
+            '{}={!r}'.format(s, getattr(self, s)) for s in self.__slots__))
+
+
+PROPERTIES = VcardFields.__slots__
+LIST_PROPERTIES = frozenset(['email', 'tel'])
+DEFAULT_PROPERTIES = ('fn', 'n', 'email')
+
+
+def DecodeCard(raw, encoding='utf-8'):
+    """Decodes a raw card block, sniffing the charset of legacy cards.
+
+    The encoding of the file is tried first, then the CHARSET parameters
+    of the card and FALLBACK_ENCODINGS.
+    """
+    try:
+        return raw.decode(encoding)
+    except UnicodeDecodeError:
+        pass
+    charsets = [m.group(1).decode('ascii') for m in CHARSET_REGEX.finditer(raw)]
+    for charset in charsets + list(FALLBACK_ENCODINGS):
+        try:
+            return raw.decode(charset)
+        except (UnicodeDecodeError, LookupError):
+            pass
+
+
+def _IsBinaryValue(head, value_start):
+    name = head.split(b';', 1)[0].rpartition(b'.')[2].upper()
+    if name not in BINARY_PROPERTIES:
+        return False
+    head = head.upper()
+    return (b'BASE64' in head or b'ENCODING=B' in head or
+            value_start.upper() == b'DATA:')
+
+
+def FindBinaryValues(raw):
+    """Yields (start, colon, end) of every inline base64 PHOTO, LOGO and
+    SOUND property of a raw card.
+
+    raw[start:end] is the whole property, folded lines included, and
+    raw[colon + 1:end] its value.
+    """
+    colon = raw.find(b':')
+    while colon >= 0:
+        start = raw.rfind(b'\n', 0, colon) + 1
+        line_end = raw.find(b'\n', colon)
+        if line_end < 0:
+            return
+        # base64 never holds a ':', the next one is on the line of the
+        # next property
+        next_colon = raw.find(b':', line_end)
+        if next_colon >= 0 and _IsBinaryValue(raw[start:colon],
+                                              raw[colon + 1:colon + 6]):
+            end = raw.rfind(b'\n', line_end, next_colon) + 1
+            if raw[end:end + 1] not in (b' ', b'\t'):
+                yield start, colon, end
+        colon = next_colon
+
+
+def StripBinaryValues(raw, min_bytes=MIN_BINARY_BYTES):
+    """Cuts inline base64 PHOTO, LOGO and SOUND values out of a raw card.
+
+    None of the properties parsed here needs them, and a photo is often
+    hundreds of times the size of the rest of the card.  Cards smaller than
+    min_bytes are returned as they are.
+    """
+    if len(raw) < min_bytes:
+        return raw
+    pieces = []
+    pos = 0
+    for start, _, end in FindBinaryValues(raw):
+        pieces.append(raw[pos:start])
+        pos = end
+    if not pieces:
+        return raw
+    pieces.append(raw[pos:])
+    return b''.join(pieces)
+
+
+def _IsQuotedPrintable(head):
+    return 'QUOTED-PRINTABLE' in head.upper()
+
+
+def UnfoldLines(card):
+    """Yields the logical content lines of a vCard block.
+
+    Undoes RFC 6350 folding (continuation lines start with a space or tab)
+    as well as vCard 2.1 quoted-printable soft line breaks (a trailing '=').
+    """
+    current = None
+    for line in LINE_SPLIT_REGEX.split(card):
+        if current is not None:
+            if line[:1] in (' ', '\t'):
+                current += line[1:]
+                continue
+            if (current.endswith('=') and
+                    _IsQuotedPrintable(current[:current.find(':')])):
+                current = current[:-1] + line
+                continue
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def SplitEscaped(value, sep):
+    """Splits a value on every separator that is not backslash escaped."""
+    if '\\' not in value:
+        return value.split(sep)
+    pieces = []
+    current = []
+    chars = iter(value)
+    for ch in chars:
+        if ch == '\\':
+            current.append(ch)
+            current.append(next(chars, ''))
+        elif ch == sep:
+            pieces.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    pieces.append(''.join(current))
+    return pieces
+
+
+def _UnescapeChar(match):
+    ch = match.group(1)
+    if ch in 'nN':
+        return '\n'
+    return ch
+
+
+def UnescapeText(value):
+    """Undoes vCard text escaping (\\n, \\, \\; and \\\\)."""
+    if '\\' not in value:
+        return value
+    return ESCAPE_REGEX.sub(_UnescapeChar, value)
+
+
+def _SplitQuoted(head, sep):
+    """Splits on separators outside of double quotes."""
+    if '"' not in head:
+        return head.split(sep)
+    pieces = []
+    current = []
+    in_quotes = False
+    for ch in head:
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == sep and not in_quotes:
+            pieces.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    pieces.append(''.join(current))
+    return pieces
+
+
+def ParseParams(param_list):
+    """Turns ['TYPE=HOME', 'PREF', ...] into {'TYPE': ['HOME', 'PREF']}."""
+    params = {}
+    for param in param_list:
+        if '=' in param:
+            key, val = param.split('=', 1)
+            key = key.strip().upper()
+        else:
+            val = param
+            key = 'ENCODING' if param.upper() in ENCODING_VALUES else 'TYPE'
+        params.setdefault(key, []).append(val.strip().strip('"'))
+    return params
+
+
+def SplitContentLine(line):
+    """Splits a logical line into (group, name, params, value).
+
+    The name is lowercased, the value is still encoded and escaped.
+    Returns None for lines without a value.
+    """
+    colon = line.find(':')
+    if colon < 0:
+        return None
+    quote = line.find('"')
+    if 0 <= quote < colon:
+        colon = len(_SplitQuoted(line, ':')[0])
+    head = _SplitQuoted(line[:colon], ';')
+    group, _, name = head[0].rpartition('.')
+    return group or None, name.lower(), ParseParams(head[1:]), line[colon + 1:]
+
+
+def _LookupCharset(params):
+    charset = params.get('CHARSET', ['utf-8'])[0]
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return charset
+
+
+def DecodeValue(value, params):
+    """Undoes the transfer encoding and charset of a raw value."""
+    encodings = [e.upper() for e in params.get('ENCODING', ())]
+    try:
+        if 'QUOTED-PRINTABLE' in encodings:
+            raw = binascii.a2b_qp(value.encode('utf-8'))
+        elif 'BASE64' in encodings or 'B' in encodings:
+            # text values of some phone exports
+            raw = binascii.a2b_base64(value.encode('utf-8'))
+        else:
+            return value
+    except (binascii.Error, ValueError):
+        return value
+    return raw.decode(_LookupCharset(params), 'replace')
+
+
+def _DecodeName(value):
+    parts = []
+    for part in SplitEscaped(value, ';')[:len(NAME_PARTS)]:
+        parts.append(' '.join(UnescapeText(p)
+                              for p in SplitEscaped(part, ',')))
+    parts.extend([''] * (len(NAME_PARTS) - len(parts)))
+    return tuple(parts)
+
+
+def ParseVcardFields(card, properties=DEFAULT_PROPERTIES):
+    """Extracts the requested properties from a raw vCard block.
+
+    Args:
+      card (string): A single BEGIN:VCARD...END:VCARD block.
+      properties: Names from PROPERTIES to extract, the others stay unset.
+
+    Returns:
+      A VcardFields record.
+    """
+    wanted = frozenset(properties)
+    fields = VcardFields()
+    for line in UnfoldLines(card):
+        # cheap look at the name before doing any real parsing
+        name = line[:line.find(':')].split(';', 1)[0]
+        name = name.rpartition('.')[2].lower()
+        if name not in wanted:
+            continue
+        parsed = SplitContentLine(line)
+        if parsed is None:
+            continue
+        _, _, params, value = parsed
+        value = DecodeValue(value, params)
+        if name == 'n':
+            if fields.n is None:
+                fields.n = _DecodeName(value)
+        elif name in LIST_PROPERTIES:
+            getattr(fields, name).append(UnescapeText(value))
+        elif getattr(fields, name) is None:
+            setattr(fields, name, UnescapeText(value))
+    return fields
+
+
+def _VobjectText(value):
+    if isinstance(value, list):
+        return ' '.join(value)
+    return six.text_type(value)
+
+
+def FieldsFromVobject(vcard):
+    """Builds the same VcardFields record from a parsed vobject vCard."""
+    fields = VcardFields()
+    contents = vcard.contents
+    if 'fn' in contents:
+        fields.fn = _VobjectText(contents['fn'][0].value)
+    if 'n' in contents:
+        name = contents['n'][0].value
+        fields.n = tuple(_VobjectText(getattr(name, part))
+                         for part in NAME_PARTS)
+    fields.email = [_VobjectText(e.value) for e in contents.get('email', ())]
+    fields.tel = [_VobjectText(t.value) for t in contents.get('tel', ())]
+    if 'uid' in contents:
+        fields.uid = _VobjectText(contents['uid'][0].value)
+    if 'rev' in contents:
+        fields.rev = _VobjectText(contents['rev'][0].value)
+    return fields
+
+
+def ReadVobject(card):
+    """Parses a decoded vCard block with vobject."""
+    import vobject
+    if 'QUOTED-PRINTABLE' in card.upper():
+        # vobject does not join quoted-printable soft line breaks
+        card = '\r\n'.join(UnfoldLines(card))
+    return vobject.readOne(card)
+
+
+def GetVcardFields(card, properties=DEFAULT_PROPERTIES, parser='fast'):
+    """Extracts fields from a raw vCard block with the chosen parser."""
+    if parser == 'vobject':
+        return FieldsFromVobject(ReadVobject(card))
+    return ParseVcardFields(card, properties=properties)
+
+
+def AddArguments(parser):
+    parser.add_argument('--parser',
+                        choices=PARSERS,
+                        default='fast',
+                        help='Parser used to read names and emails')
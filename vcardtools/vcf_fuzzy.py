@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Near-duplicate name matching for dedupe --fuzzy.
+
+Exact keys miss "Jon Smith" and "John Smith", and scoring every pair of
+names is quadratic.  Cards are first filed into small candidate buckets
+(blocking): a Soundex key of the family name plus the initial of the given
+name, and locality-sensitive hashing bands of a MinHash signature of the
+character bigrams of the name.  Only cards sharing a bucket are scored,
+with the exact Jaccard similarity of their bigrams.
+
+More bands or fewer rows per band find more candidates (recall), a higher
+threshold accepts fewer of them (precision).
+
+Similarity is not transitive: "Jon Smith" is like "John Smith" which is
+like "Joan Smyth", a chain that ends far from where it started.  Matching
+pairs are therefore not simply joined, see GroupSimilar.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import collections
+import random
+import unicodedata
+import zlib
+
+from . import vcf_normalize
+
+
+DEFAULT_THRESHOLD = 0.6
+DEFAULT_BANDS = 10
+DEFAULT_ROWS = 3
+DEFAULT_MAX_BUCKET = 100
+DEFAULT_MAX_GROUP = 5
+
+SHINGLE_SIZE = 2
+
+SOUNDEX_CODES = dict(
+    [(c, '1') for c in 'bfpv'] + [(c, '2') for c in 'cgjkqsxz'] +
+    [(c, '3') for c in 'dt'] + [('l', '4')] + [(c, '5') for c in 'mn'] +
+    [('r', '6')])
+
+
+def _StripAccents(name):
+    """'Smith,  José' -> 'smith jose', None if nothing is left."""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c if c.isalnum() else ' ' for c in name
+                   if not unicodedata.combining(c))
+    return vcf_normalize.NormalizeName(name)
+
+
+def FoldName(name):
+    """'  Smith,  José ' -> 'jose smith'.
+
+    Accents and punctuation are dropped and the words sorted, so that
+    "Smith, John" and "John Smith" compare equal.
+    """
+    name = _StripAccents(name or '')
+    if not name:
+        return None
+    return ' '.join(sorted(name.split(' ')))
+
+
+def Soundex(word):
+    """American Soundex of a word: 'Robert' -> 'R163', None without letters.
+    """
+    word = [c for c in _StripAccents(word) or '' if 'a' <= c <= 'z']
+    if not word:
+        return None
+    code = [word[0].upper()]
+    last = SOUNDEX_CODES.get(word[0])
+    for c in word[1:]:
+        digit = SOUNDEX_CODES.get(c)
+        if digit and digit != last:
+            code.append(digit)
+            if len(code) == 4:
+                break
+        if c not in 'hw':
+            # vowels separate equal codes, h and w do not
+            last = digit
+    return ''.join(code).ljust(4, '0')
+
+
+def Shingles(name, size=SHINGLE_SIZE):
+    """Set of the character n-grams of a folded name, padded with spaces."""
+    name = ' {} '.format(name)
+    return frozenset(name[i:i + size] for i in range(len(name) - size + 1))
+
+
+def Jaccard(set1, set2):
+    if not set1 or not set2:
+        return 0.0
+    common = len(set1 & set2)
+    return common / (len(set1) + len(set2) - common)
+
+
+class FuzzyMatcher(object):
+    """Blocking and scoring of near-duplicate names.
+
+    Instances are pickled to the --jobs workers, which call GetRecord; the
+    main process adds the records and asks for matching pairs.
+
+    Attributes:
+      threshold (float): Minimal Jaccard similarity of two names.
+      bands (int): Number of LSH bands.
+      rows (int): MinHash values per band.
+      max_bucket (int): Buckets with more cards are not scored, they are
+          too unspecific to be worth the quadratic cost.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, bands=DEFAULT_BANDS,
+                 rows=DEFAULT_ROWS, max_bucket=DEFAULT_MAX_BUCKET, seed=0):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.max_bucket = max_bucket
+        # fixed seed: every worker must use the same permutations
+        rng = random.Random(seed)
+        self._masks = [rng.getrandbits(32) for _ in range(bands * rows)]
+        self._names = {}
+        self._buckets = collections.defaultdict(list)
+        self.skipped_buckets = 0
+        self.matched_pairs = 0
+
+    def __getstate__(self):
+        # the workers only need the parameters, not the collected cards
+        return (self.threshold, self.bands, self.rows, self.max_bucket,
+                self._masks)
+
+    def __setstate__(self, state):
+        (self.threshold, self.bands, self.rows, self.max_bucket,
+         self._masks) = state
+        self._names = {}
+        self._buckets = collections.defaultdict(list)
+        self.skipped_buckets = 0
+        self.matched_pairs = 0
+
+    def MinHash(self, shingles):
+        """MinHash signature of a set of shingles.
+
+        The hash functions are a crc32 xor-ed with random masks, about three
+        times faster than (a * x + b) % p permutations and good enough to
+        pick candidates that are then scored exactly.
+        """
+        hashes = [zlib.crc32(s.encode('utf-8')) & 0xffffffff
+                  for s in shingles]
+        return [min(map(mask.__xor__, hashes)) for mask in self._masks]
+
+    def GetRecord(self, fn, n=None):
+        """Returns (folded name, bucket keys) of a card, or None.
+
+        Args:
+          fn (str): Formatted name.
+          n (tuple): Name components in vcf_fastparse.NAME_PARTS order.
+        """
+        if n and n[0]:
+            family, given = n[0], n[1]
+        else:
+            words = (fn or '').split()
+            family = words[-1] if words else ''
+            given = words[0] if len(words) > 1 else ''
+        name = FoldName(fn or ' '.join((given, family)))
+        if not name:
+            return None
+        keys = []
+        sound = Soundex(family)
+        if sound:
+            initial = (_StripAccents(given) or '?')[0]
+            keys.append('s:{}:{}'.format(sound, initial))
+        signature = self.MinHash(Shingles(name))
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            # ints hash the same in every process, and a rare collision
+            # only costs one more candidate to score
+            keys.append(hash(tuple([band] + rows)))
+        return name, keys
+
+    def Add(self, idx, record):
+        """Files card number idx under the keys of its record."""
+        if record is None:
+            return
+        name, keys = record
+        self._names[idx] = name
+        for key in keys:
+            self._buckets[key].append(idx)
+
+    def GetName(self, idx):
+        """Folded name of card number idx, None if it has none."""
+        return self._names.get(idx)
+
+    def IterPairs(self):
+        """Yields (idx1, idx2, score) for every matching pair of cards."""
+        scored = set()
+        shingles = {}
+        for members in self._buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > self.max_bucket:
+                self.skipped_buckets += 1
+                continue
+            for i, idx1 in enumerate(members):
+                for idx2 in members[i + 1:]:
+                    if (idx1, idx2) in scored:
+                        continue
+                    scored.add((idx1, idx2))
+                    for idx in (idx1, idx2):
+                        if idx not in shingles:
+                            shingles[idx] = Shingles(self._names[idx])
+                    score = Jaccard(shingles[idx1], shingles[idx2])
+                    if score >= self.threshold:
+                        self.matched_pairs += 1
+                        yield idx1, idx2, score
+
+
+def GroupSimilar(pairs, sizes=None, max_group=DEFAULT_MAX_GROUP):
+    """Groups ids of which every two are similar (complete linkage).
+
+    Ids are taken in increasing order as the seed of a group, which then
+    gets the seed's most similar neighbours that are similar to all the
+    members so far and not in a group yet, up to max_group.
+
+    >>> GroupSimilar([(0, 1, 0.8), (1, 2, 0.8)])
+    [[0, 1]]
+    >>> GroupSimilar([(0, 1, 0.8), (1, 2, 0.7), (0, 2, 0.6)])
+    [[0, 1, 2]]
+
+    Args:
+      pairs: Iterable of (id1, id2, score) of similar ids.
+      sizes: Optional {id: number of cards}, for max_group, 1 by default.
+      max_group (int): Maximal number of cards in a group.
+
+    Returns:
+      A list of groups of at least two ids, each in increasing order.
+    """
+    neighbours = collections.defaultdict(dict)
+    for id1, id2, score in pairs:
+        if id1 != id2:
+            neighbours[id1][id2] = max(score, neighbours[id1].get(id2, 0))
+            neighbours[id2][id1] = neighbours[id1][id2]
+    sizes = sizes or {}
+    grouped = set()
+    groups = []
+    for seed in sorted(neighbours):
+        if seed in grouped:
+            continue
+        group = [seed]
+        size = sizes.get(seed, 1)
+        candidates = sorted(neighbours[seed].items(),
+                            key=lambda item: (-item[1], item[0]))
+        for other, _ in candidates:
+            if other in grouped or size + sizes.get(other, 1) > max_group:
+                continue
+            if all(member in neighbours[other] for member in group[1:]):
+                group.append(other)
+                size += sizes.get(other, 1)
+        if len(group) > 1:
+            grouped.update(group)
+            groups.append(sorted(group))
+    return groups
+
+
+def _ParseThreshold(value):
+    try:
+        threshold = float(value)
+    except ValueError:
+        threshold = -1
+    if not 0 < threshold <= 1:
+        raise argparse.ArgumentTypeError(
+            'invalid threshold: {}, must be in ]0, 1]'.format(value))
+    return threshold
+
+
+def AddArguments(parser):
+    parser.add_argument('--fuzzy',
+                        action='store_true',
+                        help='Also group cards with similar names, such as '
+                             '"Jon Smith" and "John Smith"')
+    parser.add_argument('--fuzzy_merge',
+                        action='store_true',
+                        help='Merge the groups of similar names found by '
+                             '--fuzzy, which are only reported otherwise')
+    parser.add_argument('--fuzzy_threshold',
+                        type=_ParseThreshold,
+                        default=DEFAULT_THRESHOLD,
+                        help='Minimal similarity of two names, between 0 '
+                             'and 1 (default: {})'.format(DEFAULT_THRESHOLD))
+    parser.add_argument('--fuzzy_bands',
+                        type=int,
+                        default=DEFAULT_BANDS,
+                        help='Number of hashing bands, more find more '
+                             'candidates (default: {})'.format(DEFAULT_BANDS))
+    parser.add_argument('--fuzzy_rows',
+                        type=int,
+                        default=DEFAULT_ROWS,
+                        help='Hashes per band, more find fewer candidates '
+                             '(default: {})'.format(DEFAULT_ROWS))
+    parser.add_argument('--fuzzy_max_bucket',
+                        type=int,
+                        default=DEFAULT_MAX_BUCKET,
+                        help='Skip candidate buckets with more cards '
+                             '(default: {})'.format(DEFAULT_MAX_BUCKET))
+    parser.add_argument('--fuzzy_max_group',
+                        type=int,
+                        default=DEFAULT_MAX_GROUP,
+                        help='Put at most this many cards in a group of '
+                             'similar names (default: {})'.format(
+                                 DEFAULT_MAX_GROUP))
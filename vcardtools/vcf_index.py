@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Persistent sidecar index of the cards in a vCard file.
+
+The index is an SQLite database next to the vCard file ("contacts.vcf"
+gets "contacts.vcf.vcfidx") holding, for every card, its byte offset and
+length in the file plus the fields extracted by vcf_fastparse.  Repeated
+list, lookup and split runs answer from it and seek straight to the cards
+they need instead of re-parsing the whole file.
+
+The index remembers the size and mtime of the file it was built from, and
+the --default_country its phone number keys were normalized with.  When
+any of them changes it is rebuilt incrementally: the file is scanned again
+but cards whose content hash is already known are not re-parsed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+
+from . import vcf_fastparse
+from . import vcf_normalize
+from . import vcf_reader
+
+
+INDEX_SUFFIX = '.vcfidx'
+INDEX_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    version INTEGER, size INTEGER, mtime REAL, country TEXT);
+CREATE TABLE IF NOT EXISTS cards (
+    idx INTEGER PRIMARY KEY, offset INTEGER, length INTEGER, hash TEXT,
+    fn TEXT, n TEXT, email TEXT, tel TEXT, uid TEXT, rev TEXT);
+CREATE TABLE IF NOT EXISTS keys (key TEXT, card INTEGER);
+CREATE INDEX IF NOT EXISTS keys_key ON keys (key);
+"""
+
+FIELD_COLUMNS = ('fn', 'n', 'email', 'tel', 'uid', 'rev')
+
+
+def GetIndexPath(vcard_path):
+    return vcard_path + INDEX_SUFFIX
+
+
+def HashBlock(block):
+    """Content hash of a raw vCard block (bytes)."""
+    return hashlib.sha1(block).hexdigest()
+
+
+def OpenIndex(vcard_path, index_path=None):
+    """Opens, creating it if needed, the index of a vCard file."""
+    # only --index needs it
+    import sqlite3
+    conn = sqlite3.connect(index_path or GetIndexPath(vcard_path))
+    conn.executescript(SCHEMA)
+    row = conn.execute('SELECT version FROM meta').fetchone()
+    if row is not None and row[0] != INDEX_VERSION:
+        # written by another release, whose tables may differ, start over
+        conn.executescript('DROP TABLE meta; DROP TABLE cards; '
+                           'DROP TABLE keys;')
+        conn.executescript(SCHEMA)
+    return conn
+
+
+def IsIndexCurrent(conn, vcard_path, default_country=None):
+    st = os.stat(vcard_path)
+    row = conn.execute('SELECT size, mtime, country FROM meta').fetchone()
+    return row is not None and tuple(row) == (st.st_size, st.st_mtime,
+                                              default_country)
+
+
+def _FieldsToRow(fields):
+    return (fields.fn,
+            json.dumps(fields.n) if fields.n is not None else None,
+            json.dumps(fields.email),
+            json.dumps(fields.tel),
+            fields.uid,
+            fields.rev)
+
+
+def _RowToFields(row):
+    fields = vcf_fastparse.VcardFields()
+    fn, n, email, tel, uid, rev = row
+    fields.fn = fn
+    fields.n = tuple(json.loads(n)) if n is not None else None
+    fields.email = json.loads(email)
+    fields.tel = json.loads(tel)
+    fields.uid = uid
+    fields.rev = rev
+    return fields
+
+
+def GetLookupKeys(fields, default_country=None):
+    """Normalized keys a card can be looked up by."""
+    keys = set()
+    for email in fields.email:
+        key = vcf_normalize.NormalizeEmail(email)
+        if key:
+            keys.add('email:' + key)
+    for tel in fields.tel:
+        key = vcf_normalize.NormalizePhone(tel, default_country)
+        if key:
+            keys.add('tel:' + key)
+    for name in (fields.fn, ' '.join(p for p in fields.n or () if p)):
+        key = vcf_normalize.NormalizeName(name or '')
+        if key:
+            keys.add('name:' + key)
+    return keys
+
+
+def UpdateIndex(conn, vcard_path, encoding='utf-8', default_country=None):
+    """Brings the index up to date with the vCard file.
+
+    Phone numbers are normalized with default_country, see
+    vcf_normalize.NormalizePhone.
+
+    Returns:
+      A (reused, parsed) tuple with the number of cards taken over from the
+      previous index and the number that had to be parsed, or None when the
+      index was already current.
+    """
+    if IsIndexCurrent(conn, vcard_path, default_country):
+        return None
+    st = os.stat(vcard_path)
+    reused = parsed = 0
+    select_old = ('SELECT {} FROM cards_old WHERE hash = ? LIMIT 1'.format(
+        ', '.join(FIELD_COLUMNS)))
+    with conn:
+        # meta goes first so that an interrupted update is never current
+        conn.executescript('DELETE FROM meta;'
+                           'DELETE FROM keys;'
+                           'DROP TABLE IF EXISTS cards_old;'
+                           'ALTER TABLE cards RENAME TO cards_old;'
+                           'CREATE INDEX cards_old_hash ON cards_old (hash);')
+        conn.executescript(SCHEMA)
+        with open(vcard_path, 'rb') as f:
+            for idx, (offset, block) in enumerate(
+                    vcf_reader.IterVcardBlocks(f)):
+                block_hash = HashBlock(block)
+                row = conn.execute(select_old, (block_hash,)).fetchone()
+                if row is not None:
+                    fields = _RowToFields(row)
+                    reused += 1
+                else:
+                    fields = vcf_fastparse.ParseVcardFields(
+                        vcf_fastparse.DecodeCard(
+                            vcf_fastparse.StripBinaryValues(block), encoding),
+                        vcf_fastparse.PROPERTIES)
+                    row = _FieldsToRow(fields)
+                    parsed += 1
+                conn.execute('INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, '
+                             '?, ?, ?)',
+                             (idx, offset, len(block), block_hash) +
+                             tuple(row))
+                conn.executemany('INSERT INTO keys VALUES (?, ?)',
+                                 ((key, idx) for key in
+                                  GetLookupKeys(fields, default_country)))
+        conn.execute('DROP TABLE cards_old')
+        conn.execute('DELETE FROM meta')
+        conn.execute('INSERT INTO meta VALUES (?, ?, ?, ?)',
+                     (INDEX_VERSION, st.st_size, st.st_mtime,
+                      default_country))
+    return reused, parsed
+
+
+def CountCards(conn):
+    return conn.execute('SELECT COUNT(*) FROM cards').fetchone()[0]
+
+
+def IterIndexedFields(conn):
+    """Yields (offset, length, VcardFields) for every card in file order."""
+    cursor = conn.execute('SELECT offset, length, {} FROM cards '
+                          'ORDER BY idx'.format(', '.join(FIELD_COLUMNS)))
+    for row in cursor:
+        yield row[0], row[1], _RowToFields(row[2:])
+
+
+def LookupCards(conn, term, default_country=None):
+    """Returns (offset, length) of every card matching an email, phone
+    number or name, in file order.
+
+    default_country must be the one the index was updated with.
+    """
+    keys = set()
+    for prefix, key in (
+            ('email:', vcf_normalize.NormalizeEmail(term)),
+            ('tel:', vcf_normalize.NormalizePhone(term, default_country)),
+            ('name:', vcf_normalize.NormalizeName(term))):
+        if key:
+            keys.add(prefix + key)
+    if not keys:
+        return []
+    cursor = conn.execute(
+        'SELECT DISTINCT cards.idx, offset, length FROM keys '
+        'JOIN cards ON cards.idx = keys.card WHERE key IN ({}) '
+        'ORDER BY cards.idx'.format(', '.join('?' * len(keys))),
+        tuple(keys))
+    return [(offset, length) for _, offset, length in cursor]
+
+
+def ReadCard(f, offset, length):
+    """Reads one raw card from a binary file opened on the indexed file."""
+    f.seek(offset)
+    return f.read(length)
+
+
+def AddArguments(parser):
+    parser.add_argument('--index',
+                        action='store_true',
+                        help='Keep a {} index next to the vCard file and '
+                             'answer from it'.format(INDEX_SUFFIX))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Reading vCards from many files, directories and globs.
+
+Address books are often kept as directories of thousands of single-card
+files, where reading them one after the other is bound by open/read
+latency.  Inputs are expanded into a sorted list of files, small files are
+read by a thread pool a bounded number ahead, and their cards stream out in
+input order as soon as each file is in.  Big files are memory-mapped and
+scanned by vcf_reader as before.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import glob
+import io
+import os
+from concurrent import futures
+
+from . import vcf_card
+from . import vcf_profile
+from . import vcf_reader
+
+
+DEFAULT_READ_JOBS = 8
+
+# Reads queued per reader thread ahead of the file being consumed.
+READS_IN_FLIGHT = 4
+
+# Files up to this size are read whole by the threads, bigger ones are
+# mapped and scanned in order when their turn comes.
+MAX_PREFETCH_BYTES = 4 * 1024 * 1024
+
+VCARD_EXTENSIONS = ('.vcf', '.vcard')
+
+GLOB_CHARS = '*?['
+
+
+def _Glob(pattern):
+    try:
+        return glob.glob(pattern, recursive=True)
+    except TypeError:
+        # Python 2, no ** support
+        return glob.glob(pattern)
+
+
+def _WalkVcardFiles(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in VCARD_EXTENSIONS:
+                yield os.path.join(root, name)
+
+
+def ExpandInputs(paths):
+    """Turns files, directories and glob patterns into a list of files.
+
+    Directories are searched recursively for .vcf and .vcard files, glob
+    matches are sorted.  Explicitly named files are taken whatever their
+    extension.
+
+    Raises:
+      IOError: A path does not exist, a pattern matches nothing or no file
+          is found at all.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(_WalkVcardFiles(path))
+        elif os.path.isfile(path):
+            filenames.append(path)
+        elif any(c in path for c in GLOB_CHARS):
+            matches = sorted(_Glob(path))
+            if not matches:
+                raise IOError('No files match "{}"'.format(path))
+            for match in matches:
+                if os.path.isdir(match):
+                    filenames.extend(_WalkVcardFiles(match))
+                else:
+                    filenames.append(match)
+        else:
+            raise IOError('No such file or directory: "{}"'.format(path))
+    if not paths:
+        raise IOError('No vCard files given')
+    if not filenames:
+        raise IOError('No vCard files found in "{}"'.format(
+            '", "'.join(paths)))
+    return filenames
+
+
+def _ReadSmallFile(filename):
+    """Returns the content of a file, None if it is too big to prefetch."""
+    if os.path.getsize(filename) > MAX_PREFETCH_BYTES:
+        return None
+    with io.open(filename, 'rb') as f:
+        return f.read()
+
+
+def IterInputCards(filenames, jobs=DEFAULT_READ_JOBS, encoding='utf-8'):
+    """Yields (filename, vcf_card.RawVcard) for every card, in input order.
+
+    Args:
+      filenames: Files as returned by ExpandInputs.
+      jobs (int): Number of reader threads, 1 reads in the calling thread.
+      encoding (str): Encoding of the files.
+    """
+    for idx, card in _IterFileCards(filenames, jobs, encoding):
+        yield filenames[idx], card
+
+
+def IterInputRawVcards(filenames, jobs=DEFAULT_READ_JOBS, encoding='utf-8'):
+    """Same as IterInputCards without the filenames."""
+    for _, card in _IterFileCards(filenames, jobs, encoding):
+        yield card
+
+
+def ReadFirstCards(filenames, jobs=DEFAULT_READ_JOBS, encoding='utf-8'):
+    """Returns the first card of every file, as RawVcards, in input order.
+
+    Only the start of every file is scanned, the rest is never read.
+
+    Raises:
+      IOError: A file holds no card.
+    """
+    if len(filenames) == 1 or jobs <= 1:
+        firsts = [_ReadFirstCard(filename, encoding) for filename in filenames]
+    else:
+        pool = futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            firsts = list(pool.map(
+                lambda filename: _ReadFirstCard(filename, encoding),
+                filenames))
+        finally:
+            pool.shutdown(wait=False)
+    for filename, card in zip(filenames, firsts):
+        if card is None:
+            raise IOError('No vCard found in "{}"'.format(filename))
+    return firsts
+
+
+def _IterFileCards(filenames, jobs, encoding):
+    """Yields (index of the file in filenames, RawVcard)."""
+    if len(filenames) == 1 or jobs <= 1:
+        for idx, filename in enumerate(filenames):
+            for card in _IterMappedCards(filename, encoding):
+                yield idx, card
+        return
+
+    pool = futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        pending = collections.deque()
+        for idx, filename in enumerate(filenames):
+            pending.append((idx, pool.submit(_ReadSmallFile, filename)))
+            if len(pending) < jobs * READS_IN_FLIGHT:
+                continue
+            for item in _IterReadCards(filenames, pending.popleft(),
+                                       encoding):
+                yield item
+        while pending:
+            for item in _IterReadCards(filenames, pending.popleft(),
+                                       encoding):
+                yield item
+    finally:
+        pool.shutdown(wait=False)
+
+
+def _IterMappedCards(filename, encoding):
+    with open(filename, 'rb') as f:
+        for card in vcf_profile.Iter(
+                'scan', vcf_reader.IterRawVcards(f, encoding=encoding)):
+            yield card
+
+
+def _ReadFirstCard(filename, encoding):
+    """The first card of a file, None if it has none."""
+    cards = _IterMappedCards(filename, encoding)
+    try:
+        return next(cards, None)
+    finally:
+        # closes the file and its mapping
+        cards.close()
+
+
+def _IterReadCards(filenames, read, encoding):
+    idx, future = read
+    with vcf_profile.Stage('read'):
+        data = future.result()
+    if data is None:
+        cards = _IterMappedCards(filenames[idx], encoding)
+    else:
+        cards = vcf_profile.Iter('scan', (
+            vcf_card.RawVcard(block, offset=offset, encoding=encoding)
+            for offset, block in vcf_reader.IterMappedVcardBlocks(data)))
+    for card in cards:
+        yield idx, card
+
+
+def AddArguments(parser):
+    parser.add_argument('--read_jobs',
+                        type=int,
+                        default=DEFAULT_READ_JOBS,
+                        help='Number of threads reading input files when '
+                             'given several files, directories or globs')
@@ -3,7 +3,6 @@
 """
 
 Other desireable things:
-- use a set of vcf files (like glob) instead of single file with multiple card
 - manage other fields (right now only focus on email address and multiple email per VCARD)
 
 
@@ -15,16 +14,30 @@ from __future__ import unicode_literals
 
 
 import argparse
-import codecs
 import collections
+import contextlib
+import errno
+import functools
+import io
 import logging
 import os
 import re
 import sys
 
-import vobject
 from six import u
 
+from . import vcf_card
+from . import vcf_export
+from . import vcf_fastparse
+from . import vcf_index
+from . import vcf_inputs
+from . import vcf_normalize
+from . import vcf_parallel
+from . import vcf_profile
+# re-exported, they used to live here
+from .vcf_names import (NameError, IsFileSystemCompatString, CleanString,
+                        GetEmailUsername, GetVcardFilename)
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.NOTSET)
@@ -39,11 +52,8 @@ logger.addHandler(log_handler)
 VCARD_REGEX=r'^BEGIN:VCARD.*?END:VCARD'
 
 
-class NameError(Exception):
-    pass
-
-
 def GetVcardsFromString(content):
+    import vobject
     vl = []
     match = re.findall(VCARD_REGEX, content, re.M | re.S)
     for card in match:
@@ -57,44 +67,6 @@ def IsNotGplusOnly(vcard):
     return card_keys.difference(gplus_only_fields)
 
 
-def IsFileSystemCompatString(input_str, encoding='latin-1'):
-    """Returns strings that can be read in the desired encoding or ''.
-
-    Motivation: Even though filesystems frequently can support utf-8 file
-    names today it can still pose an issue for people who lack the needed
-    keys on their keyboards.  As such making sure filenames are written in
-    a format people can easily manipulate them in is important -- even though
-    the content may very well be utf-8.
-    """
-    try:
-        input_str.encode(encoding)
-    except (UnicodeDecodeError, UnicodeEncodeError):
-        return ''
-    return input_str
-
-
-def CleanString(s):
-    """Cleans up string.
-
-    Doesn't catch everything, appears to sometimes allow double underscores
-    to occur as a result of replacements.
-    """
-    punc = (' ', '-', '\'', '.', '&amp;', '&', '+', '@')
-    pieces = []
-    for part in s.split():
-        part = part.strip()
-        for p in punc:
-            part = part.replace(p, '_')
-        part = part.strip('_')
-        part = part.lower()
-        pieces.append(part)
-    return '_'.join(pieces)
-
-
-def GetEmailUsername(email_addr):
-    login = email_addr.split('@')[0]
-    return CleanString(login)
-
 #
 # Plain email list, one address per line no way to 
 #
@@ -119,40 +91,115 @@ def GetVcardName (vcard):
     return vcard.fn.value
 
 
-def GetVcardFilename(vcard, filename_charset='latin-1'):
-    fname_pieces = []
-    for name in ('family', 'given', 'additional'):
-        val = getattr(vcard.n.value, name)
-        if val and IsFileSystemCompatString(val, encoding=filename_charset):
-            fname_pieces.append(CleanString(val.lower()))
-    
-    if not fname_pieces and 'email' in vcard.contents:
-        fname_pieces.append(GetEmailUsername(vcard.email.value))
+class ListerIndex(object):
+    """Hash indexes of normalized emails and phone numbers, built in one pass.
+
+    Addresses and numbers that only differ in case, spacing or punctuation
+    (and, with a default country, in the international prefix) count once.
+
+    Attributes:
+      cards (int): vCards added.
+      emails (OrderedDict): Normalized email to the number of vCards with it.
+      tels (OrderedDict): Normalized phone number to the number of vCards.
+      names (set): Normalized names.
+      without_email (int): vCards without a usable email.
+      without_tel (int): vCards without a usable phone number.
+    """
+
+    def __init__(self, default_country=None):
+        self.default_country = default_country
+        self.cards = 0
+        self.emails = collections.OrderedDict()
+        self.tels = collections.OrderedDict()
+        self.names = set()
+        self.without_email = 0
+        self.without_tel = 0
+
+    def Add(self, name, emails, tels):
+        self.cards += 1
+        name = vcf_normalize.NormalizeName(name or '')
+        if name:
+            self.names.add(name)
+        keys = set(filter(None, map(vcf_normalize.NormalizeEmail, emails)))
+        for key in keys:
+            self.emails[key] = self.emails.get(key, 0) + 1
+        if not keys:
+            self.without_email += 1
+        keys = set(filter(None, (
+            vcf_normalize.NormalizePhone(tel, self.default_country)
+            for tel in tels)))
+        for key in keys:
+            self.tels[key] = self.tels.get(key, 0) + 1
+        if not keys:
+            self.without_tel += 1
+
+    def Stats(self):
+        """Returns (label, value) pairs to print."""
+        return [
+            ('Number of Vcards', self.cards),
+            ('Number of emails', len(self.emails)),
+            ('Number of phone numbers', len(self.tels)),
+            ('Number of names', len(self.names)),
+            ('Emails on several Vcards',
+             sum(1 for n in self.emails.values() if n > 1)),
+            ('Phone numbers on several Vcards',
+             sum(1 for n in self.tels.values() if n > 1)),
+            ('Vcards without email', self.without_email),
+            ('Vcards without phone number', self.without_tel),
+        ]
+
+
+def WriteRaw(data):
+    """Writes bytes to stdout as they are, after anything already printed."""
+    sys.stdout.flush()
+    getattr(sys.stdout, 'buffer', sys.stdout).write(data)
+
+
+def SilenceStdout():
+    """Points stdout at /dev/null, so that nothing is flushed to a closed
+    pipe on exit."""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+
+@contextlib.contextmanager
+def ExitOnClosedPipe():
+    """Exits with status 1 and no traceback when the reader of stdout goes
+    away, as with | head."""
+    try:
+        yield
+        sys.stdout.flush()
+    except (IOError, OSError) as e:
+        if e.errno != errno.EPIPE:
+            raise
+        SilenceStdout()
+        sys.exit(1)
+
 
-    if not fname_pieces:
-        raise NameError('{} HAS NO POSSIBLE FILENAME!'.format(str(vcard)))
-    return '{}.vcf'.format('_'.join(fname_pieces))
+def WriteLines(lines, outfile=None):
+    outfile = outfile or sys.stdout
+    for batch in vcf_export.IterBatches(lines):
+        outfile.write("\n".join(batch) + "\n")
 
 
 def ListerDumpEmail (email_dict):
 
-    for e,v in email_dict.items():
-        print(e)
+    WriteLines(email_dict)
     return
 
-lister_separator = ";"
-def ListerDumpName (n_dict):
 
-    for n,v in n_dict.items():
-        to_print = n + lister_separator + " "
-        for e in v:
-            for ee in e:
-                to_print += str(ee)
-                to_print += " " 
+def ListerDumpTel (tel_dict):
 
-        print(to_print)
+    WriteLines(tel_dict)
+    return
 
-    #print("\n\n")
+lister_separator = ";"
+def ListerDumpName (n_dict, outfile=None):
+
+    lines = (n + lister_separator + " " + "".join(
+        str(ee) + " " for e in v for ee in e) for n,v in n_dict.items())
+    WriteLines(lines, outfile)
     return
 
 
@@ -160,74 +207,210 @@ def AddArguments(parser):
     group = parser.add_mutually_exclusive_group()
     
     parser.add_argument('vcard_file',
-                        nargs=1,
-                        help='A multi-entry vCard to list.')
+                        nargs='+',
+                        help='A multi-entry vCard to list, or several files, '
+                             'directories or globs')
     group.add_argument('--email',
                         action='store_true',
-                        help='list plain email addresses one per line')
+                        help='list unique normalized email addresses one per '
+                             'line')
+    group.add_argument('--tel',
+                        action='store_true',
+                        help='list unique normalized phone numbers one per '
+                             'line')
+    group.add_argument('--stats',
+                        action='store_true',
+                        help='print statistics of unique identifiers '
+                             '(the default)')
     group.add_argument('--field',
-                        choices=['fn'],
-                        help='define fields to list, one line per vcard, with format \"<fields>; email-address*\"')
+                        type=vcf_export.ParseColumns,
+                        help='comma separated fields to list out of {}, one '
+                             'line per vcard, with format \"<fields>; '
+                             'email-address*\" or as --format'.format(
+                                 ','.join(vcf_export.COLUMNS)))
     group.add_argument('--raw',
                         action='store_true',
                         help='liste the serialization of vfc file')
+    group.add_argument('--lookup',
+                        metavar='TERM',
+                        help='print the vcards with this email, phone number'
+                             ' or name, implies --index')
+    parser.add_argument('--format',
+                        choices=vcf_export.FORMATS,
+                        default='text',
+                        help='Output format of --field, one row per vcard '
+                             'with a header except for text and jsonl '
+                             '(default: text, parquet needs pyarrow)')
+    parser.add_argument('--outfile',
+                        help='Write the --field or --format output to this '
+                             'file instead of stdout')
     parser.add_argument('--filename_charset',
                         choices=['utf-8', 'latin-1'],
                         default='latin-1',
                         help='Restrict filenames to character set')
+    vcf_parallel.AddArguments(parser)
+    vcf_inputs.AddArguments(parser)
+    vcf_fastparse.AddArguments(parser)
+    vcf_index.AddArguments(parser)
+    vcf_normalize.AddArguments(parser)
+
+
+def OpenUpdatedIndex(vcard_path, default_country=None):
+    """Opens the index of a vCard file, refreshing it if the file changed."""
+    conn = vcf_index.OpenIndex(vcard_path)
+    updated = vcf_index.UpdateIndex(conn, vcard_path,
+                                    default_country=default_country)
+    if updated is not None:
+        logger.debug('Index updated, %s vCards reused, %s parsed.', *updated)
+    return conn
+
+
+def IterRows(args, filenames, index, columns):
+    """Yields the vcf_export row of the columns of every card."""
+    if index:
+        return (vcf_export.GetRow(fields, columns) for _, _, fields
+                in vcf_index.IterIndexedFields(index))
+    return vcf_parallel.MapBlocks(
+        functools.partial(vcf_export.GetCardRow, columns=columns,
+                          parser=args.parser),
+        vcf_inputs.IterInputRawVcards(filenames, jobs=args.read_jobs),
+        jobs=args.jobs)
+
+
+def ExportRows(args, filenames, index, columns):
+    """Writes every card as a row in args.format, returns the row count."""
+    rows = IterRows(args, filenames, index, columns)
+    if args.format == 'parquet':
+        return vcf_export.WriteRows(rows, columns, args.format,
+                                    path=args.outfile)
+    if not args.outfile:
+        return vcf_export.WriteRows(rows, columns, args.format,
+                                    outfile=sys.stdout)
+    with io.open(args.outfile, 'w', encoding='utf-8', newline='') as f:
+        return vcf_export.WriteRows(rows, columns, args.format, outfile=f)
 
 
 def main(args, usage=''):
     try:
-        with codecs.open(args.vcard_file[0], 'r', encoding='utf-8') as f:
-            content = f.read()
-    except (IOError, OSError):
-        print('\nERROR: Check that all files specified exist and permissions'
-              ' are OK.\n')
+        filenames = vcf_inputs.ExpandInputs(args.vcard_file)
+        if (args.index or args.lookup) and len(filenames) != 1:
+            raise IOError('--index and --lookup work on a single vCard file')
+        vcard_file = open(filenames[0], 'rb')
+    except (IOError, OSError) as e:
+        print('\nERROR: {}\nCheck that all files specified exist and '
+              'permissions are OK.\n'.format(e))
+        print(usage)
+        sys.exit(1)
+    if args.format != 'text' and (args.email or args.tel or args.stats or
+                                  args.raw or args.lookup):
+        print('\nERROR: --format applies to --field only\n')
+        print(usage)
+        sys.exit(1)
+    if args.outfile and not args.field and args.format == 'text':
+        print('\nERROR: --outfile applies to --field and --format only\n')
         print(usage)
         sys.exit(1)
 
     name_dict = collections.defaultdict(list)
-    email_dict = collections.defaultdict(list)
 
-    # first get the whole vcard dictionary, just save for futher processing
-    vcard_list = GetVcardsFromString(content);
+    index = None
+    if args.index or args.lookup:
+        index = OpenUpdatedIndex(filenames[0], args.default_country)
+
+    if (args.lookup):
+        with vcard_file, ExitOnClosedPipe():
+            for offset, length in vcf_index.LookupCards(index, args.lookup,
+                                                       args.default_country):
+                card = vcf_index.ReadCard(vcard_file, offset, length)
+                WriteRaw(vcf_card.RawVcard(card, offset=offset).Serialize())
+        return
 
-    # The raw printing much like the cat of vcf file
+    # The raw printing much like the cat of vcf file, cards are written
+    # byte for byte as they are in the file
     if (args.raw):
-        print("\nNumber of Vcards: " + str(len(vcard_list)) + "\n")
-        for idx in range(len(vcard_list)):
-            print("###" + str(idx) + "###" +vcard_list[idx].serialize())
-        return 
-    
-    for vcard in vcard_list: 
-        #print("==1==>")
-        #print (vcard.serialize())
-        #print("<==1==")
-        
-        email = GetVcardEmail(vcard)
-        logger.debug('{}'.format(str(email)))
-
-        for e in email:
-            email_dict[e].append(vcard)
-
-        name = GetVcardName(vcard)
-        name_dict[name].append(email)
-
- 
-    if (args.email):
-        ListerDumpEmail(email_dict)
+        with vcard_file, ExitOnClosedPipe():
+            if index:
+                count = vcf_index.CountCards(index)
+                cards = (vcf_card.RawVcard(vcf_index.ReadCard(
+                    vcard_file, offset, length), offset=offset)
+                    for offset, length, _ in
+                    vcf_index.IterIndexedFields(index))
+            else:
+                # count on a cheap first pass so cards never pile up in memory
+                count = sum(1 for _ in vcf_inputs.IterInputRawVcards(
+                    filenames, jobs=args.read_jobs))
+                cards = vcf_inputs.IterInputRawVcards(filenames,
+                                                      jobs=args.read_jobs)
+            print("\nNumber of Vcards: " + str(count) + "\n")
+            for idx, card in enumerate(cards):
+                WriteRaw(b"###" + str(idx).encode('ascii') + b"###" +
+                         card.Serialize() + b"\n")
         return
-    
-    if (args.field == 'fn'):
-        ListerDumpName(name_dict)
+
+    if args.format != 'text':
+        columns = args.field or vcf_export.DEFAULT_COLUMNS
+        with vcard_file:
+            try:
+                count = ExportRows(args, filenames, index, columns)
+            except vcf_export.ExportError as e:
+                print('\nERROR: {}\n'.format(e))
+                print(usage)
+                sys.exit(1)
+            except (IOError, OSError) as e:
+                if e.errno == errno.EPIPE:
+                    # the reader went away, as with | head
+                    SilenceStdout()
+                else:
+                    logger.error('Error writing the export: {}'.format(e))
+                sys.exit(1)
+        logger.debug('%s vcards exported.', count)
         return
 
-    ## END of processing with no options
-    print ("Statistics for ", args.vcard_file[0], ":")
-    print ("  Number of Vcards:", len(name_dict))
-    print ("  Number of emails:", len(email_dict))
-    print ()
+    list_index = ListerIndex(default_country=args.default_country)
+    with vcard_file:
+        if args.field:
+            # "<fields>; email-address*": the listed fields are the key, list
+            # fields, email by default, come after the separator
+            keys = [c for c in args.field
+                    if c not in vcf_export.LIST_COLUMNS]
+            values = ([c for c in args.field
+                       if c in vcf_export.LIST_COLUMNS] or ['email'])
+            for row in IterRows(args, filenames, index, keys + values):
+                name = " ".join(v or "" for v in row[:len(keys)])
+                name_dict[name].extend(row[len(keys):])
+        else:
+            for name, email, tel in IterRows(args, filenames, index,
+                                             ('fn', 'email', 'tel')):
+                with vcf_profile.Stage('index'):
+                    list_index.Add(name, email, tel)
+
+    with ExitOnClosedPipe():
+        if (args.email):
+            ListerDumpEmail(list_index.emails)
+            return
+
+        if (args.tel):
+            ListerDumpTel(list_index.tels)
+            return
+
+        if (args.field and args.outfile):
+            try:
+                with io.open(args.outfile, 'w', encoding='utf-8') as f:
+                    ListerDumpName(name_dict, f)
+            except (IOError, OSError) as e:
+                logger.error('Error writing {}: {}'.format(args.outfile, e))
+                sys.exit(1)
+            return
+
+        if (args.field):
+            ListerDumpName(name_dict)
+            return
+
+        ## END of processing with no options or --stats
+        print ("Statistics for ", ", ".join(args.vcard_file), ":")
+        for label, value in list_index.Stats():
+            print ("  {}:".format(label), value)
+        print ()
     return
 
 def dispatch_main():
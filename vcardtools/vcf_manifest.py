@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Manifest of the files an incremental split wrote.
+
+The manifest lives in the output directory and maps every output file,
+relative to that directory, to a hash of the normalized cards it holds.  A
+re-run compares hashes and only writes, replaces or deletes the files that
+actually changed.  It also records which card got each name without a
+suffix, so that the same card gets it again whatever the input order, see
+vcf_names.FilenameAllocator.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+
+from . import vcf_fastparse
+from . import vcf_writer
+
+
+MANIFEST_NAME = '.vcardtools-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def GetManifestPath(output_dir):
+    """The manifest of an output directory, as an absolute path."""
+    return os.path.join(os.path.abspath(output_dir), MANIFEST_NAME)
+
+
+def NormalizeCard(card):
+    """Drops line ending and blank line differences from a raw vCard."""
+    return '\n'.join(line.rstrip() for line in
+                     vcf_fastparse.LINE_SPLIT_REGEX.split(card)
+                     if line.strip())
+
+
+def HashCards(cards, encoding='utf-8'):
+    """Hash of the normalized content of one output file."""
+    digest = hashlib.sha1()
+    for card in cards:
+        if isinstance(card, bytes):
+            card = vcf_fastparse.DecodeCard(card, encoding)
+        digest.update(NormalizeCard(card).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _LoadManifestData(output_dir):
+    try:
+        with io.open(GetManifestPath(output_dir), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def LoadManifest(output_dir):
+    """Returns {relative path: hash}, empty when there is no manifest."""
+    return _LoadManifestData(output_dir).get('files', {})
+
+
+def LoadNameOwners(output_dir):
+    """Returns {filename: card suffix} of the names handed out unsuffixed.
+    """
+    return _LoadManifestData(output_dir).get('owners', {})
+
+
+def SaveManifest(output_dir, files, owners=None):
+    manifest = {'version': MANIFEST_VERSION, 'files': files}
+    if owners:
+        manifest['owners'] = owners
+    data = json.dumps(manifest, indent=0, sort_keys=True)
+    vcf_writer.WriteFile(GetManifestPath(output_dir), data, atomic=True)
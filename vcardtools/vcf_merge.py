@@ -7,18 +7,27 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import codecs
+import collections
+import importlib
+import io
+import json
 import logging
-import pprint
+import os
+import shlex
 import sys
 
-import vobject
 from six import u
 from six.moves import input
 
+from . import vcf_inputs
+from . import vcf_normalize
+from . import vcf_profile
+from . import vcf_reader
+from . import vcf_writer
+
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.INFO)
 log_formatter = logging.Formatter(('%(asctime)s - %(name)s - %(levelname)s'
                                    ' - %(message)s'))
 log_handler = logging.StreamHandler()
@@ -30,25 +39,42 @@ logger.addHandler(log_handler)
 MERGEABLE_FIELDS = ('email', 'tel', 'adr', 'org', 'categories')
 
 
+# Attribute caching the normalized key on a vobject ContentLine.
+FIELD_KEY_ATTR = '_vcardtools_key'
+
+
+def GetFieldKey(field):
+    """Normalized key of one vCard field, see vcf_normalize.GetPropertyKey.
+
+    Computed once per field and kept on it, merged copies inherit it.
+    """
+    key = getattr(field, FIELD_KEY_ATTR, None)
+    if key is None:
+        key = vcf_normalize.GetPropertyKey(field.name.lower(), field.value)
+        setattr(field, FIELD_KEY_ATTR, key)
+    return key
+
+
 def VcardFieldsEqual(field1, field2):
     """Handle comparing vCard fields where inputs are lists of components.
 
-    Handle parameters?  Are any used aside from 'TYPE'?
-    Note: force cast to string to compare sub-objects like Name and Address
+    Fields are equal when they hold the same values once normalized, so
+    'Foo@Example.com' and 'foo@example.com' or '(111) 555-1212' and
+    '111.555.1212' match.  Parameters such as TYPE are not compared.
     """
-    field1_vals = set([ str(f.value) for f in field1 ])
-    field2_vals = set([ str(f.value) for f in field2 ])
-    if field1_vals == field2_vals:
-        return True
-    else:
-        return False
+    return (set(GetFieldKey(f) for f in field1) ==
+            set(GetFieldKey(f) for f in field2))
 
 
 def VcardMergeListFields(field1, field2):
-    """Handle merging list fields that may include some overlap."""
-    field_dict = {}
+    """Handle merging list fields that may include some overlap.
+
+    Values that only differ in their normalized form are kept once, as the
+    first of them.
+    """
+    field_dict = collections.OrderedDict()
     for f in field1 + field2:
-        field_dict[str(f)] = f
+        field_dict.setdefault(GetFieldKey(f), f)
     return list(field_dict.values())
 
 
@@ -59,6 +85,9 @@ def SetVcardField(new_vcard, field_name, values):
         new_field.value = val.value
         if val.params:
             new_field.params = val.params
+        key = getattr(val, FIELD_KEY_ATTR, None)
+        if key is not None:
+            setattr(new_field, FIELD_KEY_ATTR, key)
     return new_vcard
 
 
@@ -70,34 +99,37 @@ def CopyVcardFields(new_vcard, auth_vcard, field_names):
     return new_vcard
 
 
-def MergeVcards(vcard1, vcard2):
-    """Create a new vCard and populate it."""
+def MergeVcards(vcard1, vcard2, resolve_conflict=None):
+    """Create a new vCard and populate it.
+
+    Args:
+      vcard1, vcard2: vobject vCards to merge.
+      resolve_conflict: Either MergeRules deciding every differing field, or
+          one of the CONFLICT_POLICIES functions, called for differing
+          fields that cannot be merged (MERGEABLE_FIELDS are combined).
+          Prompts by default.
+    """
+    # imported here so that dedupe without duplicates never loads it
+    import vobject
+    rules = GetRules(resolve_conflict)
     new_vcard = vobject.vCard()
     vcard1_fields = set(vcard1.contents.keys())
     vcard2_fields = set(vcard2.contents.keys())
     mutual_fields = vcard1_fields.intersection(vcard2_fields)
-    logger.debug('Potentially conflicting fields: {}'.format(mutual_fields))
+    logger.debug('Potentially conflicting fields: %s', mutual_fields)
     for field in mutual_fields:
         val1 = vcard1.contents.get(field)
         val2 = vcard2.contents.get(field)
         new_values = []
         if not VcardFieldsEqual(val1, val2):
-            # we have a conflict, if a list maybe append otherwise prompt user
-            if field not in MERGEABLE_FIELDS:
-                context_str = GetVcardContextString(vcard1, vcard2)
-                new_values.extend(SelectFieldPrompt(field,
-                                                    context_str,
-                                                    val1,
-                                                    val2))
-            else:
-                new_values.extend(VcardMergeListFields(val1, val2))
+            # we have a conflict, the rules decide: lists are combined by
+            # default, anything else goes to the default policy
+            new_values.extend(rules.Resolve(field, vcard1, vcard2, val1, val2))
         else:
             new_values.extend(val1)
 
-        logger.debug('Merged values for field {}: {}'.format(
-            field.upper(),
-            u(str(new_values)))
-        )
+        logger.debug('Merged values for field %s: %s', field.upper(),
+                     new_values)
         new_vcard = SetVcardField(new_vcard, field, new_values)
 
     new_vcard = CopyVcardFields(new_vcard,
@@ -110,6 +142,256 @@ def MergeVcards(vcard1, vcard2):
     return new_vcard
 
 
+def MergeVcardGroup(vcards, resolve_conflict=None):
+    """Merges any number of vCards into one, earlier cards come first.
+
+    Gives the same card as merging them pairwise with MergeVcards, but the
+    merged card is built up in place and the normalized keys of its fields
+    are kept, so a group costs time linear in its number of fields instead
+    of copying the growing card once per member.
+    """
+    if len(vcards) == 1:
+        return vcards[0]
+    with vcf_profile.Stage('merge', items=len(vcards)):
+        rules = GetRules(resolve_conflict)
+        merged = MergeVcards(vcards[0], vcards[1], resolve_conflict=rules)
+        keys = dict((field, set(GetFieldKey(f) for f in values))
+                    for field, values in merged.contents.items())
+        for vcard in vcards[2:]:
+            MergeVcardInto(merged, keys, vcard, rules)
+    return merged
+
+
+def MergeVcardInto(merged, keys, vcard, rules):
+    """Merges vcard into merged, see MergeVcardGroup.
+
+    Args:
+      merged: vobject vCard updated in place.
+      keys (dict): Field name to the set of normalized keys of its values
+          in merged, kept up to date.
+      vcard: vobject vCard to merge in.
+      rules (MergeRules): Decides conflicts.
+    """
+    # every field is decided first, so that resolvers such as newest see
+    # merged as it was before this vcard, like a pairwise merge would
+    updates = []
+    for field, val2 in vcard.contents.items():
+        val1 = merged.contents.get(field)
+        if not val1:
+            updates.append((field, None, val2))
+            continue
+        field_keys = keys[field]
+        if set(GetFieldKey(f) for f in val2) == field_keys:
+            continue
+        resolver = rules.GetResolver(field)
+        if resolver is ResolveUnion and len(field_keys) == len(val1):
+            # only what is new gets appended, merged values stay as they are
+            rules.Count(field, resolver, 'combined')
+            updates.append((field, val1, val2))
+            continue
+        values = rules.Resolve(field, merged, vcard, val1, val2)
+        if values is not val1:
+            updates.append((field, None, values))
+    for field, val1, values in updates:
+        if val1 is not None:
+            field_keys = keys[field]
+            for f in values:
+                key = GetFieldKey(f)
+                if key not in field_keys:
+                    field_keys.add(key)
+                    SetVcardField(merged, field, [f])
+            continue
+        merged.contents[field] = []
+        SetVcardField(merged, field, values)
+        keys[field] = set(GetFieldKey(f) for f in merged.contents[field])
+
+
+def ResolveUnion(field, vcard1, vcard2, val1, val2):
+    """Keeps the values of both vCards, without duplicates."""
+    return VcardMergeListFields(val1, val2)
+
+
+def ResolvePrompt(field, vcard1, vcard2, val1, val2):
+    """Asks the user to pick one of the values."""
+    context_str = GetVcardContextString(vcard1, vcard2)
+    return SelectFieldPrompt(field, context_str, val1, val2)
+
+
+def ResolvePreferFirst(field, vcard1, vcard2, val1, val2):
+    """Keeps the values of the first vCard."""
+    return val1
+
+
+def ResolvePreferSecond(field, vcard1, vcard2, val1, val2):
+    """Keeps the values of the second vCard."""
+    return val2
+
+
+def ResolvePreferLongest(field, vcard1, vcard2, val1, val2):
+    """Keeps the values with the most text, the first vCard on a tie."""
+    def Length(values):
+        return sum(len(u(str(v.value))) for v in values)
+    if Length(val2) > Length(val1):
+        return val2
+    return val1
+
+
+def GetVcardRev(vcard):
+    """Returns the REV of a vCard as a sortable string, '' if missing."""
+    try:
+        rev = vcard.rev.value
+    except AttributeError:
+        return ''
+    # 2008-04-24T19:52:43Z and 20080424T195243Z compare the same
+    return u(str(rev)).replace('-', '').replace(':', '')
+
+
+def ResolvePreferNewest(field, vcard1, vcard2, val1, val2):
+    """Keeps the values of the vCard with the latest REV."""
+    if GetVcardRev(vcard2) > GetVcardRev(vcard1):
+        return val2
+    return val1
+
+
+CONFLICT_POLICIES = {
+    'prompt': ResolvePrompt,
+    'first': ResolvePreferFirst,
+    'second': ResolvePreferSecond,
+    'longest': ResolvePreferLongest,
+    'newest': ResolvePreferNewest,
+    'union': ResolveUnion,
+}
+
+
+def GetPolicy(name):
+    """Returns the resolver for a policy name.
+
+    Besides the CONFLICT_POLICIES names, "package.module:function" names any
+    function taking the (field, vcard1, vcard2, val1, val2) arguments of
+    the built-in ones and returning the values to keep.
+
+    Raises:
+      ValueError: Unknown policy or custom function not found.
+    """
+    if name in CONFLICT_POLICIES:
+        return CONFLICT_POLICIES[name]
+    module_name, _, func_name = name.partition(':')
+    if not (module_name and func_name):
+        raise ValueError('Unknown merge policy "{}"'.format(name))
+    try:
+        return getattr(importlib.import_module(module_name), func_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError('Cannot load merge policy "{}": {}'.format(name, e))
+
+
+def GetPolicyName(resolver):
+    for name, func in CONFLICT_POLICIES.items():
+        if func is resolver:
+            return name
+    return '{}:{}'.format(resolver.__module__, resolver.__name__)
+
+
+class MergeRules(object):
+    """Decides every conflicting field of a merge by a per-field policy.
+
+    Fields without a policy of their own are combined if they are one of
+    MERGEABLE_FIELDS and go to the default policy otherwise.  Every decision
+    is counted, see Summary().
+
+    Args:
+      default: Resolver for fields without a policy, prompts if None.
+      fields (dict): Field name (lowercase, e.g. 'title') to resolver.
+    """
+
+    def __init__(self, default=None, fields=None):
+        self.default = default or ResolvePrompt
+        self.fields = dict(fields or {})
+        self.decisions = collections.Counter()
+
+    def GetResolver(self, field):
+        if field in self.fields:
+            return self.fields[field]
+        if field in MERGEABLE_FIELDS:
+            return ResolveUnion
+        return self.default
+
+    def Resolve(self, field, vcard1, vcard2, val1, val2):
+        resolver = self.GetResolver(field)
+        values = resolver(field, vcard1, vcard2, val1, val2)
+        if values is val1:
+            kept = 'first'
+        elif values is val2:
+            kept = 'second'
+        else:
+            kept = 'combined'
+        self.Count(field, resolver, kept)
+        return values
+
+    def Count(self, field, resolver, kept):
+        self.decisions[(field, GetPolicyName(resolver), kept)] += 1
+
+    def Summary(self):
+        """Returns one line per field, policy and outcome with its count."""
+        return ['{}: {} kept {} x{}'.format(field.upper(), policy, kept, count)
+                for (field, policy, kept), count in
+                sorted(self.decisions.items())]
+
+
+def GetRules(resolve_conflict):
+    """MergeRules for the resolve_conflict argument of the merge functions."""
+    if isinstance(resolve_conflict, MergeRules):
+        return resolve_conflict
+    return MergeRules(default=resolve_conflict)
+
+
+def ParseFieldPolicy(value):
+    """argparse type of FIELD=POLICY."""
+    field, sep, policy = value.partition('=')
+    if not (sep and field.strip() and policy.strip()):
+        raise argparse.ArgumentTypeError(
+            'expected FIELD=POLICY, got "{}"'.format(value))
+    return field.strip().lower(), policy.strip()
+
+
+def LoadRulesFile(filename):
+    """Reads merge rules from a JSON file.
+
+    The file holds {"default": POLICY, "fields": {FIELD: POLICY, ...}},
+    both keys optional.
+
+    Returns:
+      A (default policy name or None, {field: policy name}) tuple.
+    """
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    fields = dict((k.lower(), v) for k, v in config.get('fields', {}).items())
+    return config.get('default'), fields
+
+
+def GetMergeRules(args):
+    """Builds MergeRules from --policy, --rules and --field_policy.
+
+    --field_policy entries override the rules file, whose default overrides
+    --policy only when --policy was not given.
+
+    Raises:
+      ValueError: Unknown policy or unreadable rules file.
+    """
+    default = args.policy
+    fields = {}
+    if args.rules:
+        try:
+            file_default, fields = LoadRulesFile(args.rules)
+        except (IOError, OSError, ValueError) as e:
+            raise ValueError('Cannot read merge rules "{}": {}'.format(
+                args.rules, e))
+        default = default or file_default
+    fields.update(args.field_policy or ())
+    return MergeRules(default=GetPolicy(default or args.default_policy),
+                      fields=dict((field, GetPolicy(policy))
+                                  for field, policy in fields.items()))
+
+
 def SelectFieldPrompt(field_name, context_str, *options):
     """Prompts user to pick from provided options.
 
@@ -148,9 +430,16 @@ def SelectFieldPrompt(field_name, context_str, *options):
         return new_value
 
 
+def LogVcard(label, vcard):
+    """Logs a whole card at debug level, serializing it only if shown."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s:\n%s', label, u(vcard.serialize()))
+
+
 def GetVcardContextString(vcard1, vcard2):
-    logger.debug('Input vCard 1:\n{}'.format(u(vcard1.serialize())))
-    logger.debug('Input vCard 2:\n{}'.format(u(vcard2.serialize())))
+    import pprint
+    LogVcard('Input vCard 1', vcard1)
+    LogVcard('Input vCard 2', vcard2)
     context = 'Option 1:\n{}\n\nOption 2:\n{}\n\n'.format(
         pprint.pformat(u(str(vcard1.contents))),
         pprint.pformat(u(str(vcard2.contents)))
@@ -158,38 +447,168 @@ def GetVcardContextString(vcard1, vcard2):
     return context
 
 
+def ReadFirstVcard(filename):
+    """Reads only the first vCard of a file, without loading the rest."""
+    with open(filename, 'rb') as f:
+        for vcard in vcf_reader.GetVcardsFromFile(f):
+            return vcard
+    raise IOError('No vCard found in "{}"'.format(filename))
+
+
+def ReadMergeManifest(filename):
+    """Reads a manifest of merges to run.
+
+    Each line names the output file and then the two or more vCard files to
+    merge into it, separated by whitespace and quoted like in a shell.
+    Relative paths are relative to the manifest.  Blank lines and lines
+    starting with # are skipped.
+
+    Yields:
+      (output path, [input paths], error) tuples, error is None unless the
+      line cannot be run: it then says why and the paths may be missing.
+    """
+    base_dir = os.path.dirname(filename)
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                paths = [os.path.join(base_dir, p) for p in shlex.split(line)]
+            except ValueError as e:
+                # unbalanced quotes
+                paths = []
+                error = '{}:{}: {}'.format(filename, line_no, e)
+            else:
+                error = None
+            if len(paths) < 3:
+                error = error or ('{}:{}: expected an output and at least two '
+                                  'vCard files'.format(filename, line_no))
+                yield (paths[0] if paths else None), paths[1:], error
+                continue
+            yield paths[0], paths[1:], None
+
+
+def RunMergeManifest(manifest, rules, atomic=False):
+    """Runs every merge of a manifest with the same rules.
+
+    A merge whose files cannot be read, parsed or written is reported and
+    skipped, as is a line that cannot be run.
+
+    Returns:
+      A (merged, failed) tuple of counts.
+    """
+    import vobject
+    merged = failed = 0
+    for outfile, infiles, error in ReadMergeManifest(manifest):
+        if error is not None:
+            logger.error('Skipping line {}'.format(error))
+            failed += 1
+            continue
+        try:
+            vcards = [ReadFirstVcard(infile) for infile in infiles]
+            merged_vcard = MergeVcardGroup(vcards, resolve_conflict=rules)
+            vcf_writer.WriteFile(outfile, u(merged_vcard.serialize()),
+                                 atomic=atomic)
+        except (IOError, OSError, ValueError,
+                vobject.base.ParseError) as e:
+            logger.error('Skipping merge into "{}": {}'.format(outfile, e))
+            failed += 1
+            continue
+        merged += 1
+    return merged, failed
+
+
+def AddPolicyArguments(parser, default_policy):
+    """Options choosing how conflicting fields are merged.
+
+    default_policy is used when neither --policy nor a rules file set one.
+    """
+    parser.add_argument('--policy',
+                        help='How to settle conflicting fields that cannot '
+                             'be combined: {} or package.module:function '
+                             '(default: {})'.format(
+                                 ', '.join(sorted(CONFLICT_POLICIES)),
+                                 default_policy))
+    parser.add_argument('--field_policy',
+                        metavar='FIELD=POLICY',
+                        type=ParseFieldPolicy,
+                        action='append',
+                        help='Policy for one field, e.g. title=longest or '
+                             'tel=first, may be repeated')
+    parser.add_argument('--rules',
+                        metavar='FILE',
+                        help='JSON file with the default policy and per-field '
+                             'policies: {"default": "newest", "fields": '
+                             '{"title": "longest"}}')
+    parser.set_defaults(default_policy=default_policy)
+
+
 def AddArguments(parser):
     parser.add_argument('vcard_files',
-                        nargs=2,
-                        help='Two vCard files to merge')
+                        nargs='*',
+                        help='Two or more vCard files, directories or globs '
+                             'to merge, the first card of each file is used')
     parser.add_argument('--outfile',
                         nargs='?',
                         type=argparse.FileType('w'),
                         default=sys.stdout,
                         help='Write merged vCard to file')
+    parser.add_argument('--manifest',
+                        metavar='FILE',
+                        help='Run every merge listed in FILE, one per line: '
+                             'the output file then the vCard files to merge')
+    parser.add_argument('--atomic',
+                        action='store_true',
+                        help='With --manifest, write each file under a '
+                             'temporary name and rename it into place')
+    AddPolicyArguments(parser, 'prompt')
+    vcf_inputs.AddArguments(parser)
 
 
 def main(args, usage=''):
     try:
-        with codecs.open(args.vcard_files[0], 'r', encoding='utf-8') as f:
-            vcard1_raw = f.read()
-
-        with codecs.open(args.vcard_files[1], 'r', encoding='utf-8') as f:
-            vcard2_raw = f.read()
-    except OSError:
-        print('\nERROR: Check that all files specified exist and permissions'
-              ' are OK.\n')
+        rules = GetMergeRules(args)
+    except ValueError as e:
+        print('\nERROR: {}\n'.format(e))
+        print(usage)
+        sys.exit(1)
+
+    if args.manifest:
+        try:
+            merged, failed = RunMergeManifest(args.manifest, rules,
+                                              atomic=args.atomic)
+        except (IOError, OSError, ValueError) as e:
+            print('\nERROR: {}\n'.format(e))
+            sys.exit(1)
+        logger.info('{} merges written, {} failed.'.format(merged, failed))
+        for line in rules.Summary():
+            logger.info(line)
+        if failed:
+            sys.exit(1)
+        return
+
+    try:
+        filenames = vcf_inputs.ExpandInputs(args.vcard_files)
+        if len(filenames) < 2:
+            raise IOError('Two or more vCard files are needed')
+        vcards = [card.vobject for card in
+                  vcf_inputs.ReadFirstCards(filenames, jobs=args.read_jobs)]
+    except (IOError, OSError) as e:
+        print('\nERROR: {}\nCheck that all files specified exist and '
+              'permissions are OK.\n'.format(e))
         print(usage)
         sys.exit(1)
 
-    vcard1 = vobject.readOne(vcard1_raw)
-    vcard2 = vobject.readOne(vcard2_raw)
-    logger.debug('First vCard:\n{}'.format(u(vcard1.serialize())))
-    logger.debug('Second vCard:\n{}'.format(u(vcard2.serialize())))
+    for vcard in vcards:
+        LogVcard('Input vCard', vcard)
 
-    merged_vcard = MergeVcards(vcard1, vcard2)
-    logger.debug('Merged vCard:\n{}'.format(u(merged_vcard.serialize())))
-    args.outfile.write(u(merged_vcard.serialize()))
+    merged_vcard = MergeVcardGroup(vcards, resolve_conflict=rules)
+    LogVcard('Merged vCard', merged_vcard)
+    with vcf_profile.Stage('write'):
+        args.outfile.write(u(merged_vcard.serialize()))
+    for line in rules.Summary():
+        logger.info(line)
 
 
 def dispatch_main():
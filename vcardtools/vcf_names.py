@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Turning contact names into filenames.
+
+Shared by split and list.  Everything here runs once per card, so it is
+kept to C-level string checks and, only where needed, one precompiled
+regex.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import re
+
+from . import vcf_fastparse
+
+
+# Hex digits of the card identity used to tell apart cards of the same name.
+SUFFIX_LENGTH = 8
+
+# Runs of whitespace and punctuation, including underscores already in the
+# name, collapse into a single underscore.
+PUNCTUATION_REGEX = re.compile(r"(?:&amp;|[\s\-'.&+@_])+", re.U)
+
+
+class NameError(Exception):
+    pass
+
+
+def _IsAscii(s):
+    try:
+        return s.isascii()
+    except AttributeError:
+        # Python < 3.7
+        return all(ord(c) < 128 for c in s)
+
+
+def IsFileSystemCompatString(input_str, encoding='latin-1'):
+    """Returns strings that can be read in the desired encoding or ''.
+
+    Motivation: Even though filesystems frequently can support utf-8 file
+    names today it can still pose an issue for people who lack the needed
+    keys on their keyboards.  As such making sure filenames are written in
+    a format people can easily manipulate them in is important -- even though
+    the content may very well be utf-8.
+    """
+    # every supported charset is an ASCII superset and isascii() is a
+    # flag lookup, so only the rare non-ASCII names pay for an encode
+    if _IsAscii(input_str):
+        return input_str
+    try:
+        input_str.encode(encoding)
+    except (UnicodeDecodeError, UnicodeEncodeError):
+        return ''
+    return input_str
+
+
+def CleanString(s):
+    """Cleans up string.
+
+    Lowercases and turns every run of whitespace and punctuation into a
+    single underscore, with none left at either end.
+    """
+    return PUNCTUATION_REGEX.sub('_', s).strip('_').lower()
+
+
+def GetEmailUsername(email_addr):
+    login = email_addr.split('@')[0]
+    return CleanString(login)
+
+
+def GetFieldsFilename(fields, filename_charset='latin-1'):
+    """Same as GetVcardFilename but for a vcf_fastparse.VcardFields record."""
+    fname_pieces = []
+    for val in (fields.n or ())[:3]:
+        if val and IsFileSystemCompatString(val, encoding=filename_charset):
+            # most names have nothing to clean, isalnum() is far cheaper
+            # than the regex
+            if val.isalnum():
+                fname_pieces.append(val.lower())
+            else:
+                fname_pieces.append(CleanString(val))
+    fname = '_'.join(piece for piece in fname_pieces if piece)
+
+    if not fname and fields.email:
+        fname = GetEmailUsername(fields.email[0])
+
+    if not fname:
+        raise NameError('{} HAS NO POSSIBLE FILENAME!'.format(fields))
+    return fname + '.vcf'
+
+
+def GetVcardFilename(vcard, filename_charset='latin-1'):
+    return GetFieldsFilename(vcf_fastparse.FieldsFromVobject(vcard),
+                             filename_charset=filename_charset)
+
+
+def GetCardSuffix(uid, raw):
+    """Returns a filename suffix identifying a card across runs.
+
+    Derived from the UID when the card has one, so that it survives edits,
+    from the content (raw bytes) otherwise.
+    """
+    if uid:
+        identity = ('uid:' + uid.strip()).encode('utf-8')
+    else:
+        identity = raw
+    return hashlib.sha1(identity).hexdigest()[:SUFFIX_LENGTH]
+
+
+class FilenameAllocator(object):
+    """Hands out unique filenames to cards as they stream in.
+
+    The first card to ask for a name gets it as is, unless the name went to
+    another card on the previous run: that card gets it back when it comes,
+    so reordering the export does not move names around.  Any other card of
+    the same name gets its identity suffix ('john-1a2b3c4d.vcf'), which
+    does not depend on where the card is in the export or on the other
+    cards; identical cards, or suffixes that happen to collide, are
+    numbered on top ('john-1a2b3c4d-2.vcf').  Only the names handed out are
+    kept.
+
+    Attributes:
+      renamed (int): Cards that got a suffix.
+      owners (dict): {name handed out unsuffixed: suffix of its card}, to
+          pass to the next run.
+    """
+
+    def __init__(self, previous_owners=None):
+        """
+        Args:
+          previous_owners (dict): The owners of the previous run.
+        """
+        self.taken = set()
+        self.renamed = 0
+        self.owners = {}
+        self._previous_owners = previous_owners or {}
+
+    def Allocate(self, fname, suffix):
+        """Returns the final name of a card.
+
+        Args:
+          fname (str): The name the card asks for, 'john.vcf'.
+          suffix (str): Its identity, see GetCardSuffix.
+        """
+        if fname not in self.taken:
+            owner = self._previous_owners.get(fname)
+            if owner is None or owner == suffix:
+                self.taken.add(fname)
+                self.owners[fname] = suffix
+                return fname
+        self.renamed += 1
+        base, ext = os.path.splitext(fname)
+        candidate = '{}-{}{}'.format(base, suffix, ext)
+        count = 1
+        while candidate in self.taken:
+            count += 1
+            candidate = '{}-{}-{}{}'.format(base, suffix, count, ext)
+        self.taken.add(candidate)
+        return candidate
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Normalized keys for the identifiers people are matched on.
+
+Two cards that share a normalized email, phone number or name are assumed
+to describe the same person.  Every function returns None when the value
+is too weak to identify anyone.
+
+GetPropertyKey goes further and gives any vobject property value a
+hashable key that is equal for values meaning the same thing, so merging
+can compare and combine properties without caring about case, spacing or
+punctuation.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import re
+
+import six
+
+
+NON_DIGIT_REGEX = re.compile(r'\D')
+WHITESPACE_REGEX = re.compile(r'\s+', re.U)
+
+# Anything shorter is an extension or a service number, not a person.
+MIN_PHONE_DIGITS = 7
+
+
+def _Fold(s):
+    try:
+        return s.casefold()
+    except AttributeError:
+        return s.lower()
+
+
+def NormalizeEmail(email):
+    """'  Foo@Example.COM ' -> 'foo@example.com'."""
+    email = _Fold(email.strip())
+    if '@' not in email:
+        return None
+    return email
+
+
+def NormalizePhone(tel, default_country=None):
+    """'+1 (111) 555-1212' -> '11115551212'.
+
+    Numbers are reduced to their digits, E.164 style without the '+'.  With
+    a default_country calling code ('1', '44', ...) numbers written without
+    an international prefix are assumed to be national numbers of that
+    country: a trunk '0' is dropped and the calling code prepended, so
+    '020 7946 0018' and '+44 20 7946 0018' match for '44'.
+
+    vCard 4.0 tel: URIs lose their scheme and parameters, so
+    'tel:+1-555-555-1212;ext=5' -> '15555551212'.
+    """
+    tel = tel.strip()
+    if tel[:4].lower() == 'tel:':
+        # ;ext= and ;phone-context= are not part of the number
+        tel = tel[4:].split(';', 1)[0].strip()
+    digits = NON_DIGIT_REGEX.sub('', tel)
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    if tel.startswith('+'):
+        return digits
+    if digits.startswith('00'):
+        # international prefix used in most of the world
+        return digits[2:]
+    if default_country:
+        if default_country == '1' and len(digits) == 11 and digits[0] == '1':
+            # North American numbers are often dialed with the 1
+            return digits
+        return default_country + digits.lstrip('0')
+    return digits
+
+
+def ParseCountryCode(value):
+    """argparse type of a calling code: '44', '+44' or '0044' -> '44'."""
+    code = NON_DIGIT_REGEX.sub('', value).lstrip('0')
+    if not code or len(code) > 3:
+        raise argparse.ArgumentTypeError(
+            'invalid calling code: {}'.format(value))
+    return code
+
+
+def NormalizeName(name):
+    """'  Forrest   GUMP ' -> 'forrest gump'."""
+    name = WHITESPACE_REGEX.sub(' ', _Fold(name)).strip()
+    return name or None
+
+
+ADR_PARTS = ('box', 'extended', 'street', 'city', 'region', 'code', 'country')
+N_PARTS = ('family', 'given', 'additional', 'prefix', 'suffix')
+
+
+def NormalizeText(value):
+    """Collapses whitespace, keeps case: ' Shrimp   Man ' -> 'Shrimp Man'."""
+    return WHITESPACE_REGEX.sub(' ', value).strip()
+
+
+def _PartKey(part):
+    # structured value components may themselves be lists
+    if isinstance(part, (list, tuple)):
+        part = ' '.join(part)
+    return NormalizeName(part) or ''
+
+
+def _StructuredKey(parts):
+    def GetKey(value):
+        return tuple(_PartKey(getattr(value, part, '')) for part in parts)
+    return GetKey
+
+
+def _EmailKey(value):
+    return NormalizeEmail(value) or _Fold(NormalizeText(value))
+
+
+def _TelKey(value):
+    return NormalizePhone(value) or NormalizeText(value)
+
+
+def _ListKey(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_PartKey(v) for v in value)
+    return (_PartKey(value),)
+
+
+def _CategoriesKey(value):
+    return frozenset(_ListKey(value))
+
+
+PROPERTY_KEYS = {
+    'email': _EmailKey,
+    'tel': _TelKey,
+    'adr': _StructuredKey(ADR_PARTS),
+    'n': _StructuredKey(N_PARTS),
+    'org': _ListKey,
+    'categories': _CategoriesKey,
+}
+
+
+def GetPropertyKey(name, value):
+    """Returns a hashable key of a vobject property value.
+
+    Args:
+      name (str): Lowercase property name, e.g. 'tel'.
+      value: The property value as vobject parsed it.
+
+    Returns:
+      Equal keys for values that mean the same: lowercased emails, phone
+      number digits, ADR and N as tuples of normalized components, ORG and
+      CATEGORIES as normalized lists, any other text with its whitespace
+      collapsed.
+    """
+    get_key = PROPERTY_KEYS.get(name)
+    if get_key is not None:
+        return get_key(value)
+    if isinstance(value, six.text_type):
+        return NormalizeText(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(NormalizeText(six.text_type(v)) for v in value)
+    if isinstance(value, bytes):
+        return value
+    return NormalizeText(six.text_type(value))
+
+
+def AddArguments(parser):
+    parser.add_argument('--default_country',
+                        metavar='CALLING_CODE',
+                        type=ParseCountryCode,
+                        help='Calling code (e.g. 1 or 44) of phone numbers '
+                             'written without an international prefix, so '
+                             'they match their +CC form')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parallel mapping of raw vCard blocks over a process pool.
+
+Blocks are shipped to the workers in batches and only the compact results
+come back, in input order.  The number of batches in flight is bounded so
+that a huge export is never queued up in memory ahead of the workers.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+
+from . import vcf_cache
+from . import vcf_profile
+
+
+DEFAULT_BATCH_SIZE = 256
+
+# Batches queued per worker before waiting on the oldest one.
+BATCHES_IN_FLIGHT = 2
+
+
+def GetJobCount(jobs):
+    """Turns a --jobs value into a worker count, 0 meaning one per CPU."""
+    if jobs is None:
+        return 1
+    if jobs <= 0:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    return jobs
+
+
+def _InitWorker(cache):
+    # Ctrl-C reaches the whole process group, the parent terminates the
+    # workers when it stops
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    vcf_cache.SetCache(cache)
+
+
+def _MapBatch(func, batch):
+    results = [func(block) for block in batch]
+    # workers are terminated, not shut down, so commit with every batch
+    vcf_cache.Flush()
+    return results
+
+
+def _Batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _GetResults(async_result):
+    with vcf_profile.Stage('workers', items=0):
+        results = async_result.get()
+    return results
+
+
+def MapBlocks(func, blocks, jobs=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields func(block) for every block, in input order.
+
+    Args:
+      func: Picklable callable (module level function or functools.partial)
+          run in the workers.
+      blocks: Iterable of raw vCard blocks.
+      jobs (int): Number of worker processes, 1 runs in-process.
+      batch_size (int): Blocks sent to a worker at a time.
+    """
+    jobs = GetJobCount(jobs)
+    if jobs == 1:
+        for block in blocks:
+            yield func(block)
+        return
+
+    # only imported for --jobs, it takes longer to import than a small
+    # file takes to list
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs, initializer=_InitWorker,
+                                initargs=(vcf_cache.GetCache(),))
+    try:
+        pending = collections.deque()
+        for batch in _Batches(blocks, batch_size):
+            pending.append(pool.apply_async(_MapBatch, (func, batch)))
+            if len(pending) >= jobs * BATCHES_IN_FLIGHT:
+                for result in _GetResults(pending.popleft()):
+                    yield result
+        while pending:
+            for result in _GetResults(pending.popleft()):
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def AddArguments(parser):
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=1,
+                        help='Parse vCards in N worker processes '
+                             '(0 for one per CPU)')
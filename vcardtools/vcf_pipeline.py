@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Overlapping the stages of a command with bounded queues.
+
+Prefetch() runs an iterator, such as reading and parsing the input, in a
+background thread that stays a bounded number of items ahead of its
+consumer: when the consumer, naming and writing files say, falls behind,
+the producer blocks instead of filling memory (backpressure), and while the
+consumer waits on the disk the producer keeps parsing.  Closing the
+consumer, on an error or Ctrl-C, stops the producer and closes its
+iterator, which shuts down any pool it runs.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import threading
+import timeit
+
+import six
+from six.moves import queue
+
+from . import vcf_profile
+
+
+DEFAULT_PREFETCH = 4096
+
+# Items are handed over in chunks, a queue operation per item costs more
+# than naming a card.
+CHUNK_SIZE = 64
+
+# How often a producer blocked on a full queue checks whether to stop.
+POLL_SECONDS = 0.1
+
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
+_END = object()
+
+
+class _Failure(object):
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _Put(chunks, item, stop):
+    """Puts item on the queue, returns False if told to stop first."""
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _Produce(items, chunks, stop):
+    try:
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= CHUNK_SIZE:
+                if not _Put(chunks, chunk, stop):
+                    return
+                chunk = []
+        if chunk and not _Put(chunks, chunk, stop):
+            return
+        _Put(chunks, _END, stop)
+    except Exception:
+        _Put(chunks, _Failure(sys.exc_info()), stop)
+    finally:
+        close = getattr(items, 'close', None)
+        if close is not None:
+            close()
+
+
+def Prefetch(iterable, size=DEFAULT_PREFETCH):
+    """Yields the items of iterable, produced by a background thread.
+
+    Exceptions of the producer are raised in the consumer.  Time spent
+    waiting for the producer counts to the 'workers' stage.
+
+    Args:
+      iterable: Iterable to run in the thread, a generator is closed there
+          when it is exhausted or the consumer stops early.
+      size (int): Number of items the producer may run ahead.
+    """
+    chunks = queue.Queue(max(size // CHUNK_SIZE, 1))
+    stop = threading.Event()
+    thread = threading.Thread(target=_Produce,
+                              args=(iter(iterable), chunks, stop))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            with vcf_profile.Stage('workers', items=0):
+                chunk = chunks.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, _Failure):
+                six.reraise(*chunk.exc_info)
+            for item in chunk:
+                yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class Progress(object):
+    """Logs how many items went through, every interval seconds.
+
+    Attributes:
+      count (int): Items so far.
+    """
+
+    def __init__(self, log, what, interval=DEFAULT_PROGRESS_INTERVAL):
+        self.log = log
+        self.what = what
+        self.interval = interval
+        self.count = 0
+        self.start = self._last = timeit.default_timer()
+
+    def Add(self, items=1):
+        self.count += items
+        if not self.interval:
+            return
+        now = timeit.default_timer()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.log.info('{} {} so far, {:.0f}/s.'.format(
+                self.count, self.what, self.count / (now - self.start)))
+
+
+def AddArguments(parser):
+    parser.add_argument('--progress',
+                        type=float,
+                        default=DEFAULT_PROGRESS_INTERVAL,
+                        metavar='SECONDS',
+                        help='Log progress every SECONDS, 0 for never '
+                             '(default: {:g})'.format(
+                                 DEFAULT_PROGRESS_INTERVAL))
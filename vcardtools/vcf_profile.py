@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Per-stage timings of a vcardtool run, for vcardtool --timings.
+
+The pipeline stages mark themselves with Stage() blocks or wrap their
+iterators with Iter().  Stages nest: time spent in an inner stage is not
+counted in the outer one, so the stage times add up to the run time.
+Nothing is recorded unless Enable() was called, and then only in the main
+thread; with --jobs the parsing done by worker processes, and the stages
+split runs in a background thread, show up as time waiting for the
+workers.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import logging
+import sys
+import threading
+import timeit
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+# Report order of the stages, any other stage comes after these.
+STAGE_ORDER = ('read', 'scan', 'cache', 'parse', 'parse (vobject)', 'workers',
+               'naming', 'dedup', 'index', 'merge', 'binary', 'write')
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Timings(object):
+    """Exclusive time and item count of every stage since creation."""
+
+    def __init__(self):
+        self.start = timeit.default_timer()
+        self.seconds = collections.defaultdict(float)
+        self.items = collections.Counter()
+        self._stack = []
+        self._thread = threading.current_thread()
+
+    def Enter(self, name):
+        now = timeit.default_timer()
+        if self._stack:
+            # pause the enclosing stage
+            outer = self._stack[-1]
+            self.seconds[outer[0]] += now - outer[1]
+        self._stack.append([name, now])
+
+    def Exit(self, items):
+        now = timeit.default_timer()
+        name, start = self._stack.pop()
+        self.seconds[name] += now - start
+        self.items[name] += items
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def IsMainThread(self):
+        return threading.current_thread() is self._thread
+
+    def Report(self, out=None):
+        out = out or sys.stderr
+        total = timeit.default_timer() - self.start
+        names = sorted(self.seconds, key=lambda n: (
+            STAGE_ORDER.index(n) if n in STAGE_ORDER else len(STAGE_ORDER),
+            n))
+        print('\nTimings:', file=out)
+        print('  {:<16} {:>9} {:>10} {:>12}'.format(
+            'stage', 'seconds', 'items', 'items/s'), file=out)
+        for name in names:
+            seconds = self.seconds[name]
+            items = self.items[name]
+            print('  {:<16} {:>9.3f} {:>10} {:>12}'.format(
+                name, seconds, items or '',
+                '{:.0f}'.format(items / seconds) if items and seconds
+                else ''), file=out)
+        print('  {:<16} {:>9.3f}'.format(
+            'other', max(total - sum(self.seconds.values()), 0)), file=out)
+        print('  {:<16} {:>9.3f}'.format('total', total), file=out)
+        rss = GetPeakRss()
+        if rss is not None:
+            print('Peak RSS: {:.1f} MB, worker processes {:.1f} MB'.format(
+                rss[0] / 2 ** 20, rss[1] / 2 ** 20), file=out)
+
+
+class _Stage(object):
+
+    def __init__(self, timings, name, items):
+        self.timings = timings
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.timings.Enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.Exit(self.items)
+        return False
+
+
+_timings = None
+
+
+def Enable():
+    """Starts recording, returns the Timings."""
+    global _timings
+    _timings = Timings()
+    return _timings
+
+
+def Stage(name, items=1):
+    """Context manager timing a block as part of a stage.
+
+    Args:
+      name (str): Stage name, see STAGE_ORDER.
+      items (int): Number of items the block handles, cards usually.
+    """
+    if _timings is None or not _timings.IsMainThread():
+        return _NULL_STAGE
+    return _Stage(_timings, name, items)
+
+
+def Iter(name, iterable):
+    """Wraps an iterable so that getting each item counts to a stage."""
+    if _timings is None:
+        return iterable
+    return _IterStage(_timings, name, iterable)
+
+
+def _IterStage(timings, name, iterable):
+    it = iter(iterable)
+    if not timings.IsMainThread():
+        # run by a vcf_pipeline thread
+        for item in it:
+            yield item
+        return
+    while True:
+        timings.Enter(name)
+        try:
+            item = next(it)
+        except StopIteration:
+            timings.Exit(0)
+            return
+        except BaseException:
+            timings.Exit(0)
+            raise
+        timings.Exit(1)
+        yield item
+
+
+def GetPeakRss():
+    """Returns (own, children) peak resident set size in bytes, or None."""
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def SetVerbose():
+    """Turns on debug logging of every vcardtools module."""
+    for name in list(logging.Logger.manager.loggerDict):
+        if name.startswith('vcardtools'):
+            logging.getLogger(name).setLevel(logging.DEBUG)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Incremental reading of multi-entry vCard files.
+
+The whole file is never held in memory.  Regular files are memory-mapped
+and card boundaries are found with a bytes regex right on the mapping, so
+the OS page cache holds the data, shared by every process reading the
+same export, and only the bytes of one card at a time are copied and
+decoded.  Anything that cannot be mapped (pipes, empty files) is scanned
+in fixed-size chunks instead.  Either way each BEGIN:VCARD...END:VCARD
+block is handed out as soon as it is found, so peak memory is bounded by
+the largest single card.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import mmap
+import re
+
+from . import vcf_card
+from . import vcf_fastparse
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Both markers must start a line.  Folded continuation lines (RFC 6350
+# section 3.2) always begin with a space or a tab, so a folded value can
+# never be mistaken for a card boundary.
+BEGIN_REGEX = re.compile(br'^(?:\xef\xbb\xbf)?(BEGIN:VCARD)', re.M | re.I)
+END_REGEX = re.compile(br'^END:VCARD', re.M | re.I)
+
+
+def MapFile(f):
+    """Returns a read-only mmap of a binary file, None if it cannot be mapped.
+    """
+    try:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, io.UnsupportedOperation, ValueError, OSError,
+            OverflowError):
+        # no file descriptor, empty file, pipe or too big for the address
+        # space
+        return None
+    if hasattr(buf, 'madvise'):
+        # Python 3.8+, lets the kernel read ahead
+        buf.madvise(mmap.MADV_SEQUENTIAL)
+    return buf
+
+
+def IterMappedVcardBlocks(buf, pos=0):
+    """Yields (offset, raw_bytes) for every vCard block in a mapped buffer.
+
+    Only the bytes of each block are copied out of buf.
+    """
+    while True:
+        m = BEGIN_REGEX.search(buf, pos)
+        if not m:
+            return
+        start = m.start(1)
+        m = END_REGEX.search(buf, m.end())
+        if not m:
+            return
+        pos = m.end()
+        yield start, buf[start:pos]
+
+
+def IterVcardBlocks(f, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields (offset, raw_bytes) for every vCard block in a binary file.
+
+    Args:
+      f: File object opened in binary mode.
+      chunk_size (int): Number of bytes to read at a time when the file
+          cannot be memory-mapped.
+
+    Yields:
+      Tuples of the byte offset of the block in the file and the raw bytes
+      from BEGIN:VCARD up to and including END:VCARD.
+    """
+    buf = MapFile(f)
+    if buf is not None:
+        try:
+            for block in IterMappedVcardBlocks(buf, f.tell()):
+                yield block
+        finally:
+            buf.close()
+        return
+    for block in IterChunkedVcardBlocks(f, chunk_size=chunk_size):
+        yield block
+
+
+def IterChunkedVcardBlocks(f, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Same as IterVcardBlocks, reading the file chunk_size bytes at a time.
+    """
+    buf = bytearray()
+    buf_offset = 0    # file offset of buf[0]
+    card_start = None
+    scan = 0
+    eof = False
+    while True:
+        if card_start is None:
+            m = BEGIN_REGEX.search(buf, scan)
+            if m:
+                card_start = m.start(1)
+                scan = m.end()
+        if card_start is not None:
+            m = END_REGEX.search(buf, scan)
+            if m:
+                yield buf_offset + card_start, bytes(buf[card_start:m.end()])
+                card_start = None
+                scan = m.end()
+                continue
+
+        if eof:
+            return
+
+        # Drop everything that can no longer be part of a card, cutting right
+        # after a newline so that '^' keeps matching at line starts.  A
+        # partial trailing line has to be searched again once completed.
+        last_line = buf.rfind(b'\n') + 1
+        if card_start is None:
+            cut = last_line
+        else:
+            cut = buf.rfind(b'\n', 0, card_start) + 1
+            card_start -= cut
+        del buf[:cut]
+        buf_offset += cut
+        scan = last_line - cut
+        if card_start is not None:
+            scan = max(scan, card_start)
+
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        else:
+            buf += chunk
+
+
+def ReadVcardBlocks(f, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields every vCard block in a binary file as a decoded string."""
+    for _, block in IterVcardBlocks(f, chunk_size=chunk_size):
+        yield vcf_fastparse.DecodeCard(block, encoding)
+
+
+def IterRawVcards(f, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields a vcf_card.RawVcard for every block in a binary file."""
+    for offset, block in IterVcardBlocks(f, chunk_size=chunk_size):
+        yield vcf_card.RawVcard(block, offset=offset, encoding=encoding)
+
+
+def GetVcardsFromFile(f, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields a parsed vobject vCard for every block in a binary file."""
+    import vobject
+    for card in ReadVcardBlocks(f, encoding=encoding, chunk_size=chunk_size):
+        yield vobject.readOne(card)
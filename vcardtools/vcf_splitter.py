@@ -19,17 +19,34 @@ from __future__ import unicode_literals
 import argparse
 import codecs
 import collections
+import functools
+import hashlib
 import logging
 import os
 import re
 import sys
 
-import vobject
+import six
 from six import u
 
+from . import vcf_binary
+from . import vcf_card
+from . import vcf_fastparse
+from . import vcf_index
+from . import vcf_inputs
+from . import vcf_manifest
+from . import vcf_parallel
+from . import vcf_pipeline
+from . import vcf_profile
+from . import vcf_writer
+# re-exported, they used to live here
+from .vcf_names import (NameError, IsFileSystemCompatString, CleanString,
+                        GetEmailUsername, GetFieldsFilename, GetVcardFilename,
+                        GetCardSuffix, FilenameAllocator)
+
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.INFO)
 log_formatter = logging.Formatter(('%(asctime)s - %(name)s - %(levelname)s'
                                    ' - %(message)s'))
 log_handler = logging.StreamHandler()
@@ -40,12 +57,11 @@ logger.addHandler(log_handler)
 
 VCARD_REGEX=r'^BEGIN:VCARD.*?END:VCARD'
 
-
-class NameError(Exception):
-    pass
+BUCKETS = ('none', 'initial', 'hash')
 
 
 def GetVcardsFromString(content):
+    import vobject
     match = re.findall(VCARD_REGEX, content, re.M | re.S)
     for card in match:
         yield vobject.readOne(card)
@@ -57,93 +73,226 @@ def IsNotGplusOnly(vcard):
     return card_keys.difference(gplus_only_fields)
 
 
-def IsFileSystemCompatString(input_str, encoding='latin-1'):
-    """Returns strings that can be read in the desired encoding or ''.
+def GetSplitRecord(card, filename_charset='latin-1', parser='fast'):
+    """Turns a vcf_card.RawVcard into a (filename, suffix, vCard bytes) tuple.
 
-    Motivation: Even though filesystems frequently can support utf-8 file
-    names today it can still pose an issue for people who lack the needed
-    keys on their keyboards.  As such making sure filenames are written in
-    a format people can easily manipulate them in is important -- even though
-    the content may very well be utf-8.
+    Runs in the --jobs worker processes, so it only returns plain values.
+    The filename is None when none could be made for the card, the suffix
+    tells it apart from other cards of the same name, see GetCardSuffix.
+    The bytes are the card exactly as it was read, nothing is
+    re-serialized.
     """
-    try:
-        input_str.encode(encoding)
-    except (UnicodeDecodeError, UnicodeEncodeError):
-        return ''
-    return input_str
+    fields = card.GetFields(('n', 'email', 'uid'), parser=parser)
+    with vcf_profile.Stage('naming'):
+        try:
+            fname = GetFieldsFilename(fields,
+                                      filename_charset=filename_charset)
+        except NameError:
+            fname = None
+        suffix = GetCardSuffix(fields.uid, card.raw)
+    return fname, suffix, card.Serialize()
 
 
-def CleanString(s):
-    """Cleans up string.
+def GetIndexedSplitRecords(index, vcard_file, filename_charset='latin-1',
+                           read_cards=True):
+    """Yields what GetSplitRecord would for every card of an indexed file.
 
-    Doesn't catch everything, appears to sometimes allow double underscores
-    to occur as a result of replacements.
+    Names come straight from the index, cards are only read from the file
+    when they need to be written or reported, or hashed for lack of a UID.
+    """
+    for offset, length, fields in vcf_index.IterIndexedFields(index):
+        with vcf_profile.Stage('naming'):
+            try:
+                fname = GetFieldsFilename(fields,
+                                          filename_charset=filename_charset)
+            except NameError:
+                fname = None
+        card = raw = None
+        if read_cards or fname is None or not fields.uid:
+            raw = vcf_index.ReadCard(vcard_file, offset, length)
+            card = vcf_card.RawVcard(raw, offset=offset).Serialize()
+        yield fname, GetCardSuffix(fields.uid, raw), card
+
+
+def GetBucket(fname, bucket='none'):
+    """Returns the subdirectory a file goes into, '' for none.
+
+    'initial' uses the first letter of the name ('g/gump_forrest.vcf'),
+    'hash' spreads names evenly over 256 two-hex-digit directories.
     """
-    punc = (' ', '-', '\'', '.', '&amp;', '&', '+', '@')
-    pieces = []
-    for part in s.split():
-        part = part.strip()
-        for p in punc:
-            part = part.replace(p, '_')
-        part = part.strip('_')
-        part = part.lower()
-        pieces.append(part)
-    return '_'.join(pieces)
-
-
-def GetEmailUsername(email_addr):
-    login = email_addr.split('@')[0]
-    return CleanString(login)
-
-
-def GetVcardFilename(vcard, filename_charset='latin-1'):
-    fname_pieces = []
-    for name in ('family', 'given', 'additional'):
-        val = getattr(vcard.n.value, name)
-        if val and IsFileSystemCompatString(val, encoding=filename_charset):
-            fname_pieces.append(CleanString(val.lower()))
-    
-    if not fname_pieces and 'email' in vcard.contents:
-        fname_pieces.append(GetEmailUsername(vcard.email.value))
-
-    if not fname_pieces:
-        raise NameError('{} HAS NO POSSIBLE FILENAME!'.format(str(vcard)))
-    return '{}.vcf'.format('_'.join(fname_pieces))
+    if bucket == 'initial':
+        initial = fname[:1].lower()
+        return initial if initial.isalnum() else '_'
+    if bucket == 'hash':
+        return hashlib.md5(fname.encode('utf-8')).hexdigest()[:2]
+    return ''
+
+
+def ShardVcards(vcard_items, cards_per_file=1, max_bytes=None, bucket='none'):
+    """Packs (filename, vCard bytes) pairs into output files.
+
+    Cards are grouped by bucket and, in filename order, packed into files of
+    at most cards_per_file cards and max_bytes bytes (a single bigger card
+    still gets its own file).  Each file is named after its first card.
+
+    Yields:
+      (relative path, list of vCard bytes) tuples.
+    """
+    def SortKey(item):
+        return GetBucket(item[0], bucket), item[0]
+
+    shard_path = None
+    shard = []
+    shard_bytes = 0
+    for fname, vcard in sorted(vcard_items, key=SortKey):
+        path = os.path.join(GetBucket(fname, bucket), fname)
+        size = len(vcard)
+        if shard and (
+                len(shard) >= cards_per_file or
+                os.path.dirname(path) != os.path.dirname(shard_path) or
+                (max_bytes and shard_bytes + size > max_bytes)):
+            yield shard_path, shard
+            shard = []
+            shard_bytes = 0
+        if not shard:
+            shard_path = path
+        shard.append(vcard)
+        shard_bytes += size
+    if shard:
+        yield shard_path, shard
 
 
 def DedupVcardFilenames(vcard_dict):
-    """Make sure every vCard in the dictionary has a unique filename."""
-    remove_keys = []
-    add_pairs = []
-    for k, v in vcard_dict.items():
-        if not len(v) > 1:
+    """Make sure every vCard in the dictionary has a unique filename.
+
+    Kept for callers of the old API, split uses FilenameAllocator: the
+    first vCard of a name keeps it, the others get their identity suffix
+    ('john-1a2b3c4d.vcf') rather than being numbered 'john-1.vcf', ...
+
+    Args:
+      vcard_dict: {filename: [vobject vCards]}.
+
+    Returns:
+      A defaultdict(list) of {unique filename: [vobject vCard]}.
+    """
+    allocator = FilenameAllocator()
+    deduped = collections.defaultdict(list)
+    for fname, vcards in list(vcard_dict.items()):
+        for vcard in vcards:
+            suffix = GetCardSuffix(
+                vcf_fastparse.FieldsFromVobject(vcard).uid,
+                vcard.serialize().encode('utf-8'))
+            deduped[allocator.Allocate(fname, suffix)].append(vcard)
+    return deduped
+
+
+def IterNamedVcards(records, allocator, progress=None, binary_output=None):
+    """Yields (final filename, vCard bytes), skipping cards without a name.
+
+    binary_output, a vcf_binary.BinaryOutput, strips or extracts the binary
+    values of the cards.
+    """
+    for fname, suffix, vcard in records:
+        if progress is not None:
+            progress.Add()
+        if fname is None:
+            logger.warning('SKIPPING: Could not create filename for:\n{}'.format(
+                vcf_fastparse.DecodeCard(vcard))
+            )
             continue
-        for idx, vcard in enumerate(v):
-            fname, ext = os.path.splitext(k)
-            fname = '{}-{}'.format(fname, idx + 1)
-            fname = fname + ext
-            assert fname not in vcard_dict
-            add_pairs.append((fname, vcard))
-        remove_keys.append(k)
+        with vcf_profile.Stage('dedup'):
+            fname = allocator.Allocate(fname, suffix)
+        logger.debug('%s', fname)
+        if binary_output is not None:
+            with vcf_profile.Stage('binary'):
+                vcard = binary_output.Apply(vcard)
+        yield fname, vcard
 
-    for k, v in add_pairs:
-        vcard_dict[k].append(v)
 
-    for k in remove_keys:
-        vcard_dict.pop(k)
+def WriteMissingFile(writer, path, data):
+    """Writes a content-addressed file unless it is there already."""
+    if not writer.Exists(path):
+        writer.Write(path, data)
 
-    return vcard_dict
+
+def WriteShards(writer, shards, incremental=False, name_owners=None):
+    """Writes (path, list of vCard bytes) shards and closes the writer.
+
+    With incremental only the files that changed are written, see
+    WriteShardsIncremental.  When stopped early, by Ctrl-C say, the writes
+    already queued are finished and the files written so far saved to the
+    manifest along with the ones of the last run not reached yet, so that
+    running again with --incremental only writes what is missing.
+
+    name_owners, the FilenameAllocator.owners filled while the shards are
+    named, is saved along with the manifest.
+    """
+    # the manifest always goes to the output directory, resolved once, so
+    # a resumed run finds it whatever its working directory
+    output_dir = os.path.abspath(writer.output_dir)
+    old_manifest = vcf_manifest.LoadManifest(output_dir)
+    new_manifest = {}
+    name_owners = name_owners if name_owners is not None else {}
+    complete = False
+    try:
+        with writer:
+            if incremental:
+                WriteShardsIncremental(writer, shards, old_manifest,
+                                       new_manifest)
+            else:
+                for path, vcards in shards:
+                    if writer.Write(path, b''.join(vcards)):
+                        new_manifest[path] = vcf_manifest.HashCards(vcards)
+        complete = True
+    finally:
+        if complete:
+            manifest = new_manifest
+            owners = name_owners
+        else:
+            manifest = dict(old_manifest)
+            manifest.update(new_manifest)
+            owners = vcf_manifest.LoadNameOwners(output_dir)
+            owners.update(name_owners)
+        for path in writer.failed_paths:
+            manifest.pop(path, None)
+        if incremental or not complete:
+            vcf_manifest.SaveManifest(output_dir, manifest, owners)
+
+
+def WriteShardsIncremental(writer, shards, old_manifest, new_manifest):
+    """Writes only the output files whose cards changed since the last run.
+
+    Files listed in the previous manifest but no longer produced are
+    deleted.  Every file produced is added to new_manifest once it is
+    written or found unchanged.
+    """
+    unchanged = 0
+    for path, vcards in shards:
+        digest = vcf_manifest.HashCards(vcards)
+        if old_manifest.get(path) == digest and writer.Exists(path):
+            unchanged += 1
+        else:
+            writer.Write(path, b''.join(vcards), overwrite=True)
+        new_manifest[path] = digest
+    removed = 0
+    for path in set(old_manifest) - set(new_manifest):
+        if writer.Remove(path):
+            removed += 1
+    logger.info('{} files unchanged, {} written, {} removed.'.format(
+        unchanged, len(new_manifest) - unchanged, removed))
 
 
 def WriteVcard(filename, vcard, fopen=codecs.open):
-    """Writes a vCard into the given filename."""
+    """Writes a vCard, or its serialized string, into the given filename."""
     if os.access(filename, os.F_OK):
         logger.warning('File exists at "{}", skipping.'.format(filename))
         return False
+    if not isinstance(vcard, six.string_types):
+        vcard = u(vcard.serialize())
     try:
         with fopen(filename, 'w', encoding='utf-8') as f:
-            logger.debug('Writing {}:\n{}'.format(filename, u(vcard.serialize())))
-            f.write(u(vcard.serialize()))
+            logger.debug('Writing %s:\n%s', filename, vcard)
+            f.write(vcard)
     except OSError:
         logger.error('Error writing to file "{}", skipping.'.format(filename))
         return False
@@ -152,8 +301,9 @@ def WriteVcard(filename, vcard, fopen=codecs.open):
 
 def AddArguments(parser):
     parser.add_argument('vcard_file',
-                        nargs=1,
-                        help='A multi-entry vCard to split.')
+                        nargs='+',
+                        help='A multi-entry vCard to split, or several '
+                             'files, directories or globs')
     parser.add_argument('--pretend',
                         action='store_true',
                         help='Print summary but do not write files')
@@ -164,44 +314,127 @@ def AddArguments(parser):
     parser.add_argument('--output_dir',
                         nargs=1,
                         help='Write output files in provided directory')
+    vcf_parallel.AddArguments(parser)
+    vcf_inputs.AddArguments(parser)
+    vcf_fastparse.AddArguments(parser)
+    vcf_index.AddArguments(parser)
+    parser.add_argument('--cards_per_file',
+                        type=int,
+                        default=1,
+                        help='Pack up to N vCards into each output file')
+    parser.add_argument('--max_bytes',
+                        type=int,
+                        help='Start a new output file before one would grow '
+                             'past this size (implies unlimited '
+                             '--cards_per_file unless given)')
+    parser.add_argument('--bucket',
+                        choices=BUCKETS,
+                        default='none',
+                        help='Spread output files over subdirectories by '
+                             'initial letter or by hash of the name')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Only rewrite or delete the files whose '
+                             'contacts changed since the last split into '
+                             'the same directory')
+    vcf_writer.AddArguments(parser)
+    vcf_pipeline.AddArguments(parser)
+    vcf_binary.AddArguments(parser)
 
 
 def main(args, usage=''):
     try:
-        with codecs.open(args.vcard_file[0], 'r', encoding='utf-8') as f:
-            content = f.read()
-    except OSError:
-        print('\nERROR: Check that all files specified exist and permissions'
-              ' are OK.\n')
+        filenames = vcf_inputs.ExpandInputs(args.vcard_file)
+        if args.index and len(filenames) != 1:
+            raise IOError('--index works on a single vCard file')
+        vcard_file = open(filenames[0], 'rb') if args.index else None
+    except (IOError, OSError) as e:
+        print('\nERROR: {}\nCheck that all files specified exist and '
+              'permissions are OK.\n'.format(e))
         print(usage)
         sys.exit(1)
 
-    new_files = collections.defaultdict(list)
-    for vcard in GetVcardsFromString(content):
-        try:
-            fname = GetVcardFilename(vcard,
-                                     filename_charset=args.filename_charset)
-            logger.debug('{}'.format(fname))
-        except NameError as e:
-            logger.warning('SKIPPING: Could not create filename for:\n{}'.format(
-                u(vcard.serialize()))
-            )
-            continue
-        new_files[fname].append(vcard)
-
-    new_vcards = DedupVcardFilenames(new_files)
+    writer = None
     if not args.pretend:
-        for k, v in new_vcards.items():
-            vcard_path = k
-            if args.output_dir:
-                output_dir = os.path.abspath(args.output_dir[0])
-                if os.path.isdir(output_dir) and os.access(output_dir, os.W_OK):
-                    vcard_path = os.path.join(output_dir, k)
-                else:
-                    logger.warning('--output_dir may not be a directory!')
-                    logger.fatal('Cannot write to output directory.')
-                    sys.exit(1)
-            WriteVcard(vcard_path, v[0])
+        try:
+            writer = vcf_writer.VcardWriter(
+                args.output_dir[0] if args.output_dir else None,
+                jobs=args.write_jobs, atomic=args.atomic)
+        except vcf_writer.OutputDirError as e:
+            logger.warning('--output_dir may not be a directory!')
+            logger.fatal(str(e))
+            sys.exit(1)
+
+    get_record = functools.partial(GetSplitRecord,
+                                   filename_charset=args.filename_charset,
+                                   parser=args.parser)
+    if vcard_file is not None:
+        index = vcf_index.OpenIndex(filenames[0])
+        vcf_index.UpdateIndex(index, filenames[0])
+        # the index is not shared with another thread, and needs no parsing
+        records = GetIndexedSplitRecords(
+            index, vcard_file, filename_charset=args.filename_charset,
+            read_cards=not args.pretend)
+    else:
+        # read and parse ahead while the cards before are named and written
+        records = vcf_pipeline.Prefetch(vcf_parallel.MapBlocks(
+            get_record,
+            vcf_inputs.IterInputRawVcards(filenames, jobs=args.read_jobs),
+            jobs=args.jobs))
+    # names go to the same cards as on the last run
+    allocator = FilenameAllocator(
+        vcf_manifest.LoadNameOwners(writer.output_dir) if writer else None)
+    progress = vcf_pipeline.Progress(logger, 'vCards', args.progress)
+    binary_output = None
+    # lazy only matters to cards parsed by vobject, split passes them on
+    if writer is not None and args.binary in ('strip', 'extract'):
+        # bucket directories are one level down
+        binary_output = vcf_binary.BinaryOutput(
+            args.binary,
+            uri_prefix=('../' if args.bucket != 'none' else '') +
+            vcf_binary.BINARY_DIR + '/',
+            write=functools.partial(WriteMissingFile, writer))
+    named_vcards = IterNamedVcards(records, allocator, progress,
+                                   binary_output)
+
+    cards_per_file = args.cards_per_file
+    if args.max_bytes and cards_per_file == 1:
+        cards_per_file = float('inf')
+    try:
+        if writer is None:
+            for _ in named_vcards:
+                pass
+        elif cards_per_file == 1:
+            # every name is final as soon as it is handed out, so cards are
+            # written as they are read
+            shards = ((os.path.join(GetBucket(fname, args.bucket), fname),
+                       [vcard]) for fname, vcard in named_vcards)
+            WriteShards(writer, shards, args.incremental,
+                        name_owners=allocator.owners)
+        else:
+            # packing goes by filename order, which needs every name
+            shards = ShardVcards(list(named_vcards),
+                                 cards_per_file=cards_per_file,
+                                 max_bytes=args.max_bytes,
+                                 bucket=args.bucket)
+            WriteShards(writer, shards, args.incremental,
+                        name_owners=allocator.owners)
+    except KeyboardInterrupt:
+        if writer is not None:
+            logger.warning('Interrupted after {} vCards, {} files written. '
+                           'Run again with --incremental to write the '
+                           'rest.'.format(progress.count, writer.written))
+        sys.exit(130)
+    finally:
+        records.close()
+        if vcard_file is not None:
+            vcard_file.close()
+    if binary_output is not None and binary_output.extracted:
+        logger.info('{} binary values extracted to {}/.'.format(
+            binary_output.extracted, vcf_binary.BINARY_DIR))
+    if allocator.renamed:
+        logger.info('{} vCards share their name with an earlier one and '
+                    'got a suffix.'.format(allocator.renamed))
 
 
 def dispatch_main():
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Writing many small vCard files with as few syscalls as possible.
+
+The output directory, and every bucket subdirectory under it, is checked
+and listed once into a set, so skipping files that already exist costs no
+syscall per card.  Each card is serialized once and written by a small
+thread pool; the number of pending writes is bounded so serialized cards
+never pile up in memory.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import logging
+import os
+import tempfile
+import threading
+from concurrent import futures
+
+import six
+from six import u
+
+from . import vcf_profile
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+log_formatter = logging.Formatter(('%(asctime)s - %(name)s - %(levelname)s'
+                                   ' - %(message)s'))
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(log_formatter)
+log_handler.setLevel(logging.DEBUG)
+logger.addHandler(log_handler)
+
+
+DEFAULT_WRITE_JOBS = 4
+
+# Writes queued per writer thread before Write() blocks.
+WRITES_IN_FLIGHT = 16
+
+
+class OutputDirError(Exception):
+    pass
+
+
+def CheckOutputDir(output_dir):
+    """Returns the absolute output directory or raises OutputDirError."""
+    output_dir = os.path.abspath(output_dir)
+    if not (os.path.isdir(output_dir) and os.access(output_dir, os.W_OK)):
+        raise OutputDirError('Cannot write to output directory "{}".'.format(
+            output_dir))
+    return output_dir
+
+
+def WriteFile(path, data, atomic=False):
+    """Writes text (utf-8) or bytes into path.
+
+    With atomic the data goes to a temporary file in the same directory
+    first, which is then renamed over path, so readers never see a partial
+    file.
+    """
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    encoding = None if mode == 'wb' else 'utf-8'
+    if not atomic:
+        with io.open(path, mode, encoding=encoding) as f:
+            f.write(data)
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix='.', suffix='.tmp')
+    try:
+        with io.open(fd, mode, encoding=encoding) as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class VcardWriter(object):
+    """Writes vCards into one directory tree through a thread pool.
+
+    Filenames may include a subdirectory, which is created when first used.
+    Use as a context manager, leaving it waits for all pending writes.
+
+    Attributes:
+      written (int): Files written so far.
+      skipped (int): Files skipped because they already existed.
+      failed (int): Files that could not be written.
+      failed_paths (set): Their filenames.
+    """
+
+    def __init__(self, output_dir=None, jobs=DEFAULT_WRITE_JOBS, atomic=False):
+        self.output_dir = CheckOutputDir(output_dir or '.')
+        self.atomic = atomic
+        self.existing = set(os.listdir(self.output_dir))
+        self._scanned_dirs = set([''])
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.failed_paths = set()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(jobs * WRITES_IN_FLIGHT)
+        self._pool = futures.ThreadPoolExecutor(max_workers=jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.Close()
+
+    def Exists(self, filename):
+        self._ScanSubdir(os.path.dirname(filename))
+        return filename in self.existing
+
+    def Write(self, filename, vcard, overwrite=False):
+        """Queues a vCard, or its serialized form, to be written.
+
+        Returns:
+          False if a file by that name already exists and overwrite is not
+          set, True otherwise.
+        """
+        with vcf_profile.Stage('write'):
+            if self.Exists(filename) and not overwrite:
+                logger.warning('File exists at "{}", skipping.'.format(
+                    filename))
+                self.skipped += 1
+                return False
+            self.existing.add(filename)
+            if not isinstance(vcard, (six.text_type, bytes)):
+                vcard = u(vcard.serialize())
+            path = os.path.join(self.output_dir, filename)
+            self._slots.acquire()
+            future = self._pool.submit(self._Write, filename, path, vcard)
+            future.add_done_callback(lambda _: self._slots.release())
+            return True
+
+    def _ScanSubdir(self, subdir):
+        if subdir in self._scanned_dirs:
+            return
+        self._scanned_dirs.add(subdir)
+        path = os.path.join(self.output_dir, subdir)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            return
+        self.existing.update(os.path.join(subdir, f)
+                             for f in os.listdir(path))
+
+    def Remove(self, filename):
+        """Deletes a file from the output directory, if it is there."""
+        if not self.Exists(filename):
+            return False
+        try:
+            os.unlink(os.path.join(self.output_dir, filename))
+        except OSError:
+            logger.error('Error removing file "{}".'.format(filename))
+            return False
+        self.existing.discard(filename)
+        return True
+
+    def _Write(self, filename, path, data):
+        try:
+            WriteFile(path, data, atomic=self.atomic)
+        except (IOError, OSError):
+            logger.error('Error writing to file "{}", skipping.'.format(path))
+            with self._lock:
+                self.failed += 1
+                self.failed_paths.add(filename)
+            return
+        logger.debug('Wrote %s', path)
+        with self._lock:
+            self.written += 1
+
+    def Close(self):
+        with vcf_profile.Stage('write', items=0):
+            self._pool.shutdown(wait=True)
+
+
+def AddArguments(parser):
+    parser.add_argument('--write_jobs',
+                        type=int,
+                        default=DEFAULT_WRITE_JOBS,
+                        help='Number of threads writing files')
+    parser.add_argument('--atomic',
+                        action='store_true',
+                        help='Write each file under a temporary name and '
+                             'rename it into place')